@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    catalogsync.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Incremental sync of the maps catalog.
+
+The catalog entries are identified by their endpoint. A catalog endpoint
+supporting deltas replies to a plain request with the full catalog and
+its version:
+
+    {"version": "42", "maps": [...]}
+
+and to a request with ?since=<version> with the changes since that
+version:
+
+    {"version": "43", "added": [...], "changed": [...], "removed": [endpoints]}
+
+An endpoint without deltas replies with the list of the maps, whatever
+the query string: the catalog is replaced and no version is stored.
+
+The local catalog store is a JSON file with the version and the maps.
+
+This module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import io
+import os
+import json
+from boundlessbasemaps import fileutils
+
+SINCE_PARAM = 'since'
+DELTA_KEYS = ('added', 'changed', 'removed')
+
+
+def apply_delta(maps, delta):
+    """Return the maps with the delta applied: the removed endpoints are
+    dropped, the changed entries replaced in place and the added ones
+    appended (or replaced if already there)"""
+    removed = set(delta.get('removed') or [])
+    updates = dict((m['endpoint'], m) for m in
+                   (delta.get('changed') or []) + (delta.get('added') or []))
+    result = []
+    for m in maps:
+        if m['endpoint'] in removed:
+            continue
+        result.append(updates.pop(m['endpoint'], m))
+    result.extend(m for m in (delta.get('added') or []) if m['endpoint'] in updates)
+    return result
+
+
+def delta_size(reply):
+    """Return the number of entries in a delta reply"""
+    return sum(len(reply.get(k) or []) for k in DELTA_KEYS)
+
+
+def apply_reply(maps, reply):
+    """Apply the catalog endpoint reply to the local maps (None if
+    there are none), return the new version, the new maps and
+    whether the reply was a delta.
+    Raise ValueError if the reply is not a catalog"""
+    if isinstance(reply, list):
+        return None, reply, False
+    if not isinstance(reply, dict):
+        raise ValueError("Not a catalog")
+    if isinstance(reply.get('maps'), list):
+        return reply.get('version'), reply['maps'], False
+    if maps is not None and any(k in reply for k in DELTA_KEYS):
+        return reply.get('version'), apply_delta(maps, reply), True
+    raise ValueError("Not a catalog")
+
+
+class CatalogStore(object):
+    """Local copy of a catalog and of its version, in the JSON file at path.
+    A plain list of maps (the catalog cache format before the deltas) is
+    read as a catalog without version"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def age(self, now):
+        return now - os.path.getmtime(self.path)
+
+    def load(self):
+        """Return the version and the maps, (None, None) if there is no
+        valid copy"""
+        try:
+            with io.open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None, None
+        if isinstance(data, list):
+            return None, data
+        if isinstance(data, dict) and isinstance(data.get('maps'), list):
+            return data.get('version'), data['maps']
+        return None, None
+
+    def save(self, version, maps):
+        fileutils.atomic_write(self.path, json.dumps({'version': version, 'maps': maps}))
+
+    def touch(self):
+        """Mark the copy as fresh, when the catalog did not change"""
+        os.utime(self.path, None)
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    cli.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Command line setup of the Basemaps default project, without the wizard.
+
+The plugins folder must be in the python path, for example:
+
+    PYTHONPATH=~/.qgis2/python/plugins python -m boundlessbasemaps.cli \\
+        --username me --password secret \\
+        --selected "Mapbox Streets###Recent Imagery" --visible "Mapbox Streets"
+
+A standalone QGIS application is initialized, the catalog is fetched (or
+read from the local cache if younger than --cache-ttl seconds), the
+authentication configuration is created and the default project is
+written together with the plugin settings.
+
+With --profiles, the default projects of many QGIS profiles are written
+in parallel, see provision.py for the format of the profiles file.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import os
+import sys
+import json
+import argparse
+
+from qgis.core import QgsApplication, QgsAuthManager
+from qgis.PyQt.QtCore import QCoreApplication, QSettings
+from boundlessbasemaps import (utils, perf, provision, fileutils, renderer, probe,
+                               fetchpolicy, federation, netfetch)
+from boundlessbasemaps.perf import timer
+from boundlessbasemaps.utils import (PROJECT_DEFAULT_TEMPLATE, PLUGIN_NAMESPACE,
+                                     BasemapsConfigError)
+
+SETTINGS_FILE = os.path.join(os.path.dirname(__file__), 'settings.json')
+DEFAULT_CACHE_TTL = 24 * 3600
+
+
+def plugin_setting(name):
+    """Return a plugin setting value, the default from settings.json is
+    returned if it was never stored. This does not require the plugin
+    (and qgiscommons2) to be loaded"""
+    settings = QSettings()
+    key = '%s/%s' % (PLUGIN_NAMESPACE, name)
+    if settings.contains(key):
+        return settings.value(key)
+    with open(SETTINGS_FILE) as f:
+        for setting in json.load(f):
+            if setting['name'] == name:
+                return setting['default']
+    return None
+
+
+def probe_timeout(args):
+    """Return the timeout of the health check, 0 if it was not requested
+    with --probe"""
+    if not args.probe:
+        return 0
+    if args.probe_timeout is not None:
+        return args.probe_timeout
+    return float(plugin_setting('probe_timeout') or probe.PROBE_TIMEOUT)
+
+
+def check_maps(maps, authcfg=None, timeout=probe.PROBE_TIMEOUT):
+    """Run the health check of the maps and print the failures,
+    return the names of the failed maps"""
+    if not timeout or not maps:
+        return []
+    results = probe.probe_maps(maps, netfetch.request_all, authcfg, timeout)
+    failed = probe.failed_maps(results)
+    for name in failed:
+        sys.stderr.write("Warning: '%s' failed the health check: %s\n" % (name, results[name]['error']))
+    for name in probe.unchecked_maps(results):
+        sys.stderr.write("Warning: '%s' was not checked, it did not answer in time\n" % name)
+    return failed
+
+
+def split_names(values):
+    """Flatten a list of '###' separated map names"""
+    names = []
+    for value in values or []:
+        names.extend([n for n in value.split('###') if n.strip() != ''])
+    return names
+
+
+def get_authcfg(authcfg=None, username=None, password=None, token_uri=None,
+                master_password=None):
+    """Return the id of a valid OAuth2 authcfg: the given one or a new one
+    created from username and password"""
+    authm = QgsAuthManager.instance()
+    if master_password and not authm.setMasterPassword(master_password, True):
+        raise BasemapsConfigError("Invalid authentication database master password")
+    if authcfg:
+        if utils.get_oauth_authcfg(authcfg) is None:
+            raise BasemapsConfigError("'%s' is not a valid OAuth2 authentication configuration" % authcfg)
+        return authcfg
+    if not username or not password:
+        raise BasemapsConfigError("Either an authcfg or username and password are required")
+    authcfg = utils.setup_oauth(username, password, token_uri)
+    if authcfg is None:
+        raise BasemapsConfigError("Could not create a valid authentication configuration!")
+    return authcfg
+
+
+def generate_default_project(maps, selected, visible, template, authcfg, lazy=False,
+                             entitlements=None):
+    """Return the default project content for the selected maps"""
+    available = set(m['name'] for m in maps)
+    missing = [n for n in selected if n not in available]
+    if missing:
+        raise BasemapsConfigError("Unknown maps: %s" % ', '.join(missing))
+    if not selected:
+        raise BasemapsConfigError("You need to select at least one base map!")
+    if not os.path.isfile(template):
+        raise BasemapsConfigError("The project template is missing or invalid: '%s'" % template)
+    selected = set(selected)
+    prj = utils.create_default_project([m for m in maps if m['name'] in selected],
+                                       visible, template, authcfg, lazy=lazy,
+                                       entitlements=entitlements)
+    if prj is None or prj == '':
+        raise BasemapsConfigError(
+            "Could not create a valid default project from the template '%s'!" % template)
+    return prj
+
+
+def write_default_project(prj, selected, visible, authcfg, backup=True):
+    """Write the default project and store the plugin settings,
+    return the path of the backup copy of the previous default project"""
+    try:
+        backup_path = utils.replace_default_project(prj, backup)
+    except (IOError, OSError, fileutils.LockTimeout) as e:
+        raise BasemapsConfigError("Could not write the default project on disk: %s" % e)
+    utils.store_plugin_settings(selected, visible, authcfg)
+    return backup_path
+
+
+def init_qgis(prefix_path, profile_dir=None):
+    """Initialize a standalone QGIS application, the settings are read and
+    written where QGIS (started with --configpath profile_dir) has them"""
+    # Set by the QGIS main, not by QgsApplication
+    QCoreApplication.setOrganizationName('QGIS')
+    QCoreApplication.setOrganizationDomain('qgis.org')
+    QCoreApplication.setApplicationName('QGIS3' if utils.QGIS3 else 'QGIS2')
+    if profile_dir:
+        QSettings.setDefaultFormat(QSettings.IniFormat)
+        QSettings.setPath(QSettings.IniFormat, QSettings.UserScope, profile_dir)
+    QgsApplication.setPrefixPath(prefix_path, True)
+    if profile_dir:
+        qgs = QgsApplication([], False, profile_dir)
+    else:
+        qgs = QgsApplication([], False)
+    qgs.initQgis()
+    return qgs
+
+
+def run(args):
+    maps_uri = args.maps_uri or plugin_setting('maps_uri')
+    format_preference = utils.parse_format_preference(plugin_setting('tile_formats'))
+    sources = fetchpolicy.split_uris(args.catalog_sources or plugin_setting('catalog_sources'))
+    with perf.span('cli.catalog'):
+        # The additional sources are fetched while the catalog is
+        fetcher = federation.SourceFetcher(sources, request=netfetch.request).start()
+        maps = utils.get_available_maps(maps_uri, args.cache_ttl, format_preference)
+        results = fetcher.wait()
+    for uri, source_maps, providers, error in results:
+        if error is not None:
+            sys.stderr.write("Warning: the catalog source '%s' could not be read: %s\n" % (uri, error))
+    if not maps:
+        sys.stderr.write("Warning: the catalog '%s' could not be read\n" % maps_uri)
+    # Merge whatever could be read
+    maps = utils.merge_sources(maps_uri, maps, None, results, format_preference)[0]
+    if not maps:
+        raise BasemapsConfigError("The list of available maps is empty!")
+    maps = renderer.apply_zoom_levels(maps, renderer.parse_zoom_levels(
+        args.zoom_levels or plugin_setting('zoom_levels')))
+    template = args.template or plugin_setting('project_template') or PROJECT_DEFAULT_TEMPLATE
+    if args.profiles:
+        return run_profiles(args, maps, template)
+    authcfg = None
+    token = None
+    entitlements = None
+    if not args.no_auth:
+        authcfg = get_authcfg(args.authcfg, args.username, args.password,
+                              args.token_uri or plugin_setting('token_uri'),
+                              args.master_password)
+        token = utils.request_authcfg_token(authcfg)
+        if token is not None:
+            entitlements = utils.entitlements_from_token(token)
+    if args.all:
+        accessible = utils.accessible_maps(utils.access_index(maps), entitlements)
+        selected = [m['name'] for m in maps if m['name'] in accessible]
+    else:
+        selected = split_names(args.selected)
+    visible = split_names(args.visible)
+    lazy = args.lazy or plugin_setting('lazy_layers') in (True, 'true')
+    check_maps([m for m in maps if m['name'] in set(selected)], authcfg, probe_timeout(args))
+    prj = generate_default_project(maps, selected, visible, template, authcfg, lazy,
+                                   entitlements)
+    backup_path = write_default_project(prj, selected, visible, authcfg, not args.overwrite)
+    if backup_path is not None:
+        print("A backup copy of the previous default project has been saved to %s" % backup_path)
+    print("Default project with %d basemaps written to %s" % (len(selected),
+                                                             utils.default_project_path()))
+
+
+def run_profiles(args, maps, template):
+    """Bulk provisioning of the profiles listed in args.profiles"""
+    profiles = provision.load_profiles(args.profiles, args.authcfg)
+    start = timer()
+    lazy = args.lazy or plugin_setting('lazy_layers') in (True, 'true')
+    results = provision.provision_profiles(maps, profiles, template, args.workers, lazy)
+    elapsed = timer() - start
+    for r in results:
+        print("%-20s %8d bytes  render %.3f s  write %.3f s  %s" % (
+            r['profile'], r['bytes'], r['render_s'], r['write_s'], r['path']))
+    print("%d profiles provisioned in %.3f s" % (len(results), elapsed))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'elapsed_s': elapsed, 'profiles': results}, f, indent=2)
+
+
+def parser():
+    p = argparse.ArgumentParser(description='Generate the Basemaps default project without the setup wizard')
+    p.add_argument('-s', '--selected', action='append', default=[],
+                   help="map to add to the default project, '###' separated lists are accepted, can be repeated")
+    p.add_argument('-v', '--visible', action='append', default=[],
+                   help="map visible by default, '###' separated lists are accepted, can be repeated")
+    p.add_argument('-a', '--all', action='store_true',
+                   help='add all the available maps included in the subscription')
+    p.add_argument('-t', '--template', help='project template, defaults to the plugin setting or the bundled template')
+    p.add_argument('-u', '--username', help='Connect username')
+    p.add_argument('-p', '--password', help='Connect password')
+    p.add_argument('--authcfg', help='id of an existing OAuth2 authentication configuration')
+    p.add_argument('--no-auth', action='store_true', help='do not use authentication (for testing)')
+    p.add_argument('--master-password', default=os.environ.get('QGIS_AUTH_MASTER_PASSWORD'),
+                   help='master password of the authentication database')
+    p.add_argument('--maps-uri', help='overrides the maps_uri plugin setting')
+    p.add_argument('--catalog-sources', help='overrides the catalog_sources plugin setting')
+    p.add_argument('--token-uri', help='overrides the token_uri plugin setting')
+    p.add_argument('--cache-ttl', type=float, default=DEFAULT_CACHE_TTL,
+                   help='max age in seconds of the cached catalog, 0 to always download it')
+    p.add_argument('--zoom-levels',
+                   help="per map zoom limits, '###' separated list of 'map name:zmin:zmax'")
+    p.add_argument('--lazy', action='store_true',
+                   help='add the hidden maps as placeholders loaded when checked')
+    p.add_argument('--probe', action='store_true',
+                   help='run the health check of the selected maps before writing the default project')
+    p.add_argument('--probe-timeout', type=float,
+                   help='seconds of the health check of --probe, defaults to the plugin setting')
+    p.add_argument('--overwrite', action='store_true',
+                   help='overwrite the current default project without a backup copy')
+    p.add_argument('--profile-dir',
+                   help='QGIS settings directory, as given to QGIS with --configpath')
+    p.add_argument('--profiles', help='JSON file describing many profiles to provision in parallel')
+    p.add_argument('--workers', type=int, help='number of worker processes for --profiles, defaults to the number of CPUs')
+    p.add_argument('--report', help='JSON file for the per-profile timings of --profiles')
+    p.add_argument('--prefix-path', default=os.environ.get('QGIS_PREFIX_PATH', '/usr'),
+                   help='QGIS installation prefix')
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    qgs = init_qgis(args.prefix_path, args.profile_dir)
+    try:
+        with perf.span('cli.run'):
+            run(args)
+    except BasemapsConfigError as e:
+        sys.stderr.write("Basemaps setup error: %s\n" % e)
+        return 1
+    finally:
+        qgs.exitQgis()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    federation.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Additional catalog sources, merged with the Basemaps catalog.
+
+A source is the URL of a catalog or the path of a local JSON file, with
+the list of the maps or an object with the maps and their providers:
+
+    {"maps": [...], "providers": [...]}
+
+The sources are fetched concurrently, each one in its own thread, and
+their results are collected as they arrive: a slow source does not
+delay the others. The merged catalog has one entry per endpoint (the
+first source listing an endpoint wins), every entry has the "source" it
+comes from. The maps of the additional sources are not authenticated
+with the Basemaps authcfg, unless they have "auth": true.
+
+The remote sources are downloaded with the request function given to
+SourceFetcher, netfetch.request in the plugin (through the QGIS network
+stack and its proxy settings), with urlopen() if there is none.
+
+This module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import io
+import json
+import threading
+
+try:
+    from urllib.request import urlopen
+    from queue import Queue, Empty
+except ImportError:  # Python 2
+    from urllib2 import urlopen
+    from Queue import Queue, Empty
+
+# Seconds a source can take
+SOURCE_TIMEOUT = 30
+
+
+def parse_source(j):
+    """Return the maps and the providers of a source document.
+    Raise ValueError if it is not a catalog"""
+    if isinstance(j, list):
+        return j, []
+    if isinstance(j, dict) and isinstance(j.get('maps'), list):
+        return j['maps'], j.get('providers') or []
+    raise ValueError("Not a catalog")
+
+
+def load_source(uri, timeout=SOURCE_TIMEOUT, request=None):
+    """Return the maps and the providers of the source at uri, the
+    remote sources are downloaded with request(url, timeout=timeout)
+    returning status, headers and body (see netfetch.request) or with
+    urlopen() if request is None"""
+    if not uri.startswith('http'):
+        with io.open(uri, encoding='utf-8') as f:
+            return parse_source(json.load(f))
+    if request is not None:
+        status, headers, body = request(uri, timeout=timeout)
+        if status != 200:
+            raise IOError("%s: HTTP error %d" % (uri, status))
+        return parse_source(json.loads(body.decode('utf-8')))
+    response = urlopen(uri, timeout=timeout)
+    try:
+        return parse_source(json.loads(response.read().decode('utf-8')))
+    finally:
+        response.close()
+
+
+def tag_source(maps, source, auth=True):
+    """Return copies of the maps with their source, without
+    authentication unless auth or their own "auth" is true"""
+    tagged = []
+    for m in maps:
+        m = dict(m, source=source)
+        if not auth:
+            m.setdefault('auth', False)
+        tagged.append(m)
+    return tagged
+
+
+def merge(catalogs):
+    """Merge catalogs, a list of (maps, providers), in order: the maps
+    are de-duplicated by endpoint and the providers by id"""
+    maps = []
+    providers = []
+    endpoints = set()
+    ids = set()
+    for catalog_maps, catalog_providers in catalogs:
+        for m in catalog_maps:
+            if m['endpoint'] not in endpoints:
+                endpoints.add(m['endpoint'])
+                maps.append(m)
+        for p in catalog_providers or []:
+            if p.get('id') not in ids:
+                ids.add(p.get('id'))
+                providers.append(p)
+    return maps, providers
+
+
+class SourceFetcher(object):
+    """Concurrent fetch of the catalog sources, the results are
+    (uri, maps, providers, error) tuples, maps and providers are tagged
+    with tag_source() and are None if error is not None. The remote
+    sources are downloaded with request, see load_source()"""
+
+    def __init__(self, uris, timeout=SOURCE_TIMEOUT, request=None):
+        self.uris = list(uris)
+        self.timeout = timeout
+        self.request = request
+        self._queue = Queue()
+        self._delivered = 0
+
+    def _fetch(self, uri):
+        try:
+            maps, providers = load_source(uri, self.timeout, self.request)
+            result = (uri, tag_source(maps, uri, False), providers, None)
+        except Exception as e:
+            result = (uri, None, None, "%s" % e)
+        self._queue.put(result)
+
+    def start(self):
+        for uri in self.uris:
+            thread = threading.Thread(target=self._fetch, args=(uri,))
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def completed(self):
+        """Return the results which arrived since the last call"""
+        results = []
+        while True:
+            try:
+                results.append(self._queue.get_nowait())
+            except Empty:
+                break
+        self._delivered += len(results)
+        return results
+
+    def finished(self):
+        return self._delivered == len(self.uris)
+
+    def wait(self):
+        """Wait for all the sources and return their results in the
+        order of the uris"""
+        results = {}
+        while len(results) + self._delivered < len(self.uris):
+            result = self._queue.get()
+            results[result[0]] = result
+        self._delivered = len(self.uris)
+        return [results[uri] for uri in self.uris if uri in results]
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    fetchpolicy.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Fetch policy of the BCS service calls: time budget, retries and circuit
+breaker.
+
+A call is given an overall time budget, the transient errors (timeouts,
+connection errors, HTTP 5xx and 429) are retried after a random delay
+up to an exponentially growing cap ("full jitter"), as long as the
+budget allows it.
+
+After FAILURE_THRESHOLD failed calls in a row, the circuit breaker of the
+endpoint opens: the calls fail immediately (and the callers use their
+cached data) for OPEN_SECONDS, then one call is let through to test the
+endpoint, the concurrent ones keep failing until it ends: any answer of
+the endpoint, an HTTP error too, closes the circuit, only a connection
+error or a timeout opens it again. The breakers are stored in a JSON
+file and survive the session.
+
+An endpoint can be a '###' separated list of mirrors. MirrorLatencies
+keeps an estimate of the latency of every mirror: the mirrors with
+unknown latency are raced (RACE_WIDTH at a time, the first valid reply
+wins and the other requests are cancelled), once all of them are known
+the calls go straight to the fastest one.
+
+The network call itself is a function passed to FetchPolicy.call(), this
+module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import io
+import json
+import time
+import random
+import threading
+from boundlessbasemaps import fileutils
+from boundlessbasemaps.perf import timer
+
+# Seconds a call can last, retries included
+DEFAULT_BUDGET = 30
+DEFAULT_RETRIES = 3
+# Retry delays cap: BASE_DELAY * 2 ** attempt, at most MAX_DELAY seconds
+BASE_DELAY = 0.5
+MAX_DELAY = 8
+# Failed calls in a row opening the circuit of an endpoint
+FAILURE_THRESHOLD = 3
+# Seconds an open circuit fails fast
+OPEN_SECONDS = 300
+# Mirrors requested at the same time
+RACE_WIDTH = 2
+# Weight of the last sample in the latency estimate of a mirror
+LATENCY_ALPHA = 0.3
+
+
+class FetchError(Exception):
+    """A call failed"""
+    pass
+
+
+class TransientError(FetchError):
+    """A call failed and can be retried"""
+    pass
+
+
+class TransportError(TransientError):
+    """The endpoint could not be reached or did not answer in time"""
+    pass
+
+
+class CircuitOpen(FetchError):
+    """The endpoint is known to be down, the call was not attempted"""
+    pass
+
+
+def split_uris(value):
+    """Return the list of the mirrors of a '###' separated value"""
+    return [u.strip() for u in (value or '').split('###') if u.strip()]
+
+
+def retry_delay(attempt, base=BASE_DELAY, cap=MAX_DELAY, rand=random.random):
+    """Return the random delay before the retry number attempt (from 0)"""
+    return rand() * min(cap, base * 2 ** attempt)
+
+
+class _JsonStates(object):
+    """Dictionary of states stored in the JSON file at path (in memory
+    only if path is None), shared by the processes"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._states = {}
+
+    def _load(self):
+        if self.path is None:
+            return self._states
+        try:
+            with io.open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _update(self, changes):
+        """Apply changes, a dictionary of key: state (None to delete)"""
+        self._modify(lambda states: self._apply(states, changes))
+
+    def _modify(self, change):
+        """Call change(states) with the current states, which it edits in
+        place, and store them, all under the locks. Return the result of
+        change, None if the states could not be stored"""
+        with self._lock:
+            if self.path is None:
+                return change(self._states)
+            try:
+                with fileutils.file_lock(self.path):
+                    states = self._load()
+                    result = change(states)
+                    fileutils.atomic_write(self.path, json.dumps(states, sort_keys=True))
+                    return result
+            except (IOError, OSError, fileutils.LockTimeout):
+                return None  # Not stored, the states are only an optimization
+
+    def _apply(self, states, changes):
+        for key, state in changes.items():
+            if state is None:
+                states.pop(key, None)
+            else:
+                states[key] = state
+
+
+class CircuitBreaker(_JsonStates):
+    """Circuit breakers of the endpoints, stored in the JSON file at path
+    (in memory only if path is None)"""
+
+    def __init__(self, path=None, threshold=FAILURE_THRESHOLD, open_seconds=OPEN_SECONDS,
+                 clock=time.time):
+        super(CircuitBreaker, self).__init__(path)
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.clock = clock
+
+    def state(self, key):
+        """Return 'closed', 'open' or 'half-open' (open, but the test
+        call is due)"""
+        return self._state(self._load().get(key))
+
+    def _state(self, state):
+        if state is None or state.get('opened') is None:
+            return 'closed'
+        if self.clock() - state['opened'] < self.open_seconds:
+            return 'open'
+        return 'half-open'
+
+    def allow(self, key):
+        """Return True if a call to the endpoint key can be attempted.
+        In half-open state only the first caller gets the test call: the
+        circuit is opened again while it is in flight"""
+        state = self.state(key)
+        if state != 'half-open':
+            return state == 'closed'
+
+        def claim(states):
+            if self._state(states.get(key)) != 'half-open':
+                return False
+            states[key] = dict(states[key], opened=self.clock())
+            return True
+        return self._modify(claim) is not False
+
+    def success(self, key):
+        if self._load().get(key) is not None:
+            self._update({key: None})
+
+    def failure(self, key, answered=False):
+        """Record a failed call, answered is True if the endpoint replied
+        with an error: the reply to the test call closes the circuit"""
+        def fail(states):
+            state = dict(states.get(key) or {})
+            if answered and state.get('opened') is not None:
+                states.pop(key, None)
+                return
+            state['failures'] = state.get('failures', 0) + 1
+            if state['failures'] >= self.threshold:
+                # Opened again by a failed test call
+                state['opened'] = self.clock()
+            states[key] = state
+        self._modify(fail)
+
+
+class MirrorLatencies(_JsonStates):
+    """Latency estimates (seconds) of the mirrors, stored in the JSON file
+    at path (in memory only if path is None)"""
+
+    def __init__(self, path=None, alpha=LATENCY_ALPHA, width=RACE_WIDTH):
+        super(MirrorLatencies, self).__init__(path)
+        self.alpha = alpha
+        self.width = width
+
+    def latency(self, uri):
+        return self._load().get(uri)
+
+    def record(self, samples):
+        """Update the estimates with samples, a dictionary of
+        mirror: latency"""
+        states = self._load()
+        changes = {}
+        for uri, latency in samples.items():
+            previous = states.get(uri)
+            if previous is None:
+                changes[uri] = latency
+            else:
+                changes[uri] = previous + self.alpha * (latency - previous)
+        if changes:
+            self._update(changes)
+
+    def rank(self, uris):
+        """Return the mirrors sorted by latency, the unknown ones first"""
+        states = self._load()
+        return sorted(uris, key=lambda u: (u in states, states.get(u)))
+
+    def race(self, uris):
+        """Return the mirrors to request at the same time: the fastest
+        one if all the latencies are known, else the first RACE_WIDTH of
+        rank()"""
+        ranked = self.rank(uris)
+        if self.latency(ranked[0]) is not None:
+            return ranked[:1]
+        return ranked[:self.width]
+
+
+class FetchPolicy(object):
+    """Time budget, retries and circuit breaker of the calls"""
+
+    def __init__(self, budget=DEFAULT_BUDGET, retries=DEFAULT_RETRIES, breaker=None,
+                 sleep=time.sleep, clock=timer):
+        self.budget = budget
+        self.retries = retries
+        self.breaker = breaker
+        self.sleep = sleep
+        self.clock = clock
+
+    def call(self, key, fetch, budget=None):
+        """Call fetch(timeout) and return its result, timeout is the
+        remaining time budget in seconds. fetch raises TransientError on
+        retryable errors (TransportError if the endpoint did not answer),
+        any other FetchError is not retried.
+        key identifies the endpoint for the circuit breaker.
+        Raise CircuitOpen if the endpoint is known to be down, else the
+        last error once the retries or the budget are exhausted"""
+        if self.breaker is not None and not self.breaker.allow(key):
+            raise CircuitOpen("%s is not available, retry later" % key)
+        deadline = self.clock() + (budget or self.budget)
+        error = TransportError("%s: no time left" % key)
+        for attempt in range(self.retries + 1):
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                break
+            try:
+                result = fetch(remaining)
+            except TransientError as e:
+                error = e
+                delay = retry_delay(attempt)
+                if attempt == self.retries or self.clock() + delay >= deadline:
+                    break
+                self.sleep(delay)
+                continue
+            except CircuitOpen:
+                raise
+            except FetchError:
+                # The endpoint answered
+                if self.breaker is not None:
+                    self.breaker.success(key)
+                raise
+            if self.breaker is not None:
+                self.breaker.success(key)
+            return result
+        if self.breaker is not None:
+            self.breaker.failure(key, not isinstance(error, TransportError))
+        raise error
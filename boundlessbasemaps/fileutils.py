@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    fileutils.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+File helpers, standard library only.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import os
+import time
+import tempfile
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class LockTimeout(Exception):
+    """The lock could not be acquired in time"""
+    pass
+
+
+def _try_lock(f):
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(path, timeout=30, poll=0.05):
+    """Hold an advisory lock on path (a path + '.lock' file is used) for the
+    duration of the with block, other processes using the same lock wait
+    up to timeout seconds, then LockTimeout is raised"""
+    f = open(path + '.lock', 'a+')
+    try:
+        deadline = time.time() + timeout
+        while not _try_lock(f):
+            if time.time() > deadline:
+                raise LockTimeout("Timeout waiting for the lock on %s" % path)
+            time.sleep(poll)
+        try:
+            yield
+        finally:
+            _unlock(f)
+    finally:
+        f.close()
+
+
+# The umask can only be read by setting it, once: the writes can run in
+# many threads
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def atomic_write(path, content):
+    """Write content to path atomically: the data are written and flushed
+    to a temporary file in the same directory which is then renamed. The
+    file keeps the mode of the one it replaces, a new file gets the
+    default mode of the umask"""
+    if not isinstance(content, bytes):
+        content = content.encode('utf-8')
+    directory = os.path.dirname(path) or '.'
+    fd, tmp = tempfile.mkstemp(prefix='.%s-' % os.path.basename(path), dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, _file_mode(path))
+        _replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    _fsync_dir(directory)
+
+
+def _file_mode(path):
+    """Return the permission bits of path, those of a new file if it
+    does not exist"""
+    try:
+        return os.stat(path).st_mode & 0o7777
+    except OSError:
+        return 0o666 & ~_UMASK
+
+
+def _fsync_dir(directory):
+    """Flush the entries of directory, so that a rename is durable. Not
+    supported on Windows"""
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _replace(src, dst):
+    try:
+        os.replace(src, dst)
+    except AttributeError:  # Python 2
+        if os.name == 'nt' and os.path.exists(dst):
+            os.unlink(dst)
+        os.rename(src, dst)
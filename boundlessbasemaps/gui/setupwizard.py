@@ -37,8 +37,52 @@ try:
 except:
     from qgis.PyQt.QtWidgets import QApplication
 
-from qgis.PyQt.QtCore import Qt, QSize
-from boundlessbasemaps import utils
+from qgis.PyQt.QtCore import Qt, QSize, QTimer, QThread, pyqtSignal
+from boundlessbasemaps import utils, perf, federation, fetchpolicy, netfetch
+
+
+def request_account_token(credentials):
+    """Request a token with the credentials returned by
+    MapSelectionPage.credentials(), return the token response, None on
+    failure"""
+    if credentials is None:
+        return None
+    return utils.request_token(*credentials)
+
+
+class CatalogFetch(QThread):
+    """Fetch the live catalog, the providers and the entitlements of the
+    account off the GUI thread. The fetched signal delivers the maps, the
+    providers and the entitlements, the maps are None on failure"""
+
+    fetched = pyqtSignal(object, object, object)
+
+    # Keep the running threads alive when their page goes away
+    _running = set()
+
+    def __init__(self, settings, credentials, format_preference):
+        super(CatalogFetch, self).__init__()
+        self.maps_uri = settings.get('maps_uri')
+        self.providers_uri = settings.get('providers_uri')
+        self.credentials = credentials
+        self.format_preference = format_preference
+        self.finished.connect(lambda: CatalogFetch._running.discard(self))
+
+    def start(self):
+        CatalogFetch._running.add(self)
+        super(CatalogFetch, self).start()
+        return self
+
+    def run(self):
+        maps = utils.get_available_maps(self.maps_uri,
+                                        format_preference=self.format_preference)
+        if not maps:
+            self.fetched.emit(None, None, None)
+            return
+        providers = utils.get_available_providers(self.providers_uri)
+        token = request_account_token(self.credentials)
+        self.fetched.emit(maps, providers,
+                          utils.entitlements_from_token(token) if token else None)
 
 
 class WizardPage(QWizardPage):
@@ -62,6 +106,15 @@ class WizardPage(QWizardPage):
     def set_error(self, message):
         self.error_msg = message
 
+    def show_error(self, message):
+        """Set the error message and show it in the page"""
+        self.set_error(message)
+        self.error_widget.setText("<b style='color:red'>%s</b>" % self.error_msg)
+        if not self.layout():
+                self.setLayout(QVBoxLayout())
+        self.layout().addWidget(self.error_widget)
+        self.error_widget.show()
+
     def initializePage(self):
         """This will call setup()"""
         self.error_widget.hide()
@@ -71,11 +124,7 @@ class WizardPage(QWizardPage):
             pass
         # Check for error messages
         if self.error() is not None:
-            self.error_widget.setText("<b style='color:red'>%s</b>" % self.error_msg)
-            if not self.layout():
-                    self.setLayout(QVBoxLayout())
-            self.layout().addWidget(self.error_widget)
-            self.error_widget.show()
+            self.show_error(self.error())
 
     def add_watermark(self):
         metrics = QApplication.fontMetrics().height()
@@ -179,10 +228,28 @@ class MapSelectionPage(WizardPage):
         self.map_choices = []
         self.map_visible_choices = []
         self.available_maps = None
+        self.available_providers = None
+        # The Basemaps catalog and the results of the additional sources
+        self.catalog_maps = None
+        self.catalog_providers = None
+        self.source_fetcher = None
+        self.source_results = {}
+        self.source_timer = None
+        self.entitlements = None
+        # The live catalog being fetched in background
+        self.catalog_fetch = None
+        self.catalog_failed = False
+        # The choices of the settings, until the first maps are listed
+        self.selected = []
+        self.visible = []
         self.maplist_layout = QVBoxLayout()
         label = QLabel(self.tr("Please select which base maps you want to be added to your new projects, check the \"Visible\" checkbox if you want the base map to be loaded by default."))
         label.setWordWrap(True)
         self.maplist_layout.addWidget(label)
+        self.status_label = QLabel()
+        self.status_label.setWordWrap(True)
+        self.status_label.hide()
+        self.maplist_layout.addWidget(self.status_label)
         self.maplist = QGroupBox()
         #self.maplist.setTitle(self.tr("Select your base maps!"))
         self.maplist.setFlat(True)
@@ -202,96 +269,221 @@ class MapSelectionPage(WizardPage):
     def initializePage(self):
         # Get available maps
         if self.available_maps is None:
-            selected = [e for e in self.settings.get('selected', "").split('###') if e != '']
-            visible = [e for e in self.settings.get('visible', "").split('###') if e != '']
-            self.available_maps = utils.get_available_maps(self.settings.get('maps_uri'))
-            if not self.available_maps:
-                self.set_error(self.tr("There was an error fetching the list of maps from the server! Please check your internet connection and retry later!"))
-            self.available_providers = utils.get_available_providers(self.settings.get('providers_uri'))
-            if not self.available_providers:
-                # self.set_error(self.tr("There was an error fetching the list of providers from the server! Please check your internet connection and retry later!"))
-                pass  #  Not a critical error
-
-            if not self.error():
-                try:
-                    self.settings['available_maps'] = self.available_maps
-                    self.settings['available_providers'] = self.available_providers
-                    self.map_choices = []
-                    if self.available_maps is not None and len(self.available_maps):
-                        # Collect providers
-                        providers = set()
-                        for m in self.available_maps:
-                            p = m['provider'] if 'provider' in m and m['provider'] else m['attribution']
-                            if p not in providers:
-                                providers.add(p)
-                        providers = list(providers)
-                        providers.sort()
-                        # Build the tree
-                        self.tree = QTreeWidget()
-                        self.tree.setColumnCount(2)
-                        self.tree.setHeaderLabels([self.tr("Available maps"), self.tr("Visible")])
-                        root = QTreeWidgetItem(self.tree)
-                        root.setText(0, self.tr("All maps"))
-                        root.setFlags(root.flags() | Qt.ItemIsTristate | Qt.ItemIsUserCheckable)
-                        root.setCheckState(0, Qt.Unchecked)
-
-                        for p in providers:
-                            parent = QTreeWidgetItem(root)
-                            parent.setText(0, self._get_provider_display(p))
-                            parent.setFlags(parent.flags() | Qt.ItemIsTristate | Qt.ItemIsUserCheckable)
-                            for m in self.available_maps:
-                                if (m['provider'] if 'provider' in m and m['provider'] else m['attribution']) == p:
-                                    child = QTreeWidgetItem(parent)
-                                    child.setFlags(child.flags() | Qt.ItemIsUserCheckable)
-                                    child.setText(0, m['name'])
-                                    viscb = QCheckBox()
-                                    if len(visible):
-                                        viscb.setChecked(m['name'] in visible)
-                                    else:
-                                        viscb.setChecked(False)
-                                    w = QWidget()
-                                    l = QHBoxLayout()
-                                    l.setAlignment(Qt.AlignCenter)
-                                    l.addWidget(viscb)
-                                    w.setLayout(l)
-                                    self.tree.setItemWidget(child, 1, w)
-                                    self.map_visible_choices.append(viscb)
-                                    if m['description']:
-                                        child.setToolTip(0, m['description'])
-                                    if len(selected):
-                                        if m['name'] in selected:
-                                            child.setCheckState(0, Qt.Checked)
-                                        else:
-                                            child.setCheckState(0, Qt.Unchecked)
-                                    else:
-                                        child.setCheckState(0, Qt.Checked)
-                                    self.map_choices.append(child)
-
-                        def set_visibility_state():
-                            '''Control the status of the visibility widgets'''
-                            i = 0
-                            for w in self.map_choices:
-                                self.map_visible_choices[i].setEnabled(self.map_choices[i].checkState(0) == Qt.Checked)
-                                i += 1
-
-                        set_visibility_state()
-                        self.tree.model().dataChanged.connect(set_visibility_state)
-                        self.tree.model().dataChanged.connect(self.completeChanged.emit)
-                        self.tree.header().setResizeMode(0, QHeaderView.ResizeToContents)
-                        self.tree.headerItem().setTextAlignment(1, Qt.AlignCenter)
-                        self.tree.expandAll()
-                        self.maplist_layout.addWidget(self.tree)
-                    else:
-                        self.set_error(self.tr("The list of available maps is empty!"))
-                except Exception as e:
-                    self.set_error(self.tr("There was an error fetching the list of maps from the server! Please check your internet connection and retry later! Error: %s") % e)
-
+            self.selected = [e for e in self.settings.get('selected', "").split('###') if e != '']
+            self.visible = [e for e in self.settings.get('visible', "").split('###') if e != '']
+            # The Basemaps catalog and the additional sources are fetched
+            # in background and merged as they arrive, the local catalog
+            # (or the bundled snapshot, or the catalog file) is shown
+            # meanwhile
+            self.fetch_sources()
+            self.catalog_maps, self.catalog_providers = utils.get_local_catalog(
+                self.settings.get('maps_uri'), self.settings.get('providers_uri'),
+                self.format_preference())
+            self.merge_catalogs()
+            self.build_tree(self.selected, self.visible)
             self.setLayout(self.maplist_layout)
             super(MapSelectionPage, self).initializePage()
+            self.catalog_fetch = CatalogFetch(self.settings, self.credentials(),
+                                              self.format_preference())
+            self.catalog_fetch.fetched.connect(self.reconcile)
+            self.catalog_fetch.start()
+            if self.source_fetcher is not None:
+                self.source_timer.start()
+            self.update_status()
+
+    def format_preference(self):
+        return utils.parse_format_preference(self.settings.get('tile_formats'))
+
+    def fetch_sources(self):
+        """Start fetching the additional catalog sources in background"""
+        uris = fetchpolicy.split_uris(self.settings.get('catalog_sources'))
+        if not uris:
+            return
+        self.source_fetcher = federation.SourceFetcher(uris, request=netfetch.request).start()
+        self.source_timer = QTimer(self)
+        self.source_timer.setInterval(200)
+        self.source_timer.timeout.connect(self.collect_sources)
+
+    def merge_catalogs(self):
+        """Merge the Basemaps catalog with the sources fetched so far,
+        whatever could be read"""
+        results = []
+        if self.source_fetcher is not None:
+            results = [self.source_results[uri] for uri in self.source_fetcher.uris
+                       if uri in self.source_results]
+        self.available_maps, self.available_providers = utils.merge_sources(
+            self.settings.get('maps_uri'), self.catalog_maps, self.catalog_providers,
+            results, self.format_preference())
+        self.settings['available_maps'] = self.available_maps
+        self.settings['available_providers'] = self.available_providers
+
+    def collect_sources(self):
+        """Add the maps of the sources which arrived to the tree"""
+        results = self.source_fetcher.completed()
+        if self.source_fetcher.finished():
+            self.source_timer.stop()
+        if not results:
+            return
+        for result in results:
+            self.source_results[result[0]] = result
+        if any(error is None for uri, maps, providers, error in results):
+            self.merge_catalogs()
+            self.rebuild_tree()
+        self.update_status()
+
+    def update_status(self):
+        """Show the state of the catalog downloads, and the error if
+        none of the catalogs has maps"""
+        messages = []
+        if self.catalog_fetch is not None:
+            if self.catalog_maps:
+                messages.append(self.tr("Updating the list of maps..."))
+            else:
+                messages.append(self.tr("Downloading the list of maps..."))
+        elif self.catalog_failed:
+            if self.catalog_maps:
+                messages.append(self.tr("The server could not be reached, the list of maps may be outdated."))
+            else:
+                messages.append(self.tr("The Basemaps catalog could not be downloaded."))
+        failed = ["%s (%s)" % (uri, error) for uri, maps, providers, error
+                  in self.source_results.values() if error is not None]
+        if failed:
+            messages.append(self.tr("Some catalog sources could not be read: %s") % ', '.join(failed))
+        self.status_label.setText(' '.join(messages))
+        self.status_label.setVisible(bool(messages))
+        pending = self.catalog_fetch is not None or (
+            self.source_fetcher is not None and not self.source_fetcher.finished())
+        if not pending and not self.available_maps and self.error() is None:
+            self.show_error(self.tr("There was an error fetching the list of maps from the server! Please check your internet connection and retry later!"))
+
+    @perf.timed('wizard.reconcile')
+    def reconcile(self, maps, providers, entitlements):
+        """Replace the local catalog shown by the page with the live one
+        fetched by CatalogFetch"""
+        self.catalog_fetch = None
+        self.catalog_failed = not maps
+        if maps:
+            self.catalog_maps = maps
+            self.catalog_providers = providers or self.catalog_providers or []
+            self.entitlements = entitlements
+            self.settings['entitlements'] = entitlements
+            self.merge_catalogs()
+            self.rebuild_tree()
+        self.update_status()
+        self.completeChanged.emit()
+
+    def rebuild_tree(self):
+        """Build the tree again from the available maps, keeping the
+        choices of the user"""
+        if self.tree is None:
+            return
+        if self.map_choices:
+            selected = [c.text(0) for c in self.map_choices if c.checkState(0) == Qt.Checked]
+            visible = [self.map_choices[i].text(0) for i, cb in enumerate(self.map_visible_choices)
+                       if cb.isChecked()]
+        else:
+            selected, visible = self.selected, self.visible
+        self.maplist_layout.removeWidget(self.tree)
+        self.tree.deleteLater()
+        self.map_choices = []
+        self.map_visible_choices = []
+        self.build_tree(selected, visible)
+        self.completeChanged.emit()
+
+    def credentials(self):
+        """Return the token URI, the username and the password of the
+        account, None if there are none. The authcfg is read here, on the
+        GUI thread: QgsAuthManager is not thread safe"""
+        if self.settings.get('authcfg') and self.field('use_current_authcfg'):
+            return utils.authcfg_credentials(self.settings.get('authcfg'))
+        username = self.field('username') or self.settings.get('username')
+        password = self.field('password') or self.settings.get('password')
+        if username and password:
+            return self.settings.get('token_uri'), username, password
+        return None
+
+    def build_tree(self, selected, visible):
+        """Build the tree of available maps grouped by provider"""
+        with perf.span('wizard.tree_build', items=len(self.available_maps)):
+            # Collect providers
+            providers = set()
+            for m in self.available_maps:
+                p = m['provider'] if 'provider' in m and m['provider'] else m['attribution']
+                if p not in providers:
+                    providers.add(p)
+            providers = list(providers)
+            providers.sort()
+            accessible = utils.accessible_maps(utils.access_index(self.available_maps),
+                                               self.entitlements)
+            hide_inaccessible = self.settings.get('hide_inaccessible')
+            # Build the tree
+            self.tree = QTreeWidget()
+            self.tree.setColumnCount(2)
+            self.tree.setHeaderLabels([self.tr("Available maps"), self.tr("Visible")])
+            root = QTreeWidgetItem(self.tree)
+            root.setText(0, self.tr("All maps"))
+            root.setFlags(root.flags() | Qt.ItemIsTristate | Qt.ItemIsUserCheckable)
+            root.setCheckState(0, Qt.Unchecked)
+
+            for p in providers:
+                parent = QTreeWidgetItem(root)
+                parent.setText(0, self._get_provider_display(p))
+                parent.setFlags(parent.flags() | Qt.ItemIsTristate | Qt.ItemIsUserCheckable)
+                for m in self.available_maps:
+                    if (m['provider'] if 'provider' in m and m['provider'] else m['attribution']) == p:
+                        if m['name'] not in accessible:
+                            if not hide_inaccessible:
+                                # Greyed out, not in map_choices
+                                child = QTreeWidgetItem(parent)
+                                child.setText(0, m['name'])
+                                child.setFlags(child.flags() & ~Qt.ItemIsEnabled & ~Qt.ItemIsUserCheckable)
+                                child.setToolTip(0, self.tr("This map is not included in your subscription"))
+                            continue
+                        child = QTreeWidgetItem(parent)
+                        child.setFlags(child.flags() | Qt.ItemIsUserCheckable)
+                        child.setText(0, m['name'])
+                        viscb = QCheckBox()
+                        if len(visible):
+                            viscb.setChecked(m['name'] in visible)
+                        else:
+                            viscb.setChecked(False)
+                        w = QWidget()
+                        l = QHBoxLayout()
+                        l.setAlignment(Qt.AlignCenter)
+                        l.addWidget(viscb)
+                        w.setLayout(l)
+                        self.tree.setItemWidget(child, 1, w)
+                        self.map_visible_choices.append(viscb)
+                        if m['description']:
+                            child.setToolTip(0, m['description'])
+                        if len(selected):
+                            if m['name'] in selected:
+                                child.setCheckState(0, Qt.Checked)
+                            else:
+                                child.setCheckState(0, Qt.Unchecked)
+                        else:
+                            child.setCheckState(0, Qt.Checked)
+                        self.map_choices.append(child)
+
+            def set_visibility_state():
+                '''Control the status of the visibility widgets'''
+                i = 0
+                for w in self.map_choices:
+                    self.map_visible_choices[i].setEnabled(self.map_choices[i].checkState(0) == Qt.Checked)
+                    i += 1
+
+            set_visibility_state()
+            self.tree.model().dataChanged.connect(set_visibility_state)
+            self.tree.model().dataChanged.connect(self.completeChanged.emit)
+            self.tree.header().setResizeMode(0, QHeaderView.ResizeToContents)
+            self.tree.headerItem().setTextAlignment(1, Qt.AlignCenter)
+            self.tree.expandAll()
+            self.maplist_layout.addWidget(self.tree)
 
     def isComplete(self):
-        """We need at least one map"""
-        return super(MapSelectionPage, self).isComplete() and len([c for c in self.map_choices if c.checkState(0) == Qt.Checked])
+        """We need at least one map and the live catalog"""
+        return (super(MapSelectionPage, self).isComplete() and self.catalog_fetch is None and
+                len([c for c in self.map_choices if c.checkState(0) == Qt.Checked]))
 
     def nextId(self):
         if self.error() is not None:
@@ -405,12 +597,17 @@ class SetupWizard(QWizard):
     - maps_uri_: mandatory
     - providers_uri_: mandatory
     - project_template: optional
+    - tile_formats: optional ('###' delimited list of preferred tile formats)
+    - hide_inaccessible: optional (hide the maps not in the subscription)
+    - catalog_sources: optional ('###' delimited list of additional catalog
+      URLs or JSON files, see federation.py)
 
     Additional returned values in settings:
     - has_error: this is the only available setting in case of errors
     - available_maps
     - available_providers
     - use_current_authcfg
+    - entitlements (None if unknown)
 
     """
 
@@ -450,6 +647,7 @@ class SetupWizard(QWizard):
         #self.bg = QPixmap(os.path.join(imgpath, "wizard_background.png"))
         #self.setPixmap(QWizard.BackgroundPixmap, self.bg)
 
+    @perf.timed('wizard.accept')
     def accept(self):
         """Collect user choices and update the settings dictionary
         The caller is responsible for the processing"""
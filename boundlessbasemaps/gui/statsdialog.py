@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    statsdialog.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Basemaps statistics panel
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+from qgis.PyQt.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QTreeWidget,
+                                 QTreeWidgetItem, QHeaderView, QPushButton,
+                                 QFileDialog, QMessageBox, QDialogButtonBox)
+from qgis.PyQt.QtCore import Qt
+
+
+def _ms(seconds):
+    return '' if seconds is None else '%d ms' % round(seconds * 1000)
+
+
+def _ratio(value):
+    return '' if value is None else '%.0f%%' % (value * 100)
+
+
+def _size(value):
+    return '%.1f MB' % (value / 1048576.0)
+
+
+def _throughput(value):
+    return '' if value is None else '%.0f kB/s' % (value / 1024.0)
+
+
+class StatsDialog(QDialog):
+    """Tile traffic statistics per provider and layer, stats is a
+    tilestats.TileStats instance"""
+
+    COLUMNS = (('Provider / map', None),
+               ('Requests', lambda s: '%d' % s['requests']),
+               ('Cache hits', lambda s: _ratio(s['hit_ratio'])),
+               ('Errors', lambda s: '%d' % s['errors']),
+               ('Synthesized', lambda s: '%d' % s['synthesized']),
+               ('Throttled', lambda s: '%d' % s['throttled']),
+               ('Data', lambda s: _size(s['bytes'])),
+               ('Throughput', lambda s: _throughput(s['throughput'])),
+               ('p50', lambda s: _ms(s['p50'])),
+               ('p95', lambda s: _ms(s['p95'])),
+               ('p99', lambda s: _ms(s['p99'])))
+
+    def __init__(self, stats, parent=None):
+        super(StatsDialog, self).__init__(parent)
+        self.stats = stats
+        self.setWindowTitle(self.tr("Basemaps statistics"))
+        self.tree = QTreeWidget()
+        self.tree.setColumnCount(len(self.COLUMNS))
+        self.tree.setHeaderLabels([self.tr(c[0]) for c in self.COLUMNS])
+
+        refresh = QPushButton(self.tr("Refresh"))
+        refresh.clicked.connect(self.refresh)
+        export = QPushButton(self.tr("Export..."))
+        export.clicked.connect(self.export)
+        reset = QPushButton(self.tr("Reset"))
+        reset.clicked.connect(self.reset)
+        buttons = QDialogButtonBox(QDialogButtonBox.Close)
+        buttons.rejected.connect(self.reject)
+
+        hbox = QHBoxLayout()
+        hbox.addWidget(refresh)
+        hbox.addWidget(export)
+        hbox.addWidget(reset)
+        hbox.addStretch()
+        hbox.addWidget(buttons)
+        layout = QVBoxLayout()
+        layout.addWidget(self.tree)
+        layout.addLayout(hbox)
+        self.setLayout(layout)
+        self.resize(800, 400)
+        self.refresh()
+
+    def _add_item(self, parent, name, summary):
+        item = QTreeWidgetItem(parent)
+        item.setText(0, name)
+        for i, (label, fmt) in enumerate(self.COLUMNS[1:], 1):
+            item.setText(i, fmt(summary))
+            item.setTextAlignment(i, Qt.AlignRight | Qt.AlignVCenter)
+        return item
+
+    def refresh(self):
+        self.stats.flush()
+        report = self.stats.report()
+        self.tree.clear()
+        for p in report['providers']:
+            parent = self._add_item(self.tree, p['provider'], p)
+            for l in report['layers']:
+                if l['provider'] == p['provider']:
+                    self._add_item(parent, l['layer'], l)
+        self.tree.expandAll()
+        self.tree.header().setResizeMode(0, QHeaderView.ResizeToContents)
+
+    def export(self):
+        path = QFileDialog.getSaveFileName(self, self.tr("Export the Basemaps statistics"),
+                                           'basemaps_statistics.json', self.tr("JSON files (*.json)"))
+        if isinstance(path, tuple):  # QGIS 3
+            path = path[0]
+        if not path:
+            return
+        try:
+            self.stats.export(path)
+        except (IOError, OSError) as e:
+            QMessageBox.warning(self, self.tr("Basemaps statistics"),
+                                self.tr("Could not export the statistics: %s") % e)
+
+    def reset(self):
+        if QMessageBox.question(self, self.tr("Basemaps statistics"),
+                                self.tr("Delete all the Basemaps statistics?"),
+                                QMessageBox.Yes | QMessageBox.No) == QMessageBox.Yes:
+            self.stats.reset()
+            self.refresh()
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    netfetch.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Blocking HTTP requests through the QGIS network stack: single requests
+for the worker threads of the plugin (the tile proxy threads, for
+example) and concurrent requests sharing a deadline (the health probe).
+
+QgsNetworkAccessManager.instance() returns a manager for the calling
+thread, configured with the proxy, SSL and cache settings of QGIS, and
+the requests are authorized with QgsAuthManager like the QGIS providers
+do. The requests wait in a local event loop of the calling thread, the
+GUI keeps processing its events meanwhile.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import socket
+from qgis.PyQt.QtCore import QEventLoop, QTimer, QUrl
+from qgis.PyQt.QtNetwork import QNetworkRequest
+from qgis.core import QgsNetworkAccessManager, QgsAuthManager
+from boundlessbasemaps.perf import timer
+
+DEFAULT_TIMEOUT = 30
+
+
+def _text(value):
+    value = value.data()
+    return value.decode('latin-1') if isinstance(value, bytes) else value
+
+
+def _request(url, headers=None, authcfg=None):
+    """Return the QNetworkRequest of url, raise socket.error if the
+    authcfg is not available"""
+    req = QNetworkRequest(QUrl(url))
+    for k, v in (headers or {}).items():
+        req.setRawHeader(k.encode('ascii'), v.encode('utf-8'))
+    if authcfg and not QgsAuthManager.instance().updateNetworkRequest(req, authcfg):
+        raise socket.error("%s: the authentication configuration %s is not available" % (
+            url, authcfg))
+    return req
+
+
+def _response(url, reply):
+    """Return status, headers and body of a finished reply, raise
+    socket.error if there is no HTTP response"""
+    status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+    if status is None:
+        raise socket.error("%s: %s" % (url, reply.errorString()))
+    return (int(status), [(_text(k), _text(v)) for k, v in reply.rawHeaderPairs()],
+            reply.readAll().data())
+
+
+def _deadline_timer(loop, timeout):
+    deadline = QTimer()
+    deadline.setSingleShot(True)
+    deadline.timeout.connect(loop.quit)
+    deadline.start(int(timeout * 1000))
+    return deadline
+
+
+def request(url, headers=None, authcfg=None, timeout=DEFAULT_TIMEOUT):
+    """GET url with the request headers (a dictionary), authorized with
+    authcfg if not None. Return status, headers ((name, value) list) and
+    body. Raise socket.error if there is no HTTP response, socket.timeout
+    after timeout seconds"""
+    reply = QgsNetworkAccessManager.instance().get(_request(url, headers, authcfg))
+    try:
+        loop = QEventLoop()
+        reply.finished.connect(loop.quit)
+        deadline = _deadline_timer(loop, timeout)
+        if not reply.isFinished():
+            loop.exec_()
+        deadline.stop()
+        if not reply.isFinished():
+            reply.abort()
+            raise socket.timeout("%s: timeout" % url)
+        return _response(url, reply)
+    finally:
+        reply.deleteLater()
+
+
+def request_all(requests, timeout=DEFAULT_TIMEOUT):
+    """GET the (url, authcfg) requests concurrently, within timeout
+    seconds. Return, for each request, its status, headers, body and
+    latency (seconds), the socket.error if there was no HTTP response,
+    or None if it did not finish in time"""
+    loop = QEventLoop()
+    start = timer()
+    results = [None] * len(requests)
+    replies = {}
+    for i, (url, authcfg) in enumerate(requests):
+        try:
+            reply = QgsNetworkAccessManager.instance().get(_request(url, authcfg=authcfg))
+        except socket.error as e:
+            results[i] = e
+            continue
+        reply.finished.connect(loop.quit)
+        replies[i] = reply
+    deadline = _deadline_timer(loop, timeout)
+    pending = dict(replies)
+    try:
+        while pending and deadline.isActive():
+            loop.exec_()
+            for i, reply in list(pending.items()):
+                if not reply.isFinished():
+                    continue
+                del pending[i]
+                try:
+                    results[i] = _response(requests[i][0], reply) + (timer() - start,)
+                except socket.error as e:
+                    results[i] = e
+        deadline.stop()
+    finally:
+        for reply in pending.values():
+            reply.abort()
+        for reply in replies.values():
+            reply.deleteLater()
+    return results
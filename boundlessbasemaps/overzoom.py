@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    overzoom.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Local synthesis of the tiles the tile servers cannot serve.
+
+Past the maximum zoom of a provider, or when the tile servers cannot be
+reached, the tile proxy asks the synthesizer for the tile: the nearest
+ancestor tile in the shared tile cache (at most MAX_LEVELS levels up) is
+cropped to the area of the tile and scaled up. The decoded ancestors are
+kept in a LRU of DECODED_TILES images, because the neighbour tiles are
+synthesized from the same ancestor.
+
+QGIS does not request the tiles past the zmax of a layer: when the proxy
+synthesizes the tiles, the plugin raises the zmax and the scale based
+visibility of the routed layers by MAX_LEVELS for the session (see
+tileproxy.routed_source()), the saved projects keep the original ones.
+
+The synthesized tiles are not cached, the real tiles replace them as soon
+as the tile servers serve them.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import threading
+from collections import OrderedDict
+from qgis.PyQt.QtCore import Qt, QBuffer, QByteArray, QIODevice
+from qgis.PyQt.QtGui import QImage
+
+# Zoom levels searched for an ancestor
+MAX_LEVELS = 6
+# Decoded ancestors kept in memory
+DECODED_TILES = 64
+JPEG_QUALITY = 90
+
+
+class Overzoom(object):
+    """Tile synthesizer from the ancestors in store, a
+    tilestore.TileStore instance. The instances are callables with the
+    signature of the tile proxy synthesize argument"""
+
+    def __init__(self, store, max_levels=MAX_LEVELS, decoded_tiles=DECODED_TILES):
+        self.store = store
+        self.max_levels = max_levels
+        self.decoded_tiles = decoded_tiles
+        self._decoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ancestor(self, tileset, z, x, y):
+        """Return the zoom, column, row, content type and data of the
+        nearest cached ancestor of the tile, None if there is none"""
+        for d in range(1, min(self.max_levels, z) + 1):
+            stored = self.store.get(tileset, z - d, x >> d, y >> d)
+            if stored is not None:
+                return (z - d, x >> d, y >> d) + stored
+        return None
+
+    def _decode(self, key, data):
+        """Return the decoded ancestor, from the LRU if possible"""
+        with self._lock:
+            image = self._decoded.pop(key, None)
+            if image is not None:
+                self._decoded[key] = image
+                return image
+        image = QImage.fromData(data)
+        if image.isNull():
+            return None
+        with self._lock:
+            self._decoded[key] = image
+            while len(self._decoded) > self.decoded_tiles:
+                self._decoded.popitem(last=False)
+        return image
+
+    def __call__(self, tileset, z, x, y):
+        """Return the content type and the data of the synthesized tile,
+        None if there is no cached ancestor"""
+        ancestor = self.ancestor(tileset, z, x, y)
+        if ancestor is None:
+            return None
+        pz, px, py, content_type, data = ancestor
+        image = self._decode((tileset, pz, px, py), data)
+        if image is None:
+            return None
+        d = z - pz
+        width = image.width() >> d
+        height = image.height() >> d
+        if not width or not height:
+            return None
+        tile = image.copy((x - (px << d)) * width, (y - (py << d)) * height, width, height).scaled(
+            image.width(), image.height(), Qt.IgnoreAspectRatio, Qt.SmoothTransformation)
+        jpeg = (content_type or '').lower() in ('image/jpeg', 'image/jpg')
+        ba = QByteArray()
+        buf = QBuffer(ba)
+        buf.open(QIODevice.WriteOnly)
+        tile.save(buf, 'JPG' if jpeg else 'PNG', JPEG_QUALITY if jpeg else -1)
+        buf.close()
+        return ('image/jpeg' if jpeg else 'image/png'), bytes(ba.data())
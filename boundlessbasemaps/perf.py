@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    perf.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Lightweight timing spans for the setup hot path.
+
+Usage:
+
+    with perf.span('catalog.download') as s:
+        ...
+        s.set(bytes=size, items=len(maps))
+
+When the instrumentation is disabled span() returns a shared no-op object,
+so the only cost is a global lookup and a function call.
+
+Spans are logged to the QGIS message log under the PERF_TAG tag and,
+optionally, appended as JSON lines to a file.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import os
+import json
+import time
+import threading
+from functools import wraps
+
+try:
+    from qgis.core import QgsMessageLog
+except ImportError:  # Running outside QGIS (benchmarks, workers)
+    QgsMessageLog = None
+
+
+PERF_TAG = 'Basemaps perf'
+
+try:
+    timer = time.perf_counter
+except AttributeError:  # Python 2
+    timer = time.time
+
+_enabled = False
+_log_file = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def configure(enabled, log_file=None):
+    """Enable or disable the instrumentation, if log_file is not empty
+    the spans are also appended to it as JSON lines"""
+    global _enabled, _log_file
+    _enabled = bool(enabled)
+    _log_file = log_file or None
+
+
+def is_enabled():
+    return _enabled
+
+
+class _NullSpan(object):
+    """Returned by span() when the instrumentation is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+    def set(self, **counts):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    """A timed section of code with optional counters (bytes, items...)"""
+
+    def __init__(self, name, counts):
+        self.name = name
+        self.counts = counts
+        self.parent = None
+        self.start = None
+        self.duration = None
+
+    def set(self, **counts):
+        self.counts.update(counts)
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        if stack:
+            self.parent = stack[-1].name
+        stack.append(self)
+        self.start = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.duration = timer() - self.start
+        _local.stack.pop()
+        record = {
+            'span': self.name,
+            'ts': time.time(),
+            'duration_ms': round(self.duration * 1000.0, 3),
+            'pid': os.getpid(),
+        }
+        if self.parent is not None:
+            record['parent'] = self.parent
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        record.update(self.counts)
+        _emit(record)
+        return False
+
+
+def span(name, **counts):
+    """Return a context manager timing the enclosed block"""
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, counts)
+
+
+def timed(name):
+    """Decorator version of span()"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _emit(record):
+    if QgsMessageLog is not None:
+        extra = ' '.join('%s=%s' % (k, record[k]) for k in sorted(record)
+                         if k not in ('span', 'ts', 'duration_ms', 'pid'))
+        QgsMessageLog.logMessage('%s: %.1f ms %s' % (record['span'],
+                                                     record['duration_ms'],
+                                                     extra), PERF_TAG)
+    if _log_file is not None:
+        line = json.dumps(record, sort_keys=True)
+        with _lock:
+            try:
+                with open(_log_file, 'a') as f:
+                    f.write(line + '\n')
+            except (IOError, OSError):
+                pass
+
+
+# Allow enabling the instrumentation from the environment, this is
+# useful for the command line tools and the benchmarks
+if os.environ.get('BASEMAPS_PERF') or os.environ.get('BASEMAPS_PERF_LOG'):
+    configure(True, os.environ.get('BASEMAPS_PERF_LOG'))
@@ -21,22 +21,56 @@ __date__ = 'March 2017'
 __copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
 
 import os
+import json
+import socket
+import sqlite3
 import webbrowser
-from datetime import datetime
-from qgis.PyQt.QtWidgets import QAction, QDialog, QMessageBox
-from qgis.PyQt.QtCore import QCoreApplication
-from qgis.core import QgsApplication
+from qgis.PyQt.QtWidgets import (QAction, QDialog, QMessageBox, QApplication, QMenu, QToolBar,
+                                 QProgressBar, QPushButton)
+from qgis.PyQt.QtCore import QCoreApplication, QTimer, Qt, QThread, pyqtSignal
+from qgis.core import QgsApplication, QgsProject, QgsMapLayer
 from qgis.gui import QgsMessageBar
 from qgiscommons2.settings import readSettings, pluginSetting, setPluginSetting
 from qgiscommons2.gui.settings import addSettingsMenu, removeSettingsMenu
-from boundlessbasemaps import utils
+from boundlessbasemaps import (utils, perf, renderer, tileproxy, probe, tilestats, tilestore,
+                               overzoom, prefetch, ratelimit, netfetch, fileutils)
+from boundlessbasemaps.utils import PROJECT_DEFAULT_TEMPLATE, BasemapsConfigError
+from boundlessbasemaps.fileutils import LockTimeout
 
-PROJECT_DEFAULT_TEMPLATE = os.path.join(os.path.dirname(__file__), 'project_default.qgs.tpl')
 
+# File of the tile traffic statistics in the plugin cache directory
+STATS_FILE = 'tilestats.json'
+# Seconds between the writes of the statistics
+STATS_FLUSH_INTERVAL = 60
+# File of the tile cache shared by the QGIS instances
+TILE_CACHE_FILE = 'tiles.sqlite'
+# File of the catalog entries of the selected maps and their authcfg,
+# the routes of the tile proxy
+ROUTES_FILE = 'tileproxy_routes.json'
+# The composer export action the prefetch action is inserted before
+COMPOSER_EXPORT_ACTION = 'mActionExportAsImage'
 
-class BasemapsConfigError(Exception):
-    """Config step gone wrong"""
-    pass
+
+class PrefetchTask(QThread):
+    """Download of the tiles of a prefetch plan off the GUI thread, the
+    progress signal tells the tiles done and the total, the done signal
+    delivers the report of prefetch.prefetch()"""
+
+    progress = pyqtSignal(int, int)
+    done = pyqtSignal(object)
+
+    def __init__(self, proxy, plan):
+        super(PrefetchTask, self).__init__()
+        self.proxy = proxy
+        self.plan = plan
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        self.done.emit(prefetch.prefetch(self.proxy, self.plan, progress=self.progress.emit,
+                                         cancelled=lambda: self.cancelled))
 
 
 class Basemaps:
@@ -56,6 +90,23 @@ class Basemaps:
         except:
             pass
         readSettings()
+        self.configure_perf()
+        self.tile_proxy = None
+        # Original data sources of the layers routed through the tile
+        # proxy, by layer id
+        self.routed = {}
+        # Original scale based visibility of the routed layers with
+        # synthesized levels, by layer id
+        self.routed_scales = {}
+        # Prefetch actions added to the composers
+        self.composer_actions = []
+        self.prefetch_task = None
+        self.tile_stats = tilestats.TileStats(os.path.join(utils.cache_dir(), STATS_FILE))
+        self.stats_timer = QTimer()
+        self.stats_timer.setInterval(STATS_FLUSH_INTERVAL * 1000)
+        self.stats_timer.timeout.connect(self.tile_stats.flush)
+        self.stats_timer.start()
+        self.start_tile_proxy()
         if not pluginSetting('first_time_setup_done'):
             self.iface.initializationCompleted.connect(self.setup)
 
@@ -63,12 +114,17 @@ class Basemaps:
     def tr(self, msg):
         return QCoreApplication.translate('boundlessbasemaps', msg)
 
+    def configure_perf(self):
+        """Enable the performance log according to the plugin settings"""
+        perf.configure(pluginSetting('perf_log'), pluginSetting('perf_log_file'))
+
     def setup(self, username=None, password=None):
         """Configuration wizard"""
         # Preliminary check:
         #if not utils.bcs_supported():
         #    return QMessageBox.warning(None, self.tr("Basemaps error"), self.tr("Your QGIS installation does not meet the minimum requirements to run this plugin. Please check if the OAUth2 authentication plugin is installed and have a look to the documentation for further information."))
         from gui.setupwizard import SetupWizard
+        self.configure_perf()
         settings = {
             "maps_uri": pluginSetting('maps_uri'),
             "token_uri": pluginSetting('token_uri'),
@@ -80,77 +136,117 @@ class Basemaps:
             "enabled": pluginSetting('enabled'),
             "selected": pluginSetting('selected'),
             "visible": pluginSetting('visible'),
+            "tile_formats": pluginSetting('tile_formats'),
+            "hide_inaccessible": pluginSetting('hide_inaccessible'),
+            "catalog_sources": pluginSetting('catalog_sources'),
         }
-        wizard = SetupWizard(settings)
-        if QDialog.Accepted == wizard.exec_():
+        with perf.span('setup.wizard'):
+            wizard = SetupWizard(settings)
+            result = wizard.exec_()
+        if QDialog.Accepted == result:
             # Process the results
             settings = wizard.settings
             if not settings.get('has_error'):
-                setPluginSetting('enabled', False)
-                utils.unset_default_project()
-                authcfg = None
-                if settings.get('enabled'):
-                    try:
-                        # Create the authcfg (or use existing)
-                        if (settings.get('use_current_authcfg') and
-                                settings.get('authcfg') is not None and
-                                utils.get_oauth_authcfg(settings.get('authcfg')) is not None):
-                            authcfg = settings.get('authcfg')
-                        else:  # try with defaults
-                            authcfg = utils.setup_oauth(settings.get('username'), settings.get(
-                                'password'), settings.get('token_uri'))
-                        if authcfg is None:
-                            raise BasemapsConfigError(
-                                self.tr("Could not find or create a valid authentication configuration!"))
-                        # It shouldn't be empty but ...
-                        if settings.get('selected') == '':
-                            raise BasemapsConfigError(
-                                self.tr("You need to select at least one base map!"))
-                        selected = [m for m in settings.get(
-                            'selected').split('###') if m != '']
-                        visible = [m for m in settings.get(
-                            'visible', "").split('###') if m != '']
-                        template = settings.get('project_template')
-                        if template == '' or template is None:
-                            template = PROJECT_DEFAULT_TEMPLATE
-                        if not os.path.isfile(template):
-                            raise BasemapsConfigError(
-                                self.tr("The project template is missing or invalid: '%s'" % template))
-                        prj = utils.create_default_project([m for m in settings.get('available_maps') if m['name'] in selected],
-                                                           visible,
-                                                           template,
-                                                           authcfg)
-                        if prj is None or prj == '':
-                            raise BasemapsConfigError(self.tr(
-                                "Could not create a valid default project from the template '%s'!" % template))
-                        # Check for any existing default_project
-                        if os.path.isfile(utils.default_project_path()):
-                            default_project_backup = utils.default_project_path().replace(
-                                '.qgs', '-%s.qgs' % datetime.now().strftime('%Y-%m-%d-%H:%M:%S'))
-                            os.rename(utils.default_project_path(),
-                                      default_project_backup)
-                            self.iface.messageBar().pushMessage(self.tr("Basemaps setup"), self.tr(
-                                "A backup copy of the previous default project has been saved to %s" % default_project_backup), level=QgsMessageBar.INFO)
-                        if not utils.set_default_project(prj):
-                            raise BasemapsConfigError(
-                                self.tr("Could not write the default project on disk!"))
-                        # Store settings
-                        setPluginSetting('enabled', True)
-                        setPluginSetting('authcfg', authcfg)
-                        setPluginSetting('selected', settings.get('selected'))
-                        setPluginSetting('visible', settings.get('visible'))
-                        self.iface.messageBar().pushMessage(self.tr("Basemaps setup success"), self.tr(
-                            "Basemaps are now ready to use!"), level=QgsMessageBar.INFO)
-                    except BasemapsConfigError as e:
-                        self.iface.messageBar().pushMessage(self.tr("Basemaps setup error"),
-                                                            e.message, level=QgsMessageBar.CRITICAL)
-                    except Exception as e:
-                        self.iface.messageBar().pushMessage(self.tr("Basemaps unhandled exception"),
-                                                            "%s" % e, level=QgsMessageBar.CRITICAL)
+                self._apply_settings(settings)
         else:  # Cancel or close
             pass
         setPluginSetting('first_time_setup_done', True)
 
+    @perf.timed('setup.apply')
+    def _apply_settings(self, settings):
+        """Create the default project from the wizard settings"""
+        setPluginSetting('enabled', False)
+        utils.unset_default_project()
+        authcfg = None
+        if settings.get('enabled'):
+            try:
+                # Create the authcfg (or use existing)
+                if (settings.get('use_current_authcfg') and
+                        settings.get('authcfg') is not None and
+                        utils.get_oauth_authcfg(settings.get('authcfg')) is not None):
+                    authcfg = settings.get('authcfg')
+                else:  # try with defaults
+                    authcfg = utils.setup_oauth(settings.get('username'), settings.get(
+                        'password'), settings.get('token_uri'))
+                if authcfg is None:
+                    raise BasemapsConfigError(
+                        self.tr("Could not find or create a valid authentication configuration!"))
+                # It shouldn't be empty but ...
+                if settings.get('selected') == '':
+                    raise BasemapsConfigError(
+                        self.tr("You need to select at least one base map!"))
+                selected = [m for m in settings.get(
+                    'selected').split('###') if m != '']
+                visible = [m for m in settings.get(
+                    'visible', "").split('###') if m != '']
+                template = settings.get('project_template')
+                if template == '' or template is None:
+                    template = PROJECT_DEFAULT_TEMPLATE
+                if not os.path.isfile(template):
+                    raise BasemapsConfigError(
+                        self.tr("The project template is missing or invalid: '%s'" % template))
+                maps = renderer.apply_zoom_levels(settings.get('available_maps'),
+                                                  renderer.parse_zoom_levels(pluginSetting('zoom_levels')))
+                probed = self.check_maps([m for m in maps if m['name'] in selected], authcfg)
+                prj = utils.create_default_project([m for m in maps if m['name'] in selected],
+                                                   visible,
+                                                   template,
+                                                   authcfg,
+                                                   lazy=pluginSetting('lazy_layers'),
+                                                   entitlements=settings.get('entitlements'))
+                if prj is None or prj == '':
+                    raise BasemapsConfigError(self.tr(
+                        "Could not create a valid default project from the template '%s'!" % template))
+                # Backup any existing default_project and write the new one
+                try:
+                    default_project_backup = utils.replace_default_project(prj)
+                except (IOError, OSError, LockTimeout):
+                    raise BasemapsConfigError(
+                        self.tr("Could not write the default project on disk!"))
+                if default_project_backup is not None:
+                    self.iface.messageBar().pushMessage(self.tr("Basemaps setup"), self.tr(
+                        "A backup copy of the previous default project has been saved to %s" % default_project_backup), level=QgsMessageBar.INFO)
+                # Store settings
+                setPluginSetting('enabled', True)
+                setPluginSetting('authcfg', authcfg)
+                setPluginSetting('selected', settings.get('selected'))
+                setPluginSetting('visible', settings.get('visible'))
+                setPluginSetting('catalog_rate_limits', ratelimit.format_limits(
+                    ratelimit.catalog_limits(settings.get('available_providers'),
+                                             settings.get('available_maps'))))
+                self.store_routes([m for m in maps if m['name'] in selected], authcfg)
+                if self.tile_proxy is not None:
+                    self.tile_proxy.set_limits(self.rate_limits())
+                    self.load_routes()
+                self.iface.messageBar().pushMessage(self.tr("Basemaps setup success"), self.tr(
+                    "Basemaps are now ready to use!"), level=QgsMessageBar.INFO)
+                failed = probe.failed_maps(probed)
+                if failed:
+                    self.iface.messageBar().pushMessage(self.tr("Basemaps health check"), self.tr(
+                        "These basemaps failed the health check: %s" % ', '.join(failed)), level=QgsMessageBar.WARNING)
+                unchecked = probe.unchecked_maps(probed)
+                if unchecked:
+                    self.iface.messageBar().pushMessage(self.tr("Basemaps health check"), self.tr(
+                        "These basemaps were not checked, they did not answer in time: %s" % ', '.join(unchecked)), level=QgsMessageBar.INFO)
+            except BasemapsConfigError as e:
+                self.iface.messageBar().pushMessage(self.tr("Basemaps setup error"),
+                                                    "%s" % e, level=QgsMessageBar.CRITICAL)
+            except Exception as e:
+                self.iface.messageBar().pushMessage(self.tr("Basemaps unhandled exception"),
+                                                    "%s" % e, level=QgsMessageBar.CRITICAL)
+
+    def check_maps(self, maps, authcfg):
+        """Check that the selected maps serve their tiles, return the probe
+        results, empty if the check is disabled"""
+        timeout = float(pluginSetting('probe_timeout') or 0)
+        if not timeout or not maps:
+            return {}
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            return probe.probe_maps(maps, netfetch.request_all, authcfg, timeout)
+        finally:
+            QApplication.restoreOverrideCursor()
+
     def initGui(self):
         helpIcon = QgsApplication.getThemeIcon('/mActionHelpAPI.png')
         self.helpAction = QAction(helpIcon, "Help...", self.iface.mainWindow())
@@ -166,9 +262,34 @@ class Basemaps:
         self.setupAction.triggered.connect(self.setup)
         self.iface.addPluginToMenu("Basemaps", self.setupAction)
 
+        # Add statistics action
+        statsIcon = QgsApplication.getThemeIcon('/mActionPropertiesWidget.svg')
+        self.statsAction = QAction(statsIcon, "Basemaps statistics...", self.iface.mainWindow())
+        self.statsAction.setObjectName("basemapsStatistics")
+        self.statsAction.triggered.connect(self.show_statistics)
+        self.iface.addPluginToMenu("Basemaps", self.statsAction)
+
+        # Add print layouts prefetch action, the prefetch only knows the
+        # print composer of QGIS 2
+        if not utils.QGIS3:
+            prefetchIcon = QgsApplication.getThemeIcon('/mActionFilePrint.png')
+            self.prefetchAction = QAction(prefetchIcon, "Prefetch basemaps for print layouts",
+                                          self.iface.mainWindow())
+            self.prefetchAction.setObjectName("basemapsPrefetch")
+            self.prefetchAction.triggered.connect(lambda: self.prefetch_print_layouts())
+            self.iface.addPluginToMenu("Basemaps", self.prefetchAction)
+
+            # Each composer can prefetch its own tiles before the export
+            self.iface.composerAdded.connect(self.add_composer_action)
+            for view in self.iface.activeComposers():
+                self.add_composer_action(view)
+
         addSettingsMenu("Basemaps")
         # addAboutMenu("Basemaps") Not working!
 
+        # Basemaps placeholders are loaded when checked
+        QgsProject.instance().layerTreeRoot().visibilityChanged.connect(self.load_placeholder)
+
     def unload(self):
         try:
             from .tests import testerplugin
@@ -179,8 +300,254 @@ class Basemaps:
 
         self.iface.removePluginMenu("Basemaps", self.helpAction)
         self.iface.removePluginMenu("Basemaps", self.setupAction)
+        self.iface.removePluginMenu("Basemaps", self.statsAction)
+        if not utils.QGIS3:
+            self.iface.removePluginMenu("Basemaps", self.prefetchAction)
+            self.iface.composerAdded.disconnect(self.add_composer_action)
+            for action in self.composer_actions:
+                try:
+                    action.deleteLater()
+                except RuntimeError:
+                    pass  # Composer already deleted
+            self.composer_actions = []
+        if self.prefetch_task is not None:
+            self.prefetch_task.cancel()
+            self.prefetch_task.wait()
         removeSettingsMenu("Basemaps")
         # removeAboutMenu("Basemaps")
+        QgsProject.instance().layerTreeRoot().visibilityChanged.disconnect(self.load_placeholder)
+        self.stop_tile_proxy()
+        self.stats_timer.stop()
+        self.tile_stats.flush()
+
+    def start_tile_proxy(self):
+        """Start the tile proxy if enabled and route the basemap layers
+        through it in this session"""
+        if not pluginSetting('tile_proxy'):
+            return
+        store = self.open_tile_store()
+        synthesize = None
+        if store is not None and pluginSetting('overzoom'):
+            synthesize = overzoom.Overzoom(store)
+        try:
+            self.tile_proxy = tileproxy.TileProxy(stats=self.tile_stats, store=store,
+                                                  synthesize=synthesize,
+                                                  limits=self.rate_limits(),
+                                                  fetcher=netfetch.request).start()
+        except socket.error as e:
+            if store is not None:
+                store.close()
+            self.iface.messageBar().pushMessage(self.tr("Basemaps tile proxy"), self.tr(
+                "The tile proxy could not start: %s" % e), level=QgsMessageBar.WARNING)
+            return
+        registry = utils.layer_registry()
+        registry.layersAdded.connect(self.route_layers)
+        registry.layersWillBeRemoved.connect(self.forget_layers)
+        QgsProject.instance().writeProject.connect(self.restore_project_sources)
+        self.load_routes()
+
+    def store_routes(self, maps, authcfg):
+        """Store the catalog entries of the selected maps, the tile proxy
+        only serves these ones"""
+        try:
+            fileutils.atomic_write(os.path.join(utils.cache_dir(), ROUTES_FILE),
+                                   json.dumps({'authcfg': authcfg, 'maps': maps}))
+        except (IOError, OSError):
+            pass  # The maps are not routed
+
+    def load_routes(self):
+        """Set the routes of the tile proxy from the stored catalog entries
+        and route the layers already loaded"""
+        self.unroute_layers()
+        try:
+            with open(os.path.join(utils.cache_dir(), ROUTES_FILE)) as f:
+                stored = json.load(f)
+            self.tile_proxy.set_routes(stored['maps'], stored['authcfg'])
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            self.tile_proxy.set_routes([])
+        self.route_layers(utils.layer_registry().mapLayers().values())
+
+    def route_layers(self, layers):
+        """Request the tiles of the basemap layers with a route through the
+        tile proxy, the original data sources are kept in self.routed.
+        If the proxy synthesizes the tiles, the layers are shown
+        overzoom.MAX_LEVELS levels past the maximum zoom of their map"""
+        extra_zoom = overzoom.MAX_LEVELS if self.tile_proxy.synthesize is not None else 0
+        for layer in layers:
+            if layer.type() != QgsMapLayer.RasterLayer or layer.providerType() != 'wms':
+                continue
+            source = tileproxy.routed_source(layer.source(), self.tile_proxy.routes,
+                                             self.tile_proxy.url, extra_zoom)
+            if source is None:
+                continue
+            self.routed[layer.id()] = layer.source()
+            utils.set_layer_source(layer, source)
+            params = tileproxy.source_params(source)
+            if extra_zoom and params.get('zmax') and layer.hasScaleBasedVisibility():
+                self.routed_scales[layer.id()] = utils.layer_scale(layer)
+                utils.set_zoom_limits(layer, int(params['zmin']) if params.get('zmin') else None,
+                                      int(params['zmax']))
+
+    def unroute_layers(self):
+        """Restore the original data sources of the routed layers"""
+        registry = utils.layer_registry()
+        for layer_id, source in self.routed.items():
+            layer = registry.mapLayer(layer_id)
+            if layer is not None:
+                utils.set_layer_source(layer, source)
+                if layer_id in self.routed_scales:
+                    utils.set_layer_scale(layer, self.routed_scales[layer_id])
+        self.routed = {}
+        self.routed_scales = {}
+
+    def forget_layers(self, layer_ids):
+        for layer_id in layer_ids:
+            self.routed.pop(layer_id, None)
+            self.routed_scales.pop(layer_id, None)
+
+    def restore_project_sources(self, doc):
+        """The project files keep the original data sources"""
+        utils.replace_project_sources(doc, self.routed, self.routed_scales)
+
+    def rate_limits(self):
+        """Return the tile quotas of the catalog providers, overridden by
+        the rate_limits setting"""
+        limits = {}
+        for name in ('catalog_rate_limits', 'rate_limits'):
+            try:
+                limits.update(ratelimit.parse_limits(pluginSetting(name)))
+            except ValueError as e:
+                self.iface.messageBar().pushMessage(self.tr("Basemaps rate limits"), "%s" % e,
+                                                    level=QgsMessageBar.WARNING)
+        return limits
+
+    def stop_tile_proxy(self):
+        if self.tile_proxy is not None:
+            registry = utils.layer_registry()
+            registry.layersAdded.disconnect(self.route_layers)
+            registry.layersWillBeRemoved.disconnect(self.forget_layers)
+            QgsProject.instance().writeProject.disconnect(self.restore_project_sources)
+            self.unroute_layers()
+            self.tile_proxy.stop()
+            if self.tile_proxy.store is not None:
+                self.tile_proxy.store.close()
+            self.tile_proxy = None
+
+    def open_tile_store(self):
+        """Return the shared tile cache, None if disabled or not available"""
+        size = float(pluginSetting('tile_cache_size') or 0)
+        if not size:
+            return None
+        try:
+            return tilestore.TileStore(os.path.join(utils.cache_dir(), TILE_CACHE_FILE),
+                                       int(size * 1024 * 1024)).start()
+        except sqlite3.Error:
+            return None
+
+    def add_composer_action(self, view):
+        """Add the prefetch action of the composer of view to its
+        composer menu and toolbar, before the export actions"""
+        window = view.composerWindow()
+        if window is None:
+            return
+        composition = view.composition()
+        action = QAction(QgsApplication.getThemeIcon('/mActionFilePrint.png'),
+                         self.tr("Prefetch basemaps for export"), window)
+        action.setObjectName("basemapsComposerPrefetch")
+        action.triggered.connect(lambda: self.prefetch_print_layouts([composition]))
+        export = window.findChild(QAction, COMPOSER_EXPORT_ACTION)
+        for widget in (window.findChild(QMenu, 'mComposerMenu'),
+                       window.findChild(QToolBar, 'mComposerToolbar')):
+            if widget is None:
+                continue
+            if export is not None and export in widget.actions():
+                widget.insertAction(export, action)
+            else:
+                widget.addAction(action)
+        self.composer_actions.append(action)
+
+    def prefetch_print_layouts(self, compositions=None):
+        """Download in background the basemap tiles of the print layouts
+        (all the open ones if None) into the tile cache, so that the
+        export does not wait for them"""
+        if self.prefetch_task is not None:
+            return
+        if self.tile_proxy is None or self.tile_proxy.store is None:
+            self.iface.messageBar().pushMessage(self.tr("Basemaps prefetch"), self.tr(
+                "The prefetch needs the Basemaps tile proxy and the shared tile cache"),
+                level=QgsMessageBar.WARNING)
+            return
+        if compositions is None:
+            compositions = [view.composition() for view in self.iface.activeComposers()]
+        # The atlas pages are rendered on the GUI thread
+        QApplication.setOverrideCursor(Qt.WaitCursor)
+        try:
+            plan = utils.print_layout_plan(compositions,
+                                           self.iface.mapCanvas().mapSettings().layers(),
+                                           routes=self.tile_proxy.routes)
+        finally:
+            QApplication.restoreOverrideCursor()
+        if not plan.tile_count():
+            self.iface.messageBar().pushMessage(self.tr("Basemaps prefetch"), self.tr(
+                "The print layouts have no basemap tiles to prefetch"), level=QgsMessageBar.INFO)
+            return
+        estimated = prefetch.estimate_saving(plan.missing(self.tile_proxy.store),
+                                             prefetch.layer_latencies(plan, self.tile_stats.report()))
+        message = self.iface.messageBar().createMessage(self.tr("Basemaps prefetch"), self.tr(
+            "Downloading the basemap tiles of %d pages, estimated export time saved: %.0f s") % (
+                plan.pages, estimated))
+        bar = QProgressBar()
+        bar.setMaximum(plan.tile_count())
+        message.layout().addWidget(bar)
+        cancel = QPushButton(self.tr("Cancel"))
+        message.layout().addWidget(cancel)
+        self.iface.messageBar().pushWidget(message, QgsMessageBar.INFO)
+        self.prefetch_task = PrefetchTask(self.tile_proxy, plan)
+        self.prefetch_task.progress.connect(lambda done, total: self.prefetch_progress(bar, done))
+        cancel.clicked.connect(self.prefetch_task.cancel)
+        self.prefetch_task.done.connect(lambda report: self.prefetch_done(message, report))
+        self.prefetch_task.start()
+
+    def prefetch_progress(self, bar, done):
+        try:
+            bar.setValue(done)
+        except RuntimeError:
+            pass  # Message closed
+
+    def prefetch_done(self, message, report):
+        """Show the report of the prefetch in place of its progress"""
+        self.prefetch_task.wait()
+        self.prefetch_task = None
+        try:
+            self.iface.messageBar().popWidget(message)
+        except RuntimeError:
+            pass  # Message closed
+        if report['cancelled']:
+            text = self.tr("Cancelled: %d of %d basemap tiles of %d pages ready, %d downloaded in %.1f s, %d failed")
+        else:
+            text = self.tr("%d of %d basemap tiles of %d pages ready, %d downloaded in %.1f s, %d failed")
+        text = text % (report['done'] - report['errors'], report['tiles'], report['pages'],
+                       report['fetched'], report['elapsed'], report['errors'])
+        text += self.tr(". Estimated export time saved: %.0f s") % max(0.0, report['saved_s'])
+        self.iface.messageBar().pushMessage(self.tr("Basemaps prefetch"), text,
+                                            level=QgsMessageBar.WARNING if report['errors']
+                                            else QgsMessageBar.INFO)
+
+    def show_statistics(self):
+        """Tile traffic statistics panel"""
+        from gui.statsdialog import StatsDialog
+        StatsDialog(self.tile_stats, self.iface.mainWindow()).exec_()
+
+    def load_placeholder(self, node, state=None):
+        """Load the basemap when its placeholder gets checked, state is
+        only passed by QGIS 2"""
+        if state is not None:
+            checked = state == Qt.Checked
+        else:
+            checked = node.itemVisibilityChecked()
+        if checked and utils.is_placeholder(node):
+            # The tree can't be changed from its own signal handlers
+            QTimer.singleShot(0, lambda: utils.load_placeholder(node))
 
     def run(self):
         self.setup()
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    prefetch.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Prefetch of the basemap tiles of the print layouts and atlases.
+
+The export of a print layout fetches the tiles of every map item page by
+page, a few at a time. Before the export, the extents and pixel widths of
+the map items of all the atlas pages (collected by
+utils.print_layout_plan()) are turned into the set of tiles QGIS will
+request, at the zoom level the XYZ provider picks for the resolution.
+The missing tiles are then downloaded concurrently into the shared tile
+cache (see seed.py) and the export runs from the cache.
+
+The time saved is estimated before the download from the number of
+missing tiles and the typical latency of the layer, as if QGIS fetched
+them QGIS_PARALLEL at a time, and estimated again after it from the
+measured download times: the time the export would have spent waiting
+for the tiles, minus the time the prefetch took. The export itself is
+not timed, both figures are estimates.
+
+This module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import math
+from boundlessbasemaps import seed, tileproxy
+from boundlessbasemaps.renderer import WEB_MERCATOR_MAX
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:  # Python 2
+    from urlparse import urlsplit
+
+# Parallel tile requests of QGIS to the same host
+QGIS_PARALLEL = 6
+# Seconds per tile when the latency of a layer is unknown
+DEFAULT_LATENCY = 0.2
+TILE_SIZE = 256
+MAX_ZOOM = 22
+
+
+def parse_source(source, routes=None):
+    """Return the XYZ layer data source as a dictionary with the tile
+    templates, the map name and provider (None if the layer does not use
+    the tile proxy), the authcfg, the zoom limits (None if not set) and
+    routed, True if the layer uses the proxy. The proxy sources are
+    resolved with routes, the routes of the proxy.
+    The zmax of the routed layers is the one of the map, the proxy raises
+    the one of the source for the synthesized levels.
+    Return None if the source is not a XYZ layer"""
+    params = tileproxy.source_params(source)
+    if params.get('type') != 'xyz' or not params.get('url'):
+        return None
+    route = tileproxy.source_route(source, routes or {})
+    zmax = int(params['zmax']) if params.get('zmax') else None
+    if route is not None:
+        templates, name, provider = route['templates'], route['name'], route['provider']
+        authcfg = route['authcfg']
+        if route.get('zmax') is not None:
+            zmax = route['zmax']
+    else:
+        templates, name, provider = [params['url']], None, None
+        authcfg = params.get('authcfg') or None
+    return {
+        'templates': templates,
+        'name': name,
+        'provider': provider,
+        'authcfg': authcfg,
+        'zmin': int(params['zmin']) if params.get('zmin') else None,
+        'zmax': zmax,
+        'routed': route is not None,
+    }
+
+
+def zoom_for_resolution(resolution, zmin=None, zmax=None):
+    """Return the zoom level of the tiles closest to resolution (EPSG:3857
+    units per pixel), within the zoom limits"""
+    z = int(round(math.log(2 * WEB_MERCATOR_MAX / TILE_SIZE / resolution, 2)))
+    return max(zmin or 0, min(zmax if zmax is not None else MAX_ZOOM, z))
+
+
+class PrefetchPlan(object):
+    """Tiles of the layers of the pages to export, each tile is counted
+    once whatever the number of pages showing it. If routes (the routes
+    of the tile proxy) is not None, only the layers using the proxy are
+    planned: the other ones do not read the tile cache"""
+
+    def __init__(self, routes=None):
+        self.layers = {}
+        self.pages = 0
+        self.routes = routes
+
+    def add(self, source, extent, width, name=None):
+        """Add the tiles of the XYZ layer data source in the EPSG:3857
+        extent (xmin, ymin, xmax, ymax) rendered width pixels wide, name
+        is the layer name"""
+        layer = parse_source(source, self.routes)
+        if (layer is None or (self.routes is not None and not layer['routed']) or
+                width <= 0 or extent[2] <= extent[0]):
+            return
+        layer['name'] = layer['name'] or name
+        z = zoom_for_resolution((extent[2] - extent[0]) / float(width),
+                                layer['zmin'], layer['zmax'])
+        entry = self.layers.setdefault(source, (layer, set()))
+        entry[1].update(seed.extent_tiles(extent[0], extent[1], extent[2], extent[3], z))
+
+    def tile_count(self):
+        return sum(len(tiles) for layer, tiles in self.layers.values())
+
+    def missing(self, store):
+        """Return the number of tiles not in store, per data source"""
+        return dict((source, len([t for t in tiles
+                                  if store.get(layer['templates'][0], *t) is None]))
+                    for source, (layer, tiles) in self.layers.items())
+
+
+def estimate_saving(missing, latencies=None, parallel=QGIS_PARALLEL):
+    """Return the estimated seconds of tile downloads the export saves,
+    missing is the number of missing tiles and latencies the typical
+    latency of the tiles, per data source"""
+    latencies = latencies or {}
+    return sum(count * (latencies.get(source) or DEFAULT_LATENCY)
+               for source, count in missing.items()) / float(parallel)
+
+
+def layer_key(layer):
+    """Return the (layer, provider) statistics key of a parsed source"""
+    host = urlsplit(layer['templates'][0]).netloc
+    return layer['name'] or host, layer['provider'] or host
+
+
+def layer_latencies(plan, report):
+    """Return the median latency of the layers of plan in the tile
+    statistics report (see tilestats.TileStats.report()), per data source"""
+    p50 = dict(((l['layer'], l['provider']), l['p50']) for l in report['layers'])
+    return dict((source, p50.get(layer_key(layer)))
+                for source, (layer, tiles) in plan.layers.items())
+
+
+def prefetch(proxy, plan, workers=seed.SEED_WORKERS, parallel=QGIS_PARALLEL,
+             progress=None, cancelled=None):
+    """Download the missing tiles of plan with proxy (a TileProxy with a
+    store), the requests are authorized with the authcfg of each layer.
+    progress(done, total), if not None, is called with the number of
+    tiles done after each one, the download stops as soon as cancelled(),
+    if not None, returns True.
+    Return the report: the number of pages, tiles, cached, fetched and
+    failed ones, the elapsed seconds, the estimated seconds saved to the
+    export (saved_s, from the measured download times) and whether it
+    was cancelled"""
+    total = plan.tile_count()
+    report = {'pages': plan.pages, 'tiles': total, 'cached': 0, 'fetched': 0, 'errors': 0,
+              'elapsed': 0.0, 'upstream_s': 0.0, 'done': 0}
+    for source, (layer, tiles) in plan.layers.items():
+        if cancelled is not None and cancelled():
+            break
+
+        def layer_progress(done, offset=report['done']):
+            progress(offset + done, total)
+
+        r = seed.seed_templates(proxy, layer['templates'], sorted(tiles), None, workers,
+                                layer_key(layer), layer['authcfg'],
+                                None if progress is None else layer_progress, cancelled)
+        for k in ('cached', 'fetched', 'errors', 'elapsed', 'upstream_s', 'done'):
+            report[k] += r[k]
+    report['cancelled'] = report['done'] < total
+    report['saved_s'] = report['upstream_s'] / float(parallel) - report['elapsed']
+    return report
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    probe.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Health probe of the basemaps endpoints.
+
+One low zoom tile of every selected map is requested concurrently, all
+the requests share a single deadline: a dead endpoint costs the probe at
+most the timeout, instead of a timeout on every render of every new
+project. The maps which did not answer before the deadline are reported
+as not checked, not as failed.
+
+The requests are sent by a function passed to probe_maps() (see
+netfetch.request_all() for the QGIS network stack), this module only
+depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+from boundlessbasemaps import perf, renderer, tileproxy
+
+
+# Seconds the whole probe can last
+PROBE_TIMEOUT = 10
+
+
+def probe_tile(m):
+    """Return the (z, x, y) of the tile requested to check the map m:
+    the first tile of its lowest zoom level"""
+    zmin, zmax = renderer.zoom_limits(m)
+    return (zmin or 0, 0, 0)
+
+
+def probe_url(m):
+    z, x, y = probe_tile(m)
+    return tileproxy.tile_url(tileproxy.shard(tileproxy.tile_templates(m), z, x, y), z, x, y)
+
+
+def _result(url, status=None, latency=None, error=None, checked=True):
+    return {'url': url, 'status': status, 'latency': latency, 'error': error,
+            'checked': checked}
+
+
+def check_response(url, response):
+    """Return the probe result of the response to the request of the tile
+    at url: status, headers, body and latency, an exception if there was no
+    response, None if it did not arrive in time"""
+    if response is None:
+        return _result(url, checked=False)
+    if isinstance(response, Exception):
+        return _result(url, error="%s" % response or response.__class__.__name__)
+    status, response_headers, body, latency = response
+    content_type = dict((k.lower(), v) for k, v in response_headers).get('content-type', '')
+    if status != 200:
+        error = 'HTTP %d' % status
+    elif not body:
+        error = 'Empty tile'
+    elif content_type and not content_type.startswith('image/'):
+        error = 'Not an image: %s' % content_type
+    else:
+        error = None
+    return _result(url, status, latency, error)
+
+
+@perf.timed('probe.maps')
+def probe_maps(maps, request_all, authcfg=None, timeout=PROBE_TIMEOUT):
+    """Request one tile of each of the maps concurrently and return a
+    dictionary of map name: result, where result is a dictionary with
+    url, status (HTTP status, None without response), latency (seconds,
+    None without response), error (None if the map is healthy or was not
+    checked) and checked (False if the map did not answer in time).
+    request_all(requests, timeout) sends the (url, authcfg) requests and
+    returns the responses, see check_response()"""
+    urls = [probe_url(m) for m in maps]
+    # No credentials to the anonymous maps of other catalog sources
+    responses = request_all([(url, authcfg if m.get('auth', True) else None)
+                             for m, url in zip(maps, urls)], timeout)
+    return dict((m['name'], check_response(url, response))
+                for m, url, response in zip(maps, urls, responses))
+
+
+def failed_maps(results):
+    """Return the sorted names of the maps which failed the probe"""
+    return sorted(name for name, r in results.items() if r['error'] is not None)
+
+
+def unchecked_maps(results):
+    """Return the sorted names of the maps which did not answer in time"""
+    return sorted(name for name, r in results.items() if not r['checked'])
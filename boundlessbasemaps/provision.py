@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    provision.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Bulk provisioning of the Basemaps default project for many QGIS profiles.
+
+The catalog is fetched once and the layer definitions are created once
+per authcfg in the main process, the projects are then rendered and
+atomically written by a pool of worker processes. The workers only use
+the standard library modules renderer and fileutils.
+
+The profiles are described by a JSON file containing a list of objects:
+
+    [{"name": "alice",
+      "path": "/home/alice/.qgis2",
+      "settings": "/home/alice/.config/QGIS/QGIS2.conf",
+      "selected": ["Mapbox Streets", "Recent Imagery"],
+      "visible": ["Mapbox Streets"],
+      "authcfg": "conect1"},
+     {"name": "bob",
+      "path": "/srv/qgis/bob",
+      "selected": "Recent Imagery"}]
+
+- path: the QGIS settings directory of the profile, where the default
+  project is written
+- settings: the QGIS settings (ini) file of the profile. QGIS 2 keeps it
+  out of the settings directory (~/.config/QGIS/QGIS2.conf on Linux), so
+  it is required unless path is a directory QGIS is started with
+  --configpath, which has the settings in QGIS/QGIS2.ini (QGIS/QGIS3.ini
+  in the QGIS 3 profiles): the file must already exist there
+- selected, visible: lists or '###' separated strings
+- authcfg: optional, it must exist in the authentication database used
+  by the profile
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import os
+import json
+import multiprocessing
+
+from boundlessbasemaps import renderer, fileutils
+from boundlessbasemaps.perf import timer
+from boundlessbasemaps.renderer import BasemapsConfigError
+
+# Template and layer definitions shared with the worker processes
+_shared = {}
+
+
+def _names(value):
+    if isinstance(value, (list, tuple)):
+        return [n for n in value if n]
+    return [n for n in (value or '').split('###') if n != '']
+
+
+def load_profiles(path, default_authcfg=None):
+    """Read and normalize the profiles description file"""
+    with open(path) as f:
+        profiles = json.load(f)
+    result = []
+    for i, p in enumerate(profiles):
+        if 'path' not in p:
+            raise BasemapsConfigError("Profile %s has no path" % p.get('name', i))
+        result.append({
+            'name': p.get('name', os.path.basename(os.path.normpath(p['path']))),
+            'path': p['path'],
+            'selected': _names(p.get('selected')),
+            'visible': _names(p.get('visible')),
+            'authcfg': p.get('authcfg', default_authcfg),
+            'settings': p.get('settings') or profile_settings_path(p['path']),
+        })
+    return result
+
+
+def profile_settings_path(profile_dir):
+    """Return the path of the QGIS settings file of a profile directory in
+    the --configpath (or QGIS 3 profile) layout, raise BasemapsConfigError
+    if there is no such file"""
+    try:
+        from qgis.core import Qgis
+        qgis3 = Qgis.QGIS_VERSION_INT >= 29900
+    except ImportError:
+        qgis3 = False
+    path = os.path.join(profile_dir, 'QGIS', 'QGIS3.ini' if qgis3 else 'QGIS2.ini')
+    if not os.path.isfile(path):
+        raise BasemapsConfigError(
+            "No QGIS settings file '%s', the 'settings' path of the profile is required" % path)
+    return path
+
+
+def _init_worker(template, definitions, lazy=False):
+    _shared['template'] = template
+    _shared['definitions'] = definitions
+    _shared['lazy'] = lazy
+
+
+def _render_and_write(job):
+    """Worker: render one project and write it atomically"""
+    name, authcfg, selected, visible, path = job
+    start = timer()
+    definitions = _shared['definitions'][authcfg]
+    prj = renderer.render_project(_shared['template'],
+                                  [definitions[n] for n in selected], visible,
+                                  _shared['lazy'])
+    rendered = timer()
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    fileutils.atomic_write(path, prj)
+    return {
+        'profile': name,
+        'path': path,
+        'bytes': len(prj),
+        'render_s': rendered - start,
+        'write_s': timer() - rendered,
+    }
+
+
+def provision_profiles(maps, profiles, template_path, workers=None, lazy=False):
+    """Write the default project and the plugin settings of every profile,
+    return the list of per-profile timings. If lazy is True the hidden maps
+    are written as placeholders"""
+    catalog = [m['name'] for m in maps]
+    available = set(catalog)
+    for p in profiles:
+        missing = [n for n in p['selected'] if n not in available]
+        if missing:
+            raise BasemapsConfigError("Unknown maps in profile %s: %s" % (
+                p['name'], ', '.join(missing)))
+        if not p['selected']:
+            raise BasemapsConfigError("No maps selected in profile %s" % p['name'])
+    template = renderer.read_template(template_path)
+
+    # The layer ids are created here, once for every authcfg
+    definitions = {}
+    for authcfg in set(p['authcfg'] for p in profiles):
+        names = set()
+        for p in profiles:
+            if p['authcfg'] == authcfg:
+                names.update(p['selected'])
+        layers = renderer.layer_definitions([m for m in maps if m['name'] in names], authcfg)
+        definitions[authcfg] = dict((l['name'], l) for l in layers)
+
+    jobs = []
+    for p in profiles:
+        selected = set(p['selected'])
+        # Keep the catalog order, as create_default_project does
+        jobs.append((p['name'], p['authcfg'], [n for n in catalog if n in selected],
+                     p['visible'], os.path.join(p['path'], 'project_default.qgs')))
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = max(1, min(workers, len(jobs)))
+    if workers == 1:
+        _init_worker(template, definitions, lazy)
+        results = [_render_and_write(job) for job in jobs]
+    else:
+        pool = multiprocessing.Pool(workers, _init_worker, (template, definitions, lazy))
+        try:
+            results = pool.map(_render_and_write, jobs)
+        finally:
+            pool.close()
+            pool.join()
+
+    from qgis.PyQt.QtCore import QSettings
+    from boundlessbasemaps import utils
+    for p in profiles:
+        settings = QSettings(p['settings'], QSettings.IniFormat)
+        utils.store_plugin_settings(p['selected'], p['visible'], p['authcfg'], settings)
+        settings.sync()
+    return results
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    ratelimit.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Tile request quotas of the providers.
+
+The tile proxy sends the requests of each provider through a token
+bucket. A provider of the catalog can set its quota:
+
+    {"id": "mapbox", "name": "Mapbox", ..., "rateLimit": 20, "rateBurst": 40}
+
+(tiles per second, the burst defaults to one second of tiles) and the
+rate_limits setting overrides it, with a '###' separated list of
+'provider:rate:burst'. The quotas are keyed by the "provider" of the
+maps, which can be the id or the name of the catalog provider. The providers without a quota are not limited
+until their first 429 response.
+
+After a 429 response the requests of the provider wait for the
+Retry-After delay (DEFAULT_PAUSE if missing), the quota is lowered to
+MARGIN times the measured rate of the requests which hit it and the rate
+is cut to BACKOFF times the quota, then recovers by RECOVERY times the
+quota after every successful request: the throughput stays just under
+the limit. The cache hits never wait, and a waiting request is dropped
+as soon as its client cancels it.
+
+This module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import time
+import threading
+from collections import deque
+from email.utils import parsedate_tz, mktime_tz
+from boundlessbasemaps.perf import timer
+
+# Quota learned after a 429 response, relative to the measured rate
+MARGIN = 0.9
+# Rate after a 429 response, relative to the quota
+BACKOFF = 0.5
+# Rate recovered after each successful request, relative to the quota
+RECOVERY = 0.05
+MIN_RATE = 0.5
+# Seconds to wait after a 429 response without Retry-After
+DEFAULT_PAUSE = 1.0
+MAX_PAUSE = 300.0
+# Seconds of requests the rate is measured on
+RATE_WINDOW = 10.0
+# Seconds between the cancellation checks of the waiting requests
+POLL_INTERVAL = 0.05
+
+
+class Cancelled(Exception):
+    """The client cancelled a waiting request"""
+
+
+def catalog_limits(providers, maps):
+    """Return the quotas of the catalog providers with a "rateLimit":
+    dictionary of the "provider" of the maps: (rate, burst), burst can be
+    None. The "provider" of a map can be the id or the name of a
+    catalog provider"""
+    quotas = {}
+    for p in providers or []:
+        try:
+            rate = float(p['rateLimit'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        try:
+            burst = float(p['rateBurst'])
+        except (KeyError, TypeError, ValueError):
+            burst = None
+        if rate > 0:
+            for key in (p.get('id'), p.get('name')):
+                if key:
+                    quotas[key] = (rate, burst)
+    limits = {}
+    for m in maps or []:
+        if m.get('provider') in quotas:
+            limits[m['provider']] = quotas[m['provider']]
+    return limits
+
+
+def parse_limits(value):
+    """Parse the rate_limits setting: '###' separated list of
+    'provider:rate:burst', the burst can be empty. Return a dictionary of
+    provider: (rate, burst). Raise ValueError if invalid"""
+    limits = {}
+    for item in (value or '').split('###'):
+        if not item.strip():
+            continue
+        try:
+            provider, rate, burst = item.rsplit(':', 2)
+            limits[provider.strip()] = (float(rate), float(burst) if burst.strip() else None)
+        except ValueError:
+            raise ValueError("Invalid rate limit for a provider: '%s'" % item)
+    return limits
+
+
+def format_limits(limits):
+    """Return the rate_limits setting of limits, see parse_limits()"""
+    return '###'.join('%s:%g:%s' % (provider, rate, '' if burst is None else '%g' % burst)
+                      for provider, (rate, burst) in sorted(limits.items()))
+
+
+def retry_after(headers, now=None):
+    """Return the seconds to wait of the Retry-After header in the
+    response headers ((name, value) list), None if missing or invalid"""
+    for k, v in headers:
+        if k.lower() != 'retry-after':
+            continue
+        v = v.strip()
+        if v.isdigit():
+            return float(v)
+        date = parsedate_tz(v)
+        if date is None:
+            return None
+        return max(0.0, mktime_tz(date) - (time.time() if now is None else now))
+    return None
+
+
+class RateLimiter(object):
+    """Token bucket of the tile requests to a provider: rate requests
+    per second (None: not limited until the first 429 response) and
+    bursts of burst requests (one second of requests if None)"""
+
+    def __init__(self, rate=None, burst=None, clock=timer):
+        self.clock = clock
+        # End of the pause after the last 429 response
+        self.paused_until = None
+        self._updated = clock()
+        self._sent = deque()
+        self._lock = threading.Lock()
+        self.configure(rate, burst)
+
+    def configure(self, rate=None, burst=None):
+        """Set the quota, the learned one is discarded"""
+        with self._lock:
+            self.limit = float(rate) if rate else None
+            self.rate = self.limit
+            self.burst = float(burst) if burst else None
+            self._tokens = self._burst()
+
+    def _burst(self):
+        return self.burst or max(1.0, self.limit or 1.0)
+
+    def _refill(self, now):
+        if self.rate is not None and now > self._updated:
+            self._tokens = min(self._burst(), self._tokens + (now - self._updated) * self.rate)
+        self._updated = max(self._updated, now)
+
+    def measured_rate(self):
+        """Return the requests per second of the last RATE_WINDOW seconds"""
+        with self._lock:
+            return self._measured_rate(self.clock())
+
+    def _measured_rate(self, now):
+        self._forget(now)
+        if not self._sent:
+            return 0.0
+        return len(self._sent) / max(now - self._sent[0], 1.0)
+
+    def _forget(self, now):
+        while self._sent and self._sent[0] < now - RATE_WINDOW:
+            self._sent.popleft()
+
+    def reserve(self):
+        """Take a token and return 0 if the request can be sent, else
+        return the seconds to wait before trying again"""
+        with self._lock:
+            now = self.clock()
+            if self.paused_until is not None and now < self.paused_until:
+                return self.paused_until - now
+            if self.rate is not None:
+                self._refill(now)
+                if self._tokens < 1:
+                    return (1 - self._tokens) / self.rate
+                self._tokens -= 1
+            self._sent.append(now)
+            self._forget(now)
+            return 0
+
+    def acquire(self, cancelled=None, timeout=None):
+        """Wait for a token, at most timeout seconds (None: no limit).
+        Return False if it timed out. Raise Cancelled as soon as
+        cancelled() returns True"""
+        deadline = None if timeout is None else timer() + timeout
+        while True:
+            delay = self.reserve()
+            if not delay:
+                return True
+            if cancelled is not None:
+                if cancelled():
+                    raise Cancelled()
+                delay = min(delay, POLL_INTERVAL)
+            if deadline is not None:
+                remaining = deadline - timer()
+                if remaining <= 0:
+                    return False
+                delay = min(delay, remaining)
+            time.sleep(delay)
+
+    def throttled(self, pause=None):
+        """Adapt to a 429 response: the requests wait pause seconds
+        (DEFAULT_PAUSE if None) and the quota and the rate are lowered.
+        The 429 responses to the requests sent before the pause only
+        extend it"""
+        pause = min(MAX_PAUSE, DEFAULT_PAUSE if pause is None else pause)
+        with self._lock:
+            now = self.clock()
+            if self.paused_until is not None and now < self.paused_until + DEFAULT_PAUSE:
+                self.paused_until = max(self.paused_until, now + pause)
+                return
+            measured = self._measured_rate(now)
+            # At least two requests to measure a rate
+            if len(self._sent) > 1:
+                learned = max(MIN_RATE, measured * MARGIN)
+                self.limit = learned if self.limit is None else min(self.limit, learned)
+            if self.limit is not None:
+                self.rate = max(MIN_RATE, self.limit * BACKOFF)
+            self.paused_until = now + pause
+            self._tokens = 0.0
+            self._updated = self.paused_until
+            self._sent.clear()
+
+    def succeeded(self):
+        """Recover the rate after a successful request"""
+        with self._lock:
+            if self.limit is not None and self.rate < self.limit:
+                self._refill(self.clock())
+                self.rate = min(self.limit, self.rate + self.limit * RECOVERY)
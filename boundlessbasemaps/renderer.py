@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    renderer.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Default project rendering from catalog entries and a project template.
+
+This module only depends on the standard library: it can be used in
+worker processes, in CI and on servers without QGIS. The generated
+maplayer elements are the same that QgsMapLayer.asLayerDefinition writes
+for XYZ layers in QGIS 2.18 (the format of the project template), the
+QGIS based equivalent is utils.qgis_layer_definitions().
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import io
+import re
+from datetime import datetime
+from xml.sax.saxutils import escape
+from boundlessbasemaps import tileproxy
+try:
+    from urllib2 import quote
+except:
+    from urllib.parse import quote
+
+
+# Custom property of the layer tree groups standing for layers which are
+# loaded on demand, the value is the data source of the layer
+PLACEHOLDER_PROPERTY = 'basemaps/placeholder'
+MIN_ZOOM_PROPERTY = 'basemaps/minZoom'
+MAX_ZOOM_PROPERTY = 'basemaps/maxZoom'
+
+# Full extent of the XYZ tiles in EPSG:3857
+WEB_MERCATOR_MAX = 20037508.342789244
+
+# Scale denominator of the zoom level 0 of the XYZ tiles, as computed by
+# the QGIS wms provider (256 pixel tiles, 0.28 mm pixel)
+ZOOM0_SCALE = 559082264.0287178
+
+MAPLAYER_TPL = u"""  <maplayer minimumScale="%(minimum_scale)s" maximumScale="%(maximum_scale)s" type="raster" hasScaleBasedVisibilityFlag="%(scale_based)s">
+   <extent>
+    <xmin>%(xmin)s</xmin>
+    <ymin>%(ymin)s</ymin>
+    <xmax>%(xmax)s</xmax>
+    <ymax>%(ymax)s</ymax>
+   </extent>
+   <id>%(id)s</id>
+   <datasource>%(datasource)s</datasource>
+   <keywordList>
+    <value></value>
+   </keywordList>
+   <layername>%(name)s</layername>
+   <srs>
+    <spatialrefsys>
+     <proj4>+proj=merc +a=6378137 +b=6378137 +lat_ts=0.0 +lon_0=0.0 +x_0=0.0 +y_0=0 +k=1.0 +units=m +nadgrids=@null +wktext  +no_defs</proj4>
+     <srsid>3857</srsid>
+     <srid>3857</srid>
+     <authid>EPSG:3857</authid>
+     <description>WGS 84 / Pseudo Mercator</description>
+     <projectionacronym>merc</projectionacronym>
+     <ellipsoidacronym>WGS84</ellipsoidacronym>
+     <geographicflag>false</geographicflag>
+    </spatialrefsys>
+   </srs>
+   <customproperties>
+    <property key="identify/format" value="Undefined"/>
+   </customproperties>
+   <provider>wms</provider>
+   <noData>
+    <noDataList bandNo="1" useSrcNoData="0"/>
+   </noData>
+   <map-layer-style-manager current="">
+    <map-layer-style name=""/>
+   </map-layer-style-manager>
+   <pipe>
+    <rasterrenderer opacity="1" alphaBand="-1" band="1" type="singlebandcolordata">
+     <rasterTransparency/>
+    </rasterrenderer>
+    <brightnesscontrast brightness="0" contrast="0"/>
+    <huesaturation colorizeGreen="128" colorizeOn="0" colorizeRed="255" colorizeBlue="128" grayscaleMode="0" saturation="0" colorizeStrength="100"/>
+    <rasterresampler maxOversampling="2"/>
+   </pipe>
+   <blendMode>0</blendMode>
+  </maplayer>"""
+
+
+class BasemapsConfigError(Exception):
+    """Config step gone wrong"""
+    pass
+
+
+def _attr(value):
+    return escape(value, {'"': '&quot;'})
+
+
+def zoom_limits(m):
+    """Return the (min, max) zoom levels of the catalog entry m, None
+    if not known"""
+    limits = []
+    for key in ('minZoom', 'maxZoom'):
+        try:
+            limits.append(int(m[key]))
+        except (KeyError, TypeError, ValueError):
+            limits.append(None)
+    return tuple(limits)
+
+
+def zoom_scale(z):
+    """Return the scale denominator of the zoom level z"""
+    return ZOOM0_SCALE / 2 ** z
+
+
+def scale_range(zmin, zmax):
+    """Return the (minimum, maximum) scale denominators of the layer
+    visibility for the zoom limits, None if there is no limit.
+    The layer is hidden one level out of zmin and one level in of zmax
+    (the tiles of zmax are upsampled for that level)"""
+    return (zoom_scale(zmax + 1) if zmax is not None else None,
+            zoom_scale(zmin - 1) if zmin else None)
+
+
+def parse_zoom_levels(value):
+    """Parse the zoom_levels setting: '###' separated list of
+    'map name:zmin:zmax', any of the limits can be empty.
+    Return a dictionary of map name: (zmin, zmax)"""
+    levels = {}
+    for item in (value or '').split('###'):
+        if not item.strip():
+            continue
+        try:
+            name, zmin, zmax = item.rsplit(':', 2)
+            levels[name.strip()] = tuple(int(z) if z.strip() else None
+                                         for z in (zmin, zmax))
+        except ValueError:
+            raise BasemapsConfigError("Invalid zoom levels for a map: '%s'" % item)
+    return levels
+
+
+def apply_zoom_levels(maps, levels):
+    """Return the catalog entries with the minZoom and maxZoom overridden
+    by levels, as returned by parse_zoom_levels()"""
+    if not levels:
+        return maps
+    result = []
+    for m in maps:
+        if m['name'] in levels:
+            m = dict(m)
+            for key, z in zip(('minZoom', 'maxZoom'), levels[m['name']]):
+                if z is not None:
+                    m[key] = z
+        result.append(m)
+    return result
+
+
+def connection_string(m, authcfg=None):
+    """Return the QGIS wms provider data source of the catalog entry m,
+    the tiles are requested to the first host of the entry"""
+    connstring = u'type=xyz&url=%(url)s'
+    # The maps of additional catalog sources can be anonymous
+    if authcfg is not None and m.get('auth', True):
+        connstring = u'authcfg=%(authcfg)s&' + connstring
+    zmin, zmax = zoom_limits(m)
+    if zmax is not None:
+        connstring += u'&zmax=%d' % zmax
+    if zmin is not None:
+        connstring += u'&zmin=%d' % zmin
+    return connstring % {
+        'url': quote(tileproxy.tile_templates(m)[0]),
+        'authcfg': authcfg,
+    }
+
+
+def layer_id(name, now=None, index=None):
+    """Return a new layer id, built like QGIS does from the layer name
+    and a timestamp. The index of the layer keeps unique the ids of the
+    layers created at the same time with the same name"""
+    stamp = (now or datetime.now()).strftime('%Y%m%d%H%M%S%f')[:-3]
+    if index is not None:
+        stamp += '_%d' % index
+    return re.sub(r'\W', '_', name + stamp, flags=re.UNICODE)
+
+
+def layer_definitions(available_maps, authcfg=None):
+    """Return the definitions of the layers for the maps as a list of
+    dictionaries with id, name, datasource, zoom limits and maplayer xml"""
+    layers = []
+    now = datetime.now()
+    extent = '%.17f' % WEB_MERCATOR_MAX
+    for index, m in enumerate(available_maps):
+        zmin, zmax = zoom_limits(m)
+        minimum_scale, maximum_scale = scale_range(zmin, zmax)
+        values = {
+            'id': layer_id(m['name'], now, index),
+            'minimum_scale': '%g' % (minimum_scale or 0),
+            'maximum_scale': '%g' % (maximum_scale or 1e8),
+            'scale_based': '0' if minimum_scale is None and maximum_scale is None else '1',
+            'name': escape(m['name']),
+            'datasource': escape(connection_string(m, authcfg)),
+            'xmin': '-' + extent,
+            'ymin': '-' + extent,
+            'xmax': extent,
+            'ymax': extent,
+        }
+        layers.append({
+            'id': values['id'],
+            'name': m['name'],
+            'datasource': connection_string(m, authcfg),
+            'zoom': (zmin, zmax),
+            'xml': MAPLAYER_TPL % values,
+        })
+    return layers
+
+
+def read_template(path):
+    with io.open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def render_project(tpl, layers, visible_maps, lazy=False):
+    """Fill the project template tpl with the layers returned by
+    layer_definitions(), this is plain string processing and can run in
+    any thread or process.
+    If lazy is True, the layers which are not visible are written as
+    placeholders in the layer tree (see PLACEHOLDER_PROPERTY) instead of
+    map layers, so that they are not loaded with the project"""
+    maplayers = []
+    layer_tree_layer = ""
+    custom_order = ""
+    legend_layer = ""
+    layer_coordinate_transform = ""
+    visible_maps = set(visible_maps)
+    for layer in layers:
+        is_visible = layer['name'] in visible_maps
+        values = {'name': _attr(layer['name']), 'id': layer['id'], 'visible': ('1' if is_visible else '0'), 'checked': ('Qt::Checked' if is_visible else 'Qt::Unchecked')}
+        if lazy and not is_visible:
+            properties = [(PLACEHOLDER_PROPERTY, layer['datasource'])]
+            for key, z in zip((MIN_ZOOM_PROPERTY, MAX_ZOOM_PROPERTY), layer.get('zoom', ())):
+                if z is not None:
+                    properties.append((key, str(z)))
+            values['properties'] = ''.join("""
+                    <property key="%s" value="%s"/>""" % (key, _attr(value))
+                for key, value in properties)
+            layer_tree_layer += """
+            <layer-tree-group expanded="0" checked="Qt::Unchecked" name="%(name)s">
+                <customproperties>%(properties)s
+                </customproperties>
+            </layer-tree-group>""" % values
+            continue
+        maplayers.append(layer['xml'])
+        custom_order += "<item>%s</item>" % layer['id']
+        layer_tree_layer += """
+            <layer-tree-layer expanded="1" checked="%(checked)s" id="%(id)s" name="%(name)s">
+                <customproperties/>
+            </layer-tree-layer>""" % values
+        legend_layer += """
+            <legendlayer drawingOrder="-1" open="true" checked="%(checked)s" name="%(name)s" showFeatureCount="0">
+              <filegroup open="true" hidden="false">
+                <legendlayerfile isInOverview="0" layerid="%(id)s" visible="%(visible)s"/>
+              </filegroup>
+            </legendlayer>""" % values
+        layer_coordinate_transform += '<layer_coordinate_transform destAuthId="EPSG:3857" srcAuthId="EPSG:3857" srcDatumTransform="-1" destDatumTransform="-1" layerid="%s"/>' % layer['id']
+    maplayers = "\n".join(maplayers)
+    for tag in ['custom_order', 'layer_tree_layer', 'legend_layer', 'layer_coordinate_transform', 'maplayers']:
+        tpl = tpl.replace("#%s#" % tag.upper(), locals()[tag])
+    return tpl
+
+
+def create_project(available_maps, visible_maps, project_template, authcfg=None,
+                   lazy=False):
+    """Create a default project from a template and return it as a string,
+    None if there are no maps"""
+    layers = layer_definitions(available_maps, authcfg)
+    if not len(layers):
+        return None
+    return render_project(read_template(project_template), layers, visible_maps, lazy)
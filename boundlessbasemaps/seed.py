@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    seed.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Seeding of the shared tile cache (see tilestore.py).
+
+The tiles of an extent and range of zoom levels are downloaded
+concurrently through the tile proxy into the cache, the tiles already
+cached are skipped. The report tells how many of the downloaded tiles
+were identical and the bytes the dedupe saved:
+
+    python -m boundlessbasemaps.seed --cache ~/.qgis2/boundlessbasemaps/tiles.sqlite \\
+        --endpoint "https://tiles.example.com/{z}/{x}/{y}.png" \\
+        --extent=-10,35,30,60 --zooms 0-10
+
+The extent is west,south,east,north in degrees. --rate keeps the
+downloads within the quota of the provider (tiles per second), the
+downloads also slow down when the provider answers 429 (see
+ratelimit.py).
+
+This module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import sys
+import math
+import socket
+import argparse
+import threading
+from boundlessbasemaps import tileproxy, tilestore, ratelimit
+from boundlessbasemaps.renderer import WEB_MERCATOR_MAX
+from boundlessbasemaps.perf import timer
+
+try:
+    from queue import Queue, Empty
+    from http.client import HTTPException
+except ImportError:  # Python 2
+    from Queue import Queue, Empty
+    from httplib import HTTPException
+
+SEED_WORKERS = 8
+# Latitude limit of the web mercator tiles
+MAX_LATITUDE = 85.0511287798
+
+
+def lonlat_to_mercator(lon, lat):
+    """Return the EPSG:3857 coordinates of a WGS 84 point"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = lon * WEB_MERCATOR_MAX / 180.0
+    y = math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)) * WEB_MERCATOR_MAX / math.pi
+    return x, y
+
+
+def extent_tiles(xmin, ymin, xmax, ymax, z):
+    """Return the (z, x, y) tiles covering an EPSG:3857 extent"""
+    n = 2 ** z
+    size = 2 * WEB_MERCATOR_MAX / n
+
+    def column(v):
+        return max(0, min(n - 1, int(math.floor((v + WEB_MERCATOR_MAX) / size))))
+
+    def row(v):
+        return max(0, min(n - 1, int(math.floor((WEB_MERCATOR_MAX - v) / size))))
+
+    return [(z, x, y) for x in range(column(xmin), column(xmax) + 1)
+            for y in range(row(ymax), row(ymin) + 1)]
+
+
+def parse_zooms(value):
+    """Return the zoom levels of a "zmin-zmax" or "z" string"""
+    zmin, _, zmax = value.partition('-')
+    return list(range(int(zmin), int(zmax or zmin) + 1))
+
+
+def seed(proxy, m, tiles, headers=None, workers=SEED_WORKERS):
+    """Download the tiles of the catalog entry m missing from the cache
+    of proxy, a tileproxy.TileProxy with a store. Return the report: the
+    number of tiles, cached, fetched and failed ones, the elapsed seconds,
+    the sum of the download times (upstream_s) and the dedupe statistics
+    of the fetched tiles (see tilestore.dedupe_stats())"""
+    templates = tileproxy.tile_templates(m)
+    return seed_templates(proxy, templates, tiles, headers, workers,
+                          (m.get('name') or templates[0], tileproxy.provider(m)))
+
+
+def seed_templates(proxy, templates, tiles, headers=None, workers=SEED_WORKERS, key=None,
+                   authcfg=None, progress=None, cancelled=None):
+    """seed() for the tile URL templates of a map, the requests are
+    recorded in the proxy statistics under key and authorized with authcfg.
+    progress(done), if not None, is called with the number of tiles done
+    after each one. The tiles left are skipped as soon as cancelled(), if
+    not None, returns True"""
+    jobs = Queue()
+    for tile in tiles:
+        jobs.put(tile)
+    counts = {'tiles': jobs.qsize(), 'cached': 0, 'errors': 0, 'upstream_s': 0.0, 'done': 0}
+    blobs = {}
+    fetched = [0, 0]
+    lock = threading.Lock()
+    start = timer()
+
+    def done():
+        counts['done'] += 1
+        if progress is not None:
+            progress(counts['done'])
+
+    def work():
+        while cancelled is None or not cancelled():
+            try:
+                z, x, y = jobs.get_nowait()
+            except Empty:
+                return
+            if proxy.store.get(templates[0], z, x, y) is not None:
+                with lock:
+                    counts['cached'] += 1
+                    done()
+                continue
+            fetch_start = timer()
+            try:
+                status, response_headers, body = proxy.fetch(templates, z, x, y, headers, key,
+                                                               cancelled, authcfg)
+            except ratelimit.Cancelled:
+                return
+            except (socket.error, HTTPException):
+                status = None
+            with lock:
+                counts['upstream_s'] += timer() - fetch_start
+                done()
+                if status != 200:
+                    counts['errors'] += 1
+                    continue
+                fetched[0] += 1
+                fetched[1] += len(body)
+                blobs[tilestore.content_hash(body)] = len(body)
+
+    threads = [threading.Thread(target=work) for i in range(min(workers, counts['tiles']))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    proxy.store.flush()
+    report = tilestore.dedupe_stats(fetched[0], len(blobs), fetched[1], sum(blobs.values()))
+    report.update(counts, fetched=fetched[0], elapsed=timer() - start)
+    return report
+
+
+def parser():
+    p = argparse.ArgumentParser(description='Download the tiles of an extent into the Basemaps tile cache')
+    p.add_argument('--cache', required=True, help='path of the tile cache database')
+    p.add_argument('--endpoint', required=True, help='XYZ URL template of the map')
+    p.add_argument('--extent', default='-180,-85,180,85',
+                   help='west,south,east,north in degrees, defaults to the world')
+    p.add_argument('--zooms', required=True, help='zoom levels: "zmin-zmax" or "z"')
+    p.add_argument('--size', type=float, default=tilestore.DEFAULT_MAX_BYTES / 1024.0 / 1024,
+                   help='size of the cache in MB')
+    p.add_argument('--workers', type=int, default=SEED_WORKERS, help='concurrent downloads')
+    p.add_argument('--rate', type=float, default=None, help='tiles per second')
+    return p
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    west, south, east, north = [float(v) for v in args.extent.split(',')]
+    xmin, ymin = lonlat_to_mercator(west, south)
+    xmax, ymax = lonlat_to_mercator(east, north)
+    tiles = []
+    for z in parse_zooms(args.zooms):
+        tiles.extend(extent_tiles(xmin, ymin, xmax, ymax, z))
+    m = {'endpoint': args.endpoint}
+    store = tilestore.TileStore(args.cache, int(args.size * 1024 * 1024)).start()
+    proxy = tileproxy.TileProxy(cache_size=0, store=store,
+                                limits={tileproxy.provider(m): (args.rate, None)} if args.rate else None)
+    try:
+        r = seed(proxy, m, tiles, workers=args.workers)
+    finally:
+        proxy.stop()
+        store.close()
+    print("%d tiles: %d cached, %d fetched, %d failed in %.1f s" % (
+        r['tiles'], r['cached'], r['fetched'], r['errors'], r['elapsed']))
+    if r['fetched']:
+        print("%d distinct tiles, dedupe ratio %.2f, %d of %d bytes saved" % (
+            r['blobs'], r['dedupe_ratio'], r['bytes_saved'], r['logical_bytes']))
+    return 1 if r['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    snapshot.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Catalog snapshot bundled with the plugin.
+
+The setup wizard shows the maps of the snapshot when there is no local
+copy of the catalog (first run, offline sites) while the live catalog is
+fetched. The snapshot is a zlib compressed pickle (protocol 2, readable
+by Python 2 and 3) of a dictionary with:
+
+- format: SNAPSHOT_FORMAT
+- created: the creation timestamp
+- version: the catalog version, if the catalog endpoint supports the
+  incremental sync: the first sync only downloads the changes since the
+  snapshot (see catalogsync.py)
+- maps and providers: the raw catalog and providers lists
+
+It is regenerated from the live catalog with `paver snapshot`.
+
+This module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import os
+import time
+import zlib
+import pickle
+from boundlessbasemaps import fileutils
+
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_FILE = os.path.join(os.path.dirname(__file__), 'catalog.snapshot')
+
+
+def build(maps, providers, version=None, created=None):
+    """Return the snapshot of the catalog"""
+    return {
+        'format': SNAPSHOT_FORMAT,
+        'created': created or time.time(),
+        'version': version,
+        'maps': maps,
+        'providers': providers,
+    }
+
+
+def dumps(snapshot):
+    return zlib.compress(pickle.dumps(snapshot, 2), 9)
+
+
+def loads(data):
+    """Return the snapshot in data, None if it is not a valid snapshot
+    of the current format"""
+    try:
+        snapshot = pickle.loads(zlib.decompress(data))
+    except Exception:
+        return None
+    if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+        return None
+    return snapshot
+
+
+def write(path, maps, providers, version=None):
+    """Write the snapshot of the catalog to path, return its size"""
+    data = dumps(build(maps, providers, version))
+    fileutils.atomic_write(path, data)
+    return len(data)
+
+
+def read(path=None):
+    """Return the snapshot at path (the bundled one if None), None if
+    missing or invalid"""
+    try:
+        with open(path or SNAPSHOT_FILE, 'rb') as f:
+            return loads(f.read())
+    except (IOError, OSError):
+        return None
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    benchmarks.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Benchmarks for catalog parsing and default project generation on
+synthetic catalogs.
+
+Run with a standalone QGIS:
+
+    python -m boundlessbasemaps.tests.benchmarks --output bench.json
+
+or through the paver task:
+
+    paver benchmark -o bench.json
+
+Memory peaks are measured with tracemalloc (Python 3 only) and only
+account for Python allocations, memory allocated by QGIS in C++ is not
+included.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+from boundlessbasemaps.tests.synthetic import (synthetic_maps, write_catalog,
+                                               sample)
+from boundlessbasemaps.perf import timer
+
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 50000]
+SELECTION_RATIOS = [0.1, 0.5, 1.0]
+VISIBILITY_RATIOS = [0.0, 0.5, 1.0]
+TEMPLATE = os.path.join(os.path.dirname(__file__), os.path.pardir,
+                        'project_default.qgs.tpl')
+# A benchmark is a regression if it is slower than the baseline by this factor
+REGRESSION_THRESHOLD = 1.2
+
+
+def measure(func, repeat=3, setup=None):
+    """Time func over repeat runs, the memory peak is taken from an
+    additional traced run so that tracing does not affect the timings.
+    If setup is given, it is called (untimed) before each run and its
+    return value is passed to func"""
+    if setup is None:
+        setup, run = (lambda: None), (lambda state: func())
+    else:
+        run = func
+    peak = None
+    if tracemalloc is not None:
+        state = setup()
+        tracemalloc.start()
+        run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    times = []
+    for _ in range(repeat):
+        state = setup()
+        start = timer()
+        run(state)
+        times.append(timer() - start)
+    times.sort()
+    return {
+        'min_s': times[0],
+        'median_s': times[len(times) // 2],
+        'max_s': times[-1],
+        'repeat': repeat,
+        'peak_kib': None if peak is None else peak // 1024,
+    }
+
+
+def _write_in_place(path, content):
+    """Unsafe in place write, the baseline of the atomic and locked
+    default project writes"""
+    with open(path, 'wb+') as f:
+        f.write(content.encode('utf-8'))
+
+
+def run_benchmarks(sizes, repeat, workdir):
+    """Run all the benchmarks and return the list of results"""
+    from boundlessbasemaps import utils
+    results = []
+
+    def add(name, size, params, func):
+        result = measure(func, repeat)
+        result.update({'benchmark': name, 'size': size, 'params': params})
+        results.append(result)
+        print('%-24s %6d %-32s %10.4f s %s KiB' % (
+            name, size, json.dumps(params, sort_keys=True), result['median_s'],
+            result['peak_kib']))
+
+    for size in sizes:
+        raw = synthetic_maps(size)
+        path = write_catalog(os.path.join(workdir, 'basemaps_%d.json' % size), raw)
+        add('get_available_maps', size, {}, lambda: utils.get_available_maps(path))
+        add('layer_is_supported', size, {},
+            lambda: [m for m in raw if utils.layer_is_supported(m)])
+        maps = utils.get_available_maps(path)
+        for sel_ratio in SELECTION_RATIOS:
+            selected = sample(maps, sel_ratio)
+            for vis_ratio in VISIBILITY_RATIOS:
+                visible = [m['name'] for m in sample(selected, vis_ratio)]
+                add('create_default_project', size,
+                    {'selected': sel_ratio, 'visible': vis_ratio},
+                    lambda: utils.create_default_project(selected, visible, TEMPLATE))
+        prj = utils.create_default_project(maps, [], TEMPLATE)
+        add('write_in_place', size, {'bytes': len(prj)},
+            lambda: _write_in_place(os.path.join(workdir, 'in_place.qgs'), prj))
+        add('set_default_project', size, {'bytes': len(prj)},
+            lambda: utils.set_default_project(prj, True))
+        add('replace_default_project', size, {'bytes': len(prj)},
+            lambda: utils.replace_default_project(prj))
+    return results
+
+
+def metadata():
+    from qgis.core import QGis
+    try:
+        qgis_version = QGis.QGIS_VERSION
+    except AttributeError:
+        from qgis.core import Qgis
+        qgis_version = Qgis.QGIS_VERSION
+    plugin_version = None
+    with open(os.path.join(os.path.dirname(__file__), os.path.pardir,
+                           'metadata.txt')) as f:
+        for line in f:
+            if line.startswith('version='):
+                plugin_version = line.strip().split('=', 1)[1]
+    return {
+        'plugin_version': plugin_version,
+        'qgis_version': qgis_version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+    }
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """Compare two result sets, return the list of regressions as
+    (benchmark, size, params, baseline median, current median) tuples"""
+    def key(r):
+        return (r['benchmark'], r['size'], json.dumps(r['params'], sort_keys=True))
+    base = dict((key(r), r) for r in baseline['results'])
+    regressions = []
+    for r in current['results']:
+        b = base.get(key(r))
+        if b is not None and r['median_s'] > b['median_s'] * threshold:
+            regressions.append((r['benchmark'], r['size'], r['params'],
+                                b['median_s'], r['median_s']))
+    return regressions
+
+
+def init_qgis(config_path, gui=False):
+    """Initialize a standalone QGIS using a throw-away settings directory,
+    so that the default project of the user is not touched"""
+    from qgis.core import QgsApplication
+    QgsApplication.setPrefixPath(os.environ.get('QGIS_PREFIX_PATH', '/usr/'), True)
+    qgs = QgsApplication([], gui, config_path)
+    qgs.initQgis()
+    return qgs
+
+
+def parse_sizes(value):
+    return [int(s) for s in value.split(',') if s.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-o', '--output', help='JSON file for the results')
+    parser.add_argument('-s', '--sizes', type=parse_sizes, default=DEFAULT_SIZES,
+                        help='comma separated catalog sizes')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-c', '--compare',
+                        help='previous JSON results to check for regressions')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    qgs = init_qgis(os.path.join(workdir, 'profile'))
+    try:
+        output = {
+            'metadata': metadata(),
+            'results': run_benchmarks(args.sizes, args.repeat, workdir),
+        }
+    finally:
+        qgs.exitQgis()
+        shutil.rmtree(workdir, True)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), output)
+        for name, size, params, before, after in regressions:
+            print('REGRESSION %s size=%d %s: %.4f s -> %.4f s' % (
+                name, size, json.dumps(params, sort_keys=True), before, after))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    mockserver.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Local stand-in for the BCS services, for offline load and latency tests.
+
+Served endpoints (same paths as the real BCS API):
+
+- /v1/basemaps/: the maps catalog, with deltas=True the catalog is
+  versioned and ?since=<version> returns the changes (see catalogsync.py)
+- /v1/basemaps/providers: the providers list
+- /v1/token/oauth/: OAuth2 password grant token endpoint (POST)
+- /v1/basemaps/<anything>/{z}/{x}/{y}.<ext>: XYZ tiles (solid color PNG)
+
+Latency, jitter, bandwidth, error rate, error status and tile quota are
+attributes of the server and can be changed while it is running.
+
+Usage from tests:
+
+    server = MockBCSServer(catalog_size=1000, latency=0.1)
+    server.start()
+    maps = utils.get_available_maps(server.maps_uri)
+    server.stop()
+
+From the command line:
+
+    python -m boundlessbasemaps.tests.mockserver --port 8000 --catalog-size 50000
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import re
+import sys
+import json
+import time
+import zlib
+import struct
+import random
+import hashlib
+import argparse
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+
+from boundlessbasemaps.tests.synthetic import synthetic_maps, synthetic_providers
+
+
+MAPS_PATH = '/v1/basemaps/'
+PROVIDERS_PATH = '/v1/basemaps/providers'
+TOKEN_PATH = '/v1/token/oauth/'
+TILE_RE = re.compile(r'^/v1/basemaps/.+/(\d+)/(\d+)/(\d+)\.(\w+)$')
+CHUNK_SIZE = 16384
+
+
+def png_tile(color, size=256):
+    """Return a solid color RGB PNG image"""
+    row = b'\x00' + bytes(bytearray(color)) * size
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data +
+                struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(row * size)) +
+            chunk(b'IEND', b''))
+
+
+def zoom_color(z, x, y):
+    """Default tile color: one color per zoom level"""
+    return ((z * 37) % 256, (z * 91) % 256, (z * 13 + 128) % 256)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.mock.handle(self, 'GET')
+
+    def do_POST(self):
+        self.server.mock.handle(self, 'POST')
+
+    def log_message(self, format, *args):
+        if self.server.mock.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MockBCSServer(object):
+    """Threaded local BCS server
+
+    - maps: catalog entries, a synthetic catalog of catalog_size entries
+      whose tiles are served by this server is used if None
+    - latency: seconds added to every response, plus up to jitter seconds
+    - bandwidth: bytes/second cap of every response body, None: no cap
+    - error_rate: ratio of requests failing with error_status
+    - quota: tiles served per second, the others fail with 429 and
+      Retry-After, None: no quota
+    - tile_color: function(z, x, y) returning the RGB tile color
+    - entitlements: list returned as roles by the token endpoint, not
+      returned if None
+    - deltas: the catalog endpoint supports the incremental sync, every
+      set_maps() call creates a new version
+    """
+
+    def __init__(self, maps=None, providers=None, catalog_size=10, port=0,
+                 latency=0.0, jitter=0.0, bandwidth=None, error_rate=0.0,
+                 error_status=503, seed=0, tile_color=zoom_color, entitlements=None,
+                 deltas=False, quota=None, verbose=False):
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.quota = quota
+        self._window = (0, 0)
+        self.tile_color = tile_color
+        self.entitlements = entitlements
+        self.deltas = deltas
+        self.version = 0
+        self._versions = {}
+        self.verbose = verbose
+        self.requests = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tiles = {}
+        self._thread = None
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self.httpd.mock = self
+        self.port = self.httpd.server_address[1]
+        self.url = 'http://127.0.0.1:%d' % self.port
+        if maps is None:
+            maps = synthetic_maps(catalog_size, base_url=self.url + '/v1/basemaps')
+        self.set_maps(maps)
+        self.set_providers(providers if providers is not None else synthetic_providers())
+
+    @property
+    def maps_uri(self):
+        return self.url + MAPS_PATH
+
+    @property
+    def providers_uri(self):
+        return self.url + PROVIDERS_PATH
+
+    @property
+    def token_uri(self):
+        return self.url + TOKEN_PATH
+
+    def set_maps(self, maps):
+        self.maps = maps
+        self.version += 1
+        self._versions[str(self.version)] = maps
+        if self.deltas:
+            self._maps_body = json.dumps({'version': str(self.version), 'maps': maps}).encode('utf-8')
+        else:
+            self._maps_body = json.dumps(maps).encode('utf-8')
+
+    def _delta(self, since):
+        """Return the changes since the version since"""
+        old = dict((m['endpoint'], m) for m in self._versions[since])
+        new = dict((m['endpoint'], m) for m in self.maps)
+        return json.dumps({
+            'version': str(self.version),
+            'added': [m for m in self.maps if m['endpoint'] not in old],
+            'changed': [m for m in self.maps if m['endpoint'] in old and old[m['endpoint']] != m],
+            'removed': [e for e in old if e not in new],
+        }).encode('utf-8')
+
+    def set_providers(self, providers):
+        self.providers = providers
+        self._providers_body = json.dumps(providers).encode('utf-8')
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def request_count(self, path_prefix=''):
+        with self._lock:
+            return len([r for r in self.requests if r[1].startswith(path_prefix)])
+
+    def handle(self, handler, method):
+        path = handler.path.split('?', 1)[0]
+        with self._lock:
+            self.requests.append((method, path))
+            failed = self._random.random() < self.error_rate
+            delay = self.latency + self._random.random() * self.jitter
+        if delay:
+            time.sleep(delay)
+        if failed:
+            return self._send(handler, self.error_status, b'{"error": "mock failure"}',
+                              'application/json')
+        tile = TILE_RE.match(path)
+        if method == 'GET' and tile is not None and self._over_quota():
+            return self._send(handler, 429, b'{"error": "quota exceeded"}', 'application/json',
+                              [('Retry-After', '1')])
+        if method == 'GET' and tile is not None:
+            z, x, y = [int(v) for v in tile.groups()[:3]]
+            return self._send(handler, 200, self._tile(z, x, y), 'image/png')
+        if method == 'GET' and path.rstrip('/') == PROVIDERS_PATH:
+            return self._send(handler, 200, self._providers_body, 'application/json')
+        if method == 'GET' and path.rstrip('/') == MAPS_PATH.rstrip('/'):
+            since = parse_qs(handler.path.partition('?')[2]).get('since', [None])[0]
+            if self.deltas and since in self._versions:
+                return self._send(handler, 200, self._delta(since), 'application/json')
+            return self._send(handler, 200, self._maps_body, 'application/json')
+        if method == 'POST' and path.rstrip('/') == TOKEN_PATH.rstrip('/'):
+            return self._send(handler, 200, self._token(handler), 'application/json')
+        return self._send(handler, 404, b'{"error": "not found"}', 'application/json')
+
+    def _over_quota(self):
+        """Count a tile request in the current second, return True if
+        it exceeds the quota"""
+        if self.quota is None:
+            return False
+        second = int(time.time())
+        with self._lock:
+            start, count = self._window
+            count = count + 1 if start == second else 1
+            self._window = (second, count)
+            return count > self.quota
+
+    def _tile(self, z, x, y):
+        color = tuple(self.tile_color(z, x, y))
+        with self._lock:
+            if color not in self._tiles:
+                self._tiles[color] = png_tile(color)
+            return self._tiles[color]
+
+    def _token(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        form = parse_qs(handler.rfile.read(length).decode('utf-8'))
+        username = form.get('username', [''])[0]
+        token = {
+            'access_token': hashlib.sha1(username.encode('utf-8')).hexdigest(),
+            'token_type': 'Bearer',
+            'expires_in': 3600,
+        }
+        if self.entitlements is not None:
+            token['roles'] = self.entitlements
+        return json.dumps(token).encode('utf-8')
+
+    def _send(self, handler, status, body, content_type, headers=()):
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        if status == 200 and handler.headers.get('If-None-Match') == etag:
+            status, body = 304, b''
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        for k, v in headers:
+            handler.send_header(k, v)
+        if status in (200, 304):
+            handler.send_header('ETag', etag)
+        handler.end_headers()
+        if not self.bandwidth:
+            handler.wfile.write(body)
+            return
+        for i in range(0, len(body), CHUNK_SIZE):
+            chunk = body[i:i + CHUNK_SIZE]
+            handler.wfile.write(chunk)
+            time.sleep(float(len(chunk)) / self.bandwidth)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local stand-in for the BCS services')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--catalog-size', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='seconds')
+    parser.add_argument('--bandwidth', type=int, default=None, help='bytes/second')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--quota', type=int, default=None, help='tiles/second')
+    args = parser.parse_args(argv)
+    server = MockBCSServer(catalog_size=args.catalog_size, port=args.port,
+                           latency=args.latency, jitter=args.jitter,
+                           bandwidth=args.bandwidth, error_rate=args.error_rate,
+                           error_status=args.error_status, quota=args.quota, verbose=True)
+    print('Maps: %s\nProviders: %s\nToken: %s' % (server.maps_uri,
+                                                  server.providers_uri,
+                                                  server.token_uri))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    synthetic.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Synthetic BCS catalogs of arbitrary size for benchmarks and load tests.
+
+The generated entries have the same structure as the ones returned by the
+BCS basemaps endpoint (see tests/data/basemaps.json).
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import json
+import random
+
+PROVIDERS = ['Boundless', 'Mapbox', 'Planet', 'DigitalGlobe', 'OSM']
+
+# Every UNSUPPORTED_EVERY-th entry is a vector tiles layer
+UNSUPPORTED_EVERY = 10
+
+
+def synthetic_maps(count, base_url='http://tiles.example.com'):
+    """Return a list of count catalog entries"""
+    maps = []
+    for i in range(count):
+        provider = PROVIDERS[i % len(PROVIDERS)]
+        vector = (i % UNSUPPORTED_EVERY) == UNSUPPORTED_EVERY - 1
+        maps.append({
+            "name": "%s Map %05d" % (provider, i),
+            "attribution": "%s 2017" % provider,
+            "provider": provider,
+            "description": "Synthetic %s basemap number %d" % (provider, i),
+            "endpoint": "%s/%s/map%05d/{z}/{x}/{y}.%s" % (
+                base_url, provider.lower(), i, 'pbf' if vector else 'png'),
+            "accessList": ["bcs-basemap-%s" % provider.lower()],
+            "styleUrl": "NA",
+            "standard": "XYZ",
+            "tileFormat": "PBF" if vector else "PNG",
+            "thumbnail": None,
+            "minZoom": 0,
+            "maxZoom": 18 + i % 3,
+        })
+    return maps
+
+
+def synthetic_providers():
+    """Return the providers list matching synthetic_maps()"""
+    return [{"id": p, "name": p, "description": "%s provider" % p,
+             "url": "http://%s.example.com" % p.lower()} for p in PROVIDERS]
+
+
+def write_catalog(path, maps):
+    """Write the catalog to a json file"""
+    with open(path, 'w') as f:
+        json.dump(maps, f)
+    return path
+
+
+def sample(items, ratio, seed=0):
+    """Return a deterministic subset of items of size ratio * len(items)"""
+    count = int(round(len(items) * ratio))
+    return random.Random(seed).sample(items, count)
@@ -9,9 +9,16 @@
 import os
 import re
 import sys
+import json
+import socket
 import shutil
 import unittest
 import tempfile
+import threading
+try:
+    from urllib.request import urlopen
+except ImportError:
+    from urllib2 import urlopen
 
 
 __author__ = 'Alessandro Pasotti'
@@ -36,10 +43,13 @@ try:
 except:
     pass
 
-from boundlessbasemaps import utils
+from boundlessbasemaps import utils, perf, cli, provision, renderer, fileutils, tileproxy, probe, tilestats, tilestore, seed, overzoom, prefetch, ratelimit, fetchpolicy, catalogsync, snapshot, federation, netfetch
+from boundlessbasemaps.tests.synthetic import synthetic_maps, synthetic_providers, write_catalog
+from boundlessbasemaps.tests.mockserver import MockBCSServer
 from boundlessbasemaps.gui.setupwizard import *
 from qgis.core import QgsProject, QgsApplication, QgsAuthManager
-from qgis.PyQt.QtCore import QFileInfo, Qt
+from qgis.PyQt.QtCore import QFileInfo, Qt, QSettings, QBuffer, QByteArray, QIODevice
+from qgis.PyQt.QtGui import QImage, QColor
 
 
 def functionalTests():
@@ -138,6 +148,399 @@ class BasemapsTest(unittest.TestCase):
                                  ])
 
 
+    def test_utils_tile_formats(self):
+        """Check the supported tile formats and the format preference"""
+        self.assertIn('PNG', utils.supported_tile_formats())
+        self.assertIn('JPEG', utils.supported_tile_formats())
+        maps = [{'name': 'Imagery', 'tileFormat': 'PNG', 'standard': 'XYZ'},
+                {'name': 'Imagery', 'tileFormat': 'JPEG', 'standard': 'XYZ'},
+                {'name': 'Streets', 'tileFormat': 'PNG', 'standard': 'XYZ'},
+                {'name': 'Vector', 'tileFormat': 'PBF', 'standard': 'XYZ'}]
+        supported = [m for m in maps if utils.layer_is_supported(m, set(['PNG', 'JPEG']))]
+        self.assertEqual(len(supported), 3)
+        preferred = utils.prefer_formats(supported, utils.parse_format_preference('JPEG###PNG'))
+        self.assertEqual([(m['name'], m['tileFormat']) for m in preferred],
+                         [('Imagery', 'JPEG'), ('Streets', 'PNG')])
+        preferred = utils.prefer_formats(supported, ['PNG'])
+        self.assertEqual([m['tileFormat'] for m in preferred], ['PNG', 'PNG'])
+
+    def test_utils_entitlements(self):
+        """Check the maps filtering by the entitlements of the account"""
+        maps = utils.get_available_maps(self.local_maps_uri)
+        index = utils.access_index(maps)
+        self.assertEqual(utils.accessible_maps(index, None), set(m['name'] for m in maps))
+        accessible = utils.accessible_maps(index, set(['bcs-basemap-mapbox']))
+        self.assertIn('Mapbox Streets', accessible)
+        self.assertNotIn('Recent Imagery', accessible)
+        self.assertRaises(utils.BasemapsConfigError, utils.create_default_project,
+                          maps, [], self.tpl_path, entitlements=set(['bcs-basemap-mapbox']))
+        server = MockBCSServer(entitlements=['bcs-basemap-mapbox']).start()
+        try:
+            self.assertEqual(utils.get_entitlements(server.token_uri, 'me', 'secret'),
+                             set(['bcs-basemap-mapbox']))
+            server.entitlements = None
+            self.assertIsNone(utils.get_entitlements(server.token_uri, 'me', 'secret'))
+        finally:
+            server.stop()
+
+    def test_utils_get_available_maps_synthetic(self):
+        """Check that synthetic benchmark catalogs are filtered like real ones"""
+        path = write_catalog(tempfile.mktemp('.json'), synthetic_maps(100))
+        maps = utils.get_available_maps(path)
+        os.unlink(path)
+        self.assertEqual(len(maps), 90)
+        self.assertTrue(all(m['tileFormat'] == 'PNG' for m in maps))
+
+    def test_utils_get_available_maps_mock_server(self):
+        """Check available maps download from the local mock server"""
+        server = MockBCSServer(catalog_size=1000, latency=0.1).start()
+        try:
+            maps = utils.get_available_maps(server.maps_uri)
+            self.assertEqual(len(maps), 900)
+            providers = utils.get_available_providers(server.providers_uri)
+            self.assertEqual(len(providers), 5)
+            server.error_rate = 1.0
+            self.assertEqual(utils.get_available_maps(server.maps_uri), [])
+        finally:
+            server.stop()
+
+    def test_utils_get_available_maps_cache(self):
+        """Check that a fresh cached catalog does not hit the network"""
+        server = MockBCSServer(catalog_size=100).start()
+        try:
+            self.assertEqual(len(utils.get_available_maps(server.maps_uri)), 90)
+            self.assertEqual(len(utils.get_available_maps(server.maps_uri, 3600)), 90)
+            self.assertEqual(server.request_count('/v1/basemaps/'), 1)
+            utils.get_available_maps(server.maps_uri, 0)
+            self.assertEqual(server.request_count('/v1/basemaps/'), 2)
+        finally:
+            server.stop()
+
+    def test_utils_get_available_maps_stale(self):
+        """Check that the cached catalog is used while the service fails"""
+        server = MockBCSServer(catalog_size=100).start()
+        try:
+            self.assertEqual(len(utils.get_available_maps(server.maps_uri)), 90)
+            server.error_rate = 1.0
+            self.assertEqual(len(utils.get_available_maps(server.maps_uri, 0)), 90)
+            # Retried
+            self.assertEqual(server.request_count('/v1/basemaps/'), 1 + 1 + fetchpolicy.DEFAULT_RETRIES)
+        finally:
+            server.stop()
+            utils.fetch_policy().breaker.success(server.maps_uri)
+
+    def test_fetch_policy(self):
+        """Check the retries, the time budget and the circuit breaker"""
+        clock = [0.0]
+        def sleep(seconds):
+            clock[0] += seconds
+        def failing(timeout):
+            calls.append(timeout)
+            clock[0] += min(2, timeout)
+            raise fetchpolicy.TransientError('down')
+        path = tempfile.mktemp('.json')
+        breaker = fetchpolicy.CircuitBreaker(path, threshold=2, open_seconds=60,
+                                             clock=lambda: clock[0])
+        policy = fetchpolicy.FetchPolicy(budget=10, retries=3, breaker=breaker,
+                                         sleep=sleep, clock=lambda: clock[0])
+        calls = []
+        self.assertRaises(fetchpolicy.TransientError, policy.call, 'uri', failing)
+        self.assertTrue(1 < len(calls) <= 4)
+        self.assertTrue(clock[0] <= 10)
+        self.assertEqual(breaker.state('uri'), 'closed')
+        # Other errors are not retried
+        def broken(timeout):
+            calls.append(timeout)
+            raise fetchpolicy.FetchError('not found')
+        calls = []
+        self.assertRaises(fetchpolicy.FetchError, policy.call, 'other', broken)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(breaker.state('other'), 'closed')
+        # A second failed call opens the circuit, stored across sessions
+        self.assertRaises(fetchpolicy.TransientError, policy.call, 'uri', failing)
+        breaker = fetchpolicy.CircuitBreaker(path, threshold=2, open_seconds=60,
+                                             clock=lambda: clock[0])
+        policy.breaker = breaker
+        self.assertEqual(breaker.state('uri'), 'open')
+        self.assertRaises(fetchpolicy.CircuitOpen, policy.call, 'uri', lambda t: 'ok')
+        clock[0] += 61
+        self.assertEqual(breaker.state('uri'), 'half-open')
+        # A single test call, the other callers fail fast meanwhile
+        def trial(timeout):
+            self.assertRaises(fetchpolicy.CircuitOpen, policy.call, 'uri', lambda t: 'ok')
+            return 'ok'
+        self.assertEqual(policy.call('uri', trial), 'ok')
+        self.assertEqual(breaker.state('uri'), 'closed')
+        # Any answer to the test call closes the circuit, not a timeout
+        for i in range(2):
+            self.assertRaises(fetchpolicy.TransientError, policy.call, 'uri', failing)
+        self.assertEqual(breaker.state('uri'), 'open')
+        def timeout(timeout):
+            raise fetchpolicy.TransportError('timeout')
+        clock[0] += 61
+        self.assertRaises(fetchpolicy.TransportError, policy.call, 'uri', timeout)
+        self.assertEqual(breaker.state('uri'), 'open')
+        clock[0] += 61
+        self.assertRaises(fetchpolicy.TransientError, policy.call, 'uri', failing)
+        self.assertEqual(breaker.state('uri'), 'closed')
+        for i in range(2):
+            self.assertRaises(fetchpolicy.TransientError, policy.call, 'uri', failing)
+        clock[0] += 61
+        self.assertRaises(fetchpolicy.FetchError, policy.call, 'uri', broken)
+        self.assertEqual(breaker.state('uri'), 'closed')
+        os.unlink(path)
+
+    def test_catalog_delta(self):
+        """Check the application of the catalog deltas"""
+        maps = synthetic_maps(5)
+        changed = dict(maps[1], description='Changed')
+        added = synthetic_maps(6)[5]
+        delta = {'version': '2', 'added': [added], 'changed': [changed],
+                 'removed': [maps[3]['endpoint']]}
+        version, result, is_delta = catalogsync.apply_reply(maps, delta)
+        self.assertTrue(is_delta)
+        self.assertEqual(version, '2')
+        self.assertEqual(result, [maps[0], changed, maps[2], maps[4], added])
+        self.assertEqual(catalogsync.apply_reply(maps, maps), (None, maps, False))
+        self.assertRaises(ValueError, catalogsync.apply_reply, None, delta)
+        # The store reads the old cache format
+        path = tempfile.mktemp('.json')
+        write_catalog(path, maps)
+        store = catalogsync.CatalogStore(path)
+        self.assertEqual(store.load(), (None, maps))
+        store.save('2', result)
+        self.assertEqual(store.load(), ('2', result))
+        os.unlink(path)
+
+    def test_utils_get_available_maps_delta(self):
+        """Check the incremental sync of the catalog"""
+        server = MockBCSServer(catalog_size=100, deltas=True).start()
+        try:
+            self.assertEqual(len(utils.get_available_maps(server.maps_uri, 0)), 90)
+            maps = server.maps[:50] + server.maps[51:] + synthetic_maps(101)[100:]
+            maps[0] = dict(maps[0], description='Changed')
+            server.set_maps(maps)
+            result = utils.get_available_maps(server.maps_uri, 0)
+            self.assertEqual(len(result), 90)
+            self.assertEqual(result[0]['description'], 'Changed')
+            store = catalogsync.CatalogStore(utils.cache_path(server.maps_uri))
+            self.assertEqual(store.load(), ('2', maps))
+            # Transient failure: the local copy, without a full fetch
+            server.error_rate = 1.0
+            self.assertEqual(len(utils.get_available_maps(server.maps_uri, 0)), 90)
+            self.assertEqual(utils.fetch_policy().breaker._load()[server.maps_uri]['failures'], 1)
+            utils.fetch_policy().breaker.success(server.maps_uri)
+            server.error_rate = 0.0
+            # Not supported: full catalog
+            server.deltas = False
+            server.set_maps(maps[:10])
+            self.assertEqual(len(utils.get_available_maps(server.maps_uri, 0)), 9)
+        finally:
+            server.stop()
+
+    def test_snapshot(self):
+        """Check the bundled catalog snapshot"""
+        maps = synthetic_maps(100)
+        path = tempfile.mktemp('.snapshot')
+        self.assertTrue(snapshot.write(path, maps, synthetic_providers(), '7') > 0)
+        snap = snapshot.read(path)
+        self.assertEqual(snap['maps'], maps)
+        self.assertEqual(snap['version'], '7')
+        self.assertIsNone(snapshot.loads(b'not a snapshot'))
+        # Used when there is no local copy, it seeds the local copy
+        bundled = snapshot.SNAPSHOT_FILE
+        snapshot.SNAPSHOT_FILE = path
+        maps_uri = 'http://127.0.0.1:1/v1/basemaps/snapshot'
+        try:
+            local_maps, providers = utils.get_local_catalog(maps_uri, 'http://127.0.0.1:1/v1/providers')
+            self.assertEqual(len(local_maps), 90)
+            self.assertEqual(len(providers), len(synthetic_providers()))
+            store = catalogsync.CatalogStore(utils.cache_path(maps_uri))
+            self.assertEqual(store.load(), ('7', maps))
+            # A catalog file is read at once
+            local_maps, providers = utils.get_local_catalog(self.local_maps_uri, self.local_providers_uri)
+            self.assertEqual(local_maps, utils.get_available_maps(self.local_maps_uri))
+            self.assertEqual(providers, utils.get_available_providers(self.local_providers_uri))
+        finally:
+            snapshot.SNAPSHOT_FILE = bundled
+            os.unlink(path)
+            os.unlink(utils.cache_path(maps_uri))
+
+    def test_federation(self):
+        """Check the merge of the additional catalog sources"""
+        maps = synthetic_maps(20)
+        path = tempfile.mktemp('.json')
+        with open(path, 'w') as f:
+            json.dump({'maps': maps[10:] + synthetic_maps(30)[20:],
+                       'providers': [{'id': 'own', 'name': 'Own tiles'}]}, f)
+        slow = MockBCSServer(catalog_size=5, latency=2).start()
+        try:
+            fetcher = federation.SourceFetcher([slow.maps_uri, path, path + '.missing']).start()
+            # The slow source does not delay the others
+            results = []
+            while len(results) < 2:
+                results.extend(fetcher.completed())
+            self.assertEqual(sorted(r[0] for r in results), sorted([path, path + '.missing']))
+            self.assertFalse(fetcher.finished())
+            results = fetcher.wait()
+            self.assertEqual([r[0] for r in results], [slow.maps_uri])
+        finally:
+            slow.stop()
+        self.assertIsNone(federation.SourceFetcher([path]).start().wait()[0][3])
+        self.assertIsNotNone(federation.SourceFetcher([path + '.missing']).start().wait()[0][3])
+        source = federation.SourceFetcher([path]).start().wait()
+        merged, providers = utils.merge_sources(self.local_maps_uri, maps[:15], synthetic_providers(), source)
+        # De-duplicated by endpoint, the first source wins
+        self.assertEqual(len(set(m['endpoint'] for m in merged)), len(merged))
+        self.assertEqual(merged[12]['source'], self.local_maps_uri)
+        self.assertEqual(merged[-1]['source'], path)
+        self.assertEqual(providers[-1]['name'], 'Own tiles')
+        # The maps of the sources are anonymous
+        self.assertFalse('authcfg=' in renderer.connection_string(merged[-1], 'abc1234'))
+        self.assertTrue('authcfg=' in renderer.connection_string(merged[0], 'abc1234'))
+        # The sources are merged without the Basemaps catalog
+        merged, providers = utils.merge_sources(self.local_maps_uri, None, None, source)
+        self.assertEqual(set(m['source'] for m in merged), set([path]))
+        # The remote sources are downloaded with the request function
+        requested = []
+
+        def request(url, timeout=None):
+            requested.append(url)
+            if url.endswith('missing'):
+                return 404, [], b''
+            return 200, [], json.dumps(maps[:3]).encode('utf-8')
+        results = federation.SourceFetcher(['http://example.com/maps', 'http://example.com/missing'],
+                                           request=request).start().wait()
+        self.assertEqual(sorted(requested), ['http://example.com/maps', 'http://example.com/missing'])
+        self.assertEqual(len(results[0][1]), 3)
+        self.assertIsNotNone(results[1][3])
+        os.unlink(path)
+
+    def test_utils_mirrors(self):
+        """Check that the catalog mirrors are raced and the fastest remembered"""
+        slow = MockBCSServer(catalog_size=100, latency=1).start()
+        fast = MockBCSServer(catalog_size=100).start()
+        uri = '###'.join((slow.maps_uri, fast.maps_uri))
+        try:
+            self.assertEqual(len(utils.get_available_maps(uri, 0)), 90)
+            self.assertEqual(utils.best_mirror(uri), fast.maps_uri)
+            utils.get_available_maps(uri, 0)
+            self.assertEqual(slow.request_count('/v1/basemaps/'), 1)
+            self.assertEqual(fast.request_count('/v1/basemaps/'), 2)
+        finally:
+            slow.stop()
+            fast.stop()
+
+    def test_mirror_latencies(self):
+        """Check the ranking of the mirrors"""
+        latencies = fetchpolicy.MirrorLatencies(width=2)
+        mirrors = fetchpolicy.split_uris('http://a/ ### http://b/###http://c/')
+        self.assertEqual(mirrors, ['http://a/', 'http://b/', 'http://c/'])
+        self.assertEqual(latencies.race(mirrors), ['http://a/', 'http://b/'])
+        latencies.record({'http://a/': 0.5, 'http://b/': 0.2})
+        self.assertEqual(latencies.race(mirrors), ['http://c/', 'http://b/'])
+        latencies.record({'http://c/': 0.3})
+        self.assertEqual(latencies.race(mirrors), ['http://b/'])
+        # The estimates follow the samples
+        for i in range(5):
+            latencies.record({'http://b/': 1.0})
+        self.assertEqual(latencies.rank(mirrors), ['http://c/', 'http://a/', 'http://b/'])
+
+    def test_cli_generate_default_project(self):
+        """Check the command line project generation"""
+        maps = utils.get_available_maps(self.local_maps_uri)
+        selected = cli.split_names(['Mapbox Streets###Mapbox Light', 'Recent Imagery'])
+        self.assertEqual(selected, ['Mapbox Streets', 'Mapbox Light', 'Recent Imagery'])
+        prj = cli.generate_default_project(maps, selected, ['Mapbox Light'],
+                                           self.tpl_path, None)
+        self.assertEqual(prj.count('<maplayer '), 3)
+        self.assertRaises(utils.BasemapsConfigError, cli.generate_default_project,
+                          maps, ['Not a map'], [], self.tpl_path, None)
+        self.assertRaises(utils.BasemapsConfigError, cli.generate_default_project,
+                          maps, [], [], self.tpl_path, None)
+
+    def test_cli_probe_opt_in(self):
+        """Check that the command line health check runs only with --probe"""
+        args = cli.parser().parse_args(['--probe-timeout', '5'])
+        self.assertEqual(cli.probe_timeout(args), 0)
+        args = cli.parser().parse_args(['--probe', '--probe-timeout', '5'])
+        self.assertEqual(cli.probe_timeout(args), 5)
+
+    def test_replace_default_project(self):
+        """Check the locked and atomic default project write with backup"""
+        path = utils.default_project_path()
+        saved = path + '.saved'
+        if os.path.isfile(path):
+            shutil.move(path, saved)
+        try:
+            self.assertIsNone(utils.replace_default_project(u'first'))
+            backup = utils.replace_default_project(u'second')
+            with open(backup) as f:
+                self.assertEqual(f.read(), 'first')
+            with open(path) as f:
+                self.assertEqual(f.read(), 'second')
+            os.unlink(backup)
+            self.assertFalse(utils.set_default_project(u'third'))
+            with fileutils.file_lock(path):
+                self.assertRaises(fileutils.LockTimeout, self._locked_write, path)
+        finally:
+            os.unlink(path)
+            if os.path.isfile(saved):
+                shutil.move(saved, path)
+
+    def _locked_write(self, path):
+        with fileutils.file_lock(path, timeout=0.2):
+            pass
+
+    @unittest.skipIf(os.name == 'nt', "No POSIX file modes")
+    def test_atomic_write_mode(self):
+        """Check that the atomic writes keep the mode of the files"""
+        path = tempfile.mktemp('.qgs')
+        umask = os.umask(0)
+        os.umask(umask)
+        try:
+            fileutils.atomic_write(path, u'first')
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o666 & ~umask)
+            os.chmod(path, 0o640)
+            fileutils.atomic_write(path, u'second')
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+            with open(path) as f:
+                self.assertEqual(f.read(), 'second')
+        finally:
+            os.unlink(path)
+
+    def test_provision_profiles(self):
+        """Provision the default project of two profiles in parallel"""
+        maps = utils.get_available_maps(self.local_maps_uri)
+        base = tempfile.mkdtemp()
+        profiles_file = os.path.join(base, 'profiles.json')
+        description = [
+            {'name': 'one', 'path': os.path.join(base, 'one'),
+             'settings': os.path.join(base, 'one.ini'),
+             'selected': ['Mapbox Streets', 'Mapbox Light'], 'visible': ['Mapbox Light']},
+            {'name': 'two', 'path': os.path.join(base, 'two'),
+             'selected': 'Recent Imagery', 'authcfg': 'abc1234'},
+        ]
+        with open(profiles_file, 'w') as f:
+            json.dump(description, f)
+        # Without the settings path, the --configpath settings file must exist
+        self.assertRaises(utils.BasemapsConfigError, provision.load_profiles, profiles_file)
+        os.makedirs(os.path.join(base, 'two', 'QGIS'))
+        settings_file = os.path.join(base, 'two', 'QGIS',
+                                     'QGIS3.ini' if utils.QGIS3 else 'QGIS2.ini')
+        open(settings_file, 'w').close()
+        profiles = provision.load_profiles(profiles_file)
+        self.assertEqual(profiles[1]['settings'], settings_file)
+        results = provision.provision_profiles(maps, profiles, self.tpl_path, 2)
+        self.assertEqual([r['profile'] for r in results], ['one', 'two'])
+        with open(os.path.join(base, 'one', 'project_default.qgs')) as f:
+            self.assertEqual(f.read().count('<maplayer '), 2)
+        with open(os.path.join(base, 'two', 'project_default.qgs')) as f:
+            self.assertTrue('authcfg=abc1234' in f.read())
+        settings = QSettings(profiles[1]['settings'], QSettings.IniFormat)
+        self.assertEqual(settings.value('boundlessbasemaps/selected'), 'Recent Imagery')
+        shutil.rmtree(base)
+
     def test_utils_get_available_providers(self):
         """Check available maps retrieval from local test json file"""        
         maps = utils.get_available_providers(os.path.join(self.data_dir,
@@ -183,6 +586,558 @@ class BasemapsTest(unittest.TestCase):
         self.assertEqual(self._standard_id(prj), open(
             os.path.join(self.data_dir, 'project_default_no_auth_reference.qgs'), 'rb').read())
 
+    def test_renderer_create_project(self):
+        """Check that the standard library renderer creates the reference projects"""
+        prj = renderer.create_project(
+            utils.get_available_maps(os.path.join(self.data_dir, 'basemaps_no_auth.json')),
+            ['OSM Basemap B'], self.tpl_path)
+        with open(os.path.join(self.data_dir, 'project_default_no_auth_reference.qgs'), 'rb') as f:
+            self.assertEqual(self._standard_id(prj), f.read().decode('utf-8'))
+        prj = renderer.create_project(
+            utils.get_available_maps(self.local_maps_uri),
+            ['Mapbox Light', 'Recent Imagery'], self.tpl_path, 'abc123')
+        with open(os.path.join(self.data_dir, 'project_default_reference.qgs'), 'rb') as f:
+            self.assertEqual(self._standard_id(prj), f.read().decode('utf-8'))
+        tmp = tempfile.mktemp('.qgs')
+        with open(tmp, 'wb+') as f:
+            f.write(prj.encode('utf-8'))
+        self.assertTrue(QgsProject.instance().read(QFileInfo(tmp)))
+        os.unlink(tmp)
+
+    def test_renderer_lazy_project(self):
+        """Check that hidden maps are placeholders loaded on demand"""
+        prj = utils.create_default_project(
+            utils.get_available_maps(self.local_maps_uri),
+            ['Mapbox Light'], self.tpl_path, lazy=True)
+        tmp = tempfile.mktemp('.qgs')
+        with open(tmp, 'wb+') as f:
+            f.write(prj.encode('utf-8'))
+        self.assertTrue(QgsProject.instance().read(QFileInfo(tmp)))
+        os.unlink(tmp)
+        root = QgsProject.instance().layerTreeRoot()
+        self.assertEqual(len(root.findLayers()), 1)
+        placeholders = [n for n in root.children() if utils.is_placeholder(n)]
+        self.assertEqual(len(placeholders), 7)
+        layer = utils.load_placeholder(placeholders[0])
+        self.assertTrue(layer.isValid())
+        self.assertEqual(len(root.findLayers()), 2)
+        self.assertEqual(root.children()[0].layerId(), layer.id())
+
+    def test_renderer_zoom_levels(self):
+        """Check the zoom limits and scale based visibility of the layers"""
+        maps = utils.get_available_maps(self.local_maps_uri)[:2]
+        levels = renderer.parse_zoom_levels(
+            '%s:3:19###%s::12' % (maps[0]['name'], maps[1]['name']))
+        self.assertEqual(levels[maps[1]['name']], (None, 12))
+        self.assertRaises(utils.BasemapsConfigError, renderer.parse_zoom_levels, 'wrong')
+        maps = renderer.apply_zoom_levels(maps, levels)
+        layers = renderer.layer_definitions(maps)
+        self.assertTrue(layers[0]['datasource'].endswith('&zmax=19&zmin=3'))
+        self.assertIn('minimumScale="533.182" maximumScale="1.39771e+08" type="raster" '
+                      'hasScaleBasedVisibilityFlag="1"', layers[0]['xml'])
+        self.assertIn('minimumScale="68247.3" maximumScale="1e+08"', layers[1]['xml'])
+        self.assertEqual(renderer.zoom_limits(maps[1]), (None, 12))
+        tmp = tempfile.mktemp('.qgs')
+        with open(tmp, 'wb+') as f:
+            f.write(renderer.render_project(renderer.read_template(self.tpl_path),
+                                            layers, []).encode('utf-8'))
+        self.assertTrue(QgsProject.instance().read(QFileInfo(tmp)))
+        os.unlink(tmp)
+        layer = QgsProject.instance().layerTreeRoot().findLayers()[0].layer()
+        self.assertTrue(layer.hasScaleBasedVisibility())
+
+    def test_renderer_layer_ids(self):
+        """Check that the layers with the same name get different ids"""
+        maps = utils.get_available_maps(self.local_maps_uri)[:1] * 2
+        maps.append(dict(maps[0], name=maps[0]['name'].replace(' ', '-')))
+        ids = [l['id'] for l in renderer.layer_definitions(maps)]
+        self.assertEqual(len(set(ids)), 3)
+
+    def test_tile_templates(self):
+        """Check the subdomain and mirror endpoints of the test catalog"""
+        maps = utils.get_available_maps(os.path.join(self.data_dir, 'basemaps_subdomains.json'))
+        self.assertEqual(len(maps), 2)
+        for m in maps:
+            templates = tileproxy.tile_templates(m)
+            self.assertEqual(len(templates), 3)
+            self.assertEqual(tileproxy.shard(templates, 5, 3, 4), templates[1])
+            self.assertEqual(tileproxy.shard(templates, 5, 4, 3), templates[1])
+            self.assertEqual(tileproxy.shard(templates, 5, 4, 4), templates[2])
+        self.assertIn('url=http%3A//a.tile.openstreetmap.org/',
+                      renderer.connection_string(maps[0]))
+
+    def test_tile_routes(self):
+        """Check the routes of the tile proxy and the routed data sources"""
+        maps = utils.get_available_maps(os.path.join(self.data_dir, 'basemaps_subdomains.json'))
+        route = tileproxy.route(maps[0], 'abc1234')
+        self.assertEqual(route['templates'], tileproxy.tile_templates(maps[0]))
+        self.assertEqual(route['url'], route['templates'][0])
+        single = {'name': 'Single', 'endpoint': 'https://tiles.example.com/{z}/{x}/{y}.png'}
+        # Every map is routed
+        self.assertEqual(tileproxy.route(single)['templates'], [single['endpoint']])
+        # The credentials are only sent to the hosts of the endpoint
+        mirrored = dict(single, mirrors=['https://tiles2.example.com', 'https://tiles.example.co.uk',
+                                         'https://TILES.example.com:8443'])
+        self.assertEqual(len(tileproxy.route(mirrored)['templates']), 4)
+        self.assertEqual(tileproxy.route(mirrored, 'abc1234')['templates'],
+                         ['https://tiles.example.com/{z}/{x}/{y}.png',
+                          'https://TILES.example.com:8443/{z}/{x}/{y}.png'])
+        self.assertEqual(len(tileproxy.route(maps[0], 'abc1234')['templates']), 3)
+        # The catalog maps have a single host
+        catalog = utils.get_available_maps(self.local_maps_uri)
+        self.assertEqual(len(tileproxy.TileProxy().set_routes(catalog, 'abc1234')), len(catalog))
+        routes = {route['name']: route}
+        proxy_url = lambda name: 'http://127.0.0.1:1234/tile/{z}/{x}/{y}?n=%s' % name
+        source = renderer.connection_string(dict(maps[0], maxZoom=5), 'abc1234')
+        routed = tileproxy.routed_source(source, routes, proxy_url)
+        self.assertIn('url=http%3A//127.0.0.1%3A1234/', routed)
+        self.assertIn('zmax=5', routed)
+        self.assertNotIn('authcfg', routed)
+        # The levels synthesized past the maximum zoom
+        self.assertIn('zmax=11', tileproxy.routed_source(source, routes, proxy_url, 6))
+        self.assertEqual(tileproxy.source_route(routed, routes), route)
+        self.assertIsNone(tileproxy.source_route(source, routes))
+        # Other authcfg, other maps
+        self.assertIsNone(tileproxy.routed_source(renderer.connection_string(maps[0]),
+                                                  routes, proxy_url))
+        self.assertIsNone(tileproxy.routed_source(renderer.connection_string(single, 'abc1234'),
+                                                  routes, proxy_url))
+
+    def test_tile_proxy(self):
+        """Check the tiles fetched through the local proxy"""
+        server = MockBCSServer().start()
+        proxy = tileproxy.TileProxy().start()
+        try:
+            self.assertEqual(len(set(proxy.ports)), tileproxy.LISTENERS)
+            m = {'name': 'Mock', 'subdomains': ['127.0.0.1', 'localhost'],
+                 'endpoint': 'http://{s}:%d/v1/basemaps/mock/{z}/{x}/{y}.png' % server.port}
+            proxy.set_routes([m])
+            url = proxy.url('Mock')
+            for x in range(4):
+                self.assertEqual(urlopen(tileproxy.tile_url(url, 3, x, 0)).read()[:4],
+                                 b'\x89PNG')
+            self.assertEqual(server.request_count('/v1/basemaps/mock'), 4)
+            # Cached
+            urlopen(tileproxy.tile_url(url, 3, 0, 0)).read()
+            self.assertEqual(server.request_count('/v1/basemaps/mock'), 4)
+            # Only the stored routes are served
+            port = proxy.ports[0]
+            self.assertRaises(Exception, urlopen,
+                              'http://127.0.0.1:%d/tile/1/1/1?n=Other' % port)
+            self.assertRaises(Exception, urlopen,
+                              'http://127.0.0.1:%d/tile/1/1/1?t=file:///etc/passwd' % port)
+            # The ports of a running proxy are not shared
+            self.assertRaises(socket.error, tileproxy.TileProxy(port).start)
+        finally:
+            proxy.stop()
+            server.stop()
+
+    def test_tile_stats(self):
+        """Check the tile traffic statistics of the proxy"""
+        path = tempfile.mktemp('.json')
+        stats = tilestats.TileStats(path)
+        server = MockBCSServer().start()
+        proxy = tileproxy.TileProxy(stats=stats).start()
+        try:
+            m = {'name': 'Mock', 'provider': 'mock', 'subdomains': ['127.0.0.1', 'localhost'],
+                 'endpoint': 'http://{s}:%d/v1/basemaps/mock/{z}/{x}/{y}.png' % server.port}
+            proxy.set_routes([m])
+            url = proxy.url('Mock')
+            for x in (0, 1, 2, 3, 0):
+                urlopen(tileproxy.tile_url(url, 3, x, 0)).read()
+        finally:
+            proxy.stop()
+            server.stop()
+        stats.flush()
+        # A later session adds up
+        stats = tilestats.TileStats(path)
+        stats.record('Mock', 'mock', 100, latency=0.5)
+        stats.record('Other', 'mock', error=True)
+        report = stats.report()
+        os.unlink(path)
+        layer = report['layers'][0]
+        self.assertEqual(layer['layer'], 'Mock')
+        self.assertEqual(layer['requests'], 6)
+        self.assertEqual(layer['hits'], 1)
+        self.assertAlmostEqual(layer['hit_ratio'], 1 / 6.0)
+        self.assertTrue(layer['p50'] <= layer['p95'] <= layer['p99'])
+        self.assertTrue(0.5 <= layer['p99'] < 0.6)
+        provider = report['providers'][0]
+        self.assertEqual(provider['requests'], 7)
+        self.assertEqual(provider['errors'], 1)
+
+    def test_tile_store(self):
+        """Check the tile cache shared by the QGIS instances"""
+        path = tempfile.mktemp('.sqlite')
+        now = [1000.0]
+        clock = lambda: now[0]
+        stores = [tilestore.TileStore(path, 100 * 1000, 3600, clock).start() for i in range(2)]
+        try:
+            # Concurrent writers, the readers see the tiles of the others
+            def write(store, row):
+                for x in range(50):
+                    store.put('set', 10, x, row, 'image/png', ('%d%02d' % (row, x)).encode() * 100)
+                store.flush()
+            threads = [threading.Thread(target=write, args=(store, row))
+                       for row, store in enumerate(stores)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(stores[1].get('set', 10, 3, 0), ('image/png', b'003' * 100))
+            self.assertEqual(stores[0].get('set', 10, 49, 1)[1], b'149' * 100)
+            self.assertIsNone(stores[0].get('set', 10, 50, 1))
+            # One evictor at a time
+            self.assertTrue(stores[0].claim_eviction())
+            self.assertFalse(stores[1].claim_eviction())
+            self.assertTrue(stores[0].claim_eviction())
+            now[0] += 3 * tilestore.EVICT_INTERVAL + 1
+            self.assertTrue(stores[1].claim_eviction())
+            # The recently read tiles are kept
+            for store in stores:
+                store.flush()
+            self.assertEqual(stores[1].size(), 30000)
+            stores[1].max_bytes = 10000
+            self.assertEqual(stores[1].evict(), 70)
+            self.assertEqual(stores[1].size(), 9000)
+            self.assertIsNotNone(stores[0].get('set', 10, 3, 0))
+            self.assertIsNotNone(stores[0].get('set', 10, 49, 1))
+            # Expired
+            now[0] += 3600
+            self.assertIsNone(stores[0].get('set', 10, 3, 0))
+            # Served by the proxy of another instance
+            server = MockBCSServer().start()
+            proxies = [tileproxy.TileProxy(store=stores[i]).start() for i in range(2)]
+            try:
+                m = {'name': 'Mock', 'subdomains': ['127.0.0.1', 'localhost'],
+                     'endpoint': 'http://{s}:%d/v1/basemaps/mock/{z}/{x}/{y}.png' % server.port}
+                for proxy in proxies:
+                    proxy.set_routes([m])
+                first = urlopen(tileproxy.tile_url(proxies[0].url('Mock'), 3, 1, 2)).read()
+                stores[0].flush()
+                response = urlopen(tileproxy.tile_url(proxies[1].url('Mock'), 3, 1, 2))
+                self.assertEqual(response.read(), first)
+                self.assertEqual(response.info().get('Content-Type'), 'image/png')
+                self.assertEqual(server.request_count('/v1/basemaps/mock/'), 1)
+            finally:
+                for proxy in proxies:
+                    proxy.stop()
+                server.stop()
+        finally:
+            for store in stores:
+                store.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+
+    def test_tile_store_dedupe(self):
+        """Check that the identical tiles are stored once"""
+        path = tempfile.mktemp('.sqlite')
+        store = tilestore.TileStore(path).start()
+        try:
+            sea = b'sea' * 100
+            for x in range(10):
+                store.put('set', 5, x, 0, 'image/png', sea)
+                store.put('other', 5, x, 0, 'image/png', sea)
+            store.put('set', 5, 0, 1, 'image/png', b'land' * 100)
+            store.flush()
+            stats = store.stats()
+            self.assertEqual((stats['tiles'], stats['blobs']), (21, 2))
+            self.assertEqual(stats['bytes'], 700)
+            self.assertEqual(stats['bytes_saved'], 19 * 300)
+            self.assertAlmostEqual(stats['dedupe_ratio'], 10.5)
+            self.assertEqual(store.get('other', 5, 9, 0), ('image/png', sea))
+            # A blob is deleted with its last tile
+            store.put('set', 5, 0, 1, 'image/png', sea)
+            store.flush()
+            self.assertEqual(store.stats()['blobs'], 1)
+            store.max_bytes = 100
+            self.assertEqual(store.evict(), 21)
+            self.assertEqual(store.size(), 0)
+        finally:
+            store.close()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+
+    def test_seed(self):
+        """Check the seeding of the tile cache and its dedupe report"""
+        self.assertEqual(seed.extent_tiles(-1, -1, 1, 1, 1), [(1, 0, 0), (1, 0, 1), (1, 1, 0), (1, 1, 1)])
+        xmin, ymin = seed.lonlat_to_mercator(10, 40)
+        xmax, ymax = seed.lonlat_to_mercator(11, 41)
+        tiles = seed.extent_tiles(xmin, ymin, xmax, ymax, 10)
+        self.assertEqual((tiles[0], tiles[-1], len(tiles)), ((10, 540, 383), (10, 543, 387), 20))
+        self.assertEqual(seed.parse_zooms('2-4'), [2, 3, 4])
+        path = tempfile.mktemp('.sqlite')
+        server = MockBCSServer().start()
+        store = tilestore.TileStore(path).start()
+        try:
+            proxy = tileproxy.TileProxy(cache_size=0, store=store)
+            m = {'name': 'Mock', 'endpoint': 'http://127.0.0.1:%d/v1/basemaps/mock/{z}/{x}/{y}.png' % server.port}
+            tiles = [t for z in range(4) for t in seed.extent_tiles(-1e8, -1e8, 1e8, 1e8, z)]
+            report = seed.seed(proxy, m, tiles)
+            # The mock tiles have one color per zoom level
+            self.assertEqual((report['tiles'], report['fetched'], report['errors']), (85, 85, 0))
+            self.assertEqual(report['blobs'], 4)
+            self.assertAlmostEqual(report['dedupe_ratio'], 85 / 4.0)
+            self.assertEqual(report['bytes_saved'], report['logical_bytes'] - store.size())
+            report = seed.seed(proxy, m, tiles)
+            self.assertEqual((report['cached'], report['fetched']), (85, 0))
+            self.assertEqual(server.request_count('/v1/basemaps/mock/'), 85)
+        finally:
+            store.close()
+            server.stop()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+
+    def test_overzoom(self):
+        """Check the synthesis of the tiles from their cached ancestors"""
+        # Parent tile with a color per quadrant
+        colors = [QColor(255, 0, 0), QColor(0, 255, 0), QColor(0, 0, 255), QColor(255, 255, 0)]
+        image = QImage(256, 256, QImage.Format_RGB32)
+        for i, color in enumerate(colors):
+            for px in range(128):
+                for py in range(128):
+                    image.setPixel((i % 2) * 128 + px, (i // 2) * 128 + py, color.rgb())
+        ba = QByteArray()
+        buf = QBuffer(ba)
+        buf.open(QIODevice.WriteOnly)
+        image.save(buf, 'PNG')
+        buf.close()
+        path = tempfile.mktemp('.sqlite')
+        stats = tilestats.TileStats()
+        server = MockBCSServer(error_rate=1.0, error_status=404).start()
+        store = tilestore.TileStore(path).start()
+        try:
+            m = {'name': 'Mock', 'provider': 'mock',
+                 'endpoint': 'http://127.0.0.1:%d/v1/basemaps/mock/{z}/{x}/{y}.png' % server.port}
+            templates = tileproxy.tile_templates(m)
+            store.put(templates[0], 2, 1, 1, 'image/png', bytes(ba.data()))
+            synthesize = overzoom.Overzoom(store)
+            self.assertEqual(synthesize.ancestor(templates[0], 5, 8, 15)[:3], (2, 1, 1))
+            self.assertIsNone(synthesize.ancestor(templates[0], 5, 0, 0))
+            proxy = tileproxy.TileProxy(stats=stats, store=store, synthesize=synthesize)
+            # Bottom left quadrant of the parent
+            status, headers, body = proxy.fetch(templates, 3, 2, 3, key=('Mock', 'mock'))
+            self.assertEqual(status, 200)
+            tile = QImage.fromData(body)
+            self.assertEqual((tile.width(), tile.height()), (256, 256))
+            self.assertEqual(QColor(tile.pixel(128, 128)), colors[2])
+            # Three levels deeper, from the decoded parent
+            status, headers, body = proxy.fetch(templates, 5, 15, 8, key=('Mock', 'mock'))
+            self.assertEqual(QColor(QImage.fromData(body).pixel(10, 10)), colors[1])
+            # No ancestor: the upstream error
+            self.assertEqual(proxy.fetch(templates, 3, 0, 0, key=('Mock', 'mock'))[0], 404)
+            proxy.stop()
+        finally:
+            store.close()
+            server.stop()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+        layer = stats.report()['layers'][0]
+        self.assertEqual((layer['requests'], layer['synthesized'], layer['errors']), (3, 2, 3))
+
+    def test_prefetch(self):
+        """Check the prefetch plan of the print layout pages and its download"""
+        server = MockBCSServer().start()
+        m = {'name': 'Mock', 'provider': 'mock', 'subdomains': ['127.0.0.1', 'localhost'],
+             'endpoint': 'http://{s}:%d/v1/basemaps/mock/{z}/{x}/{y}.png' % server.port}
+        routes = {'Mock': tileproxy.route(m)}
+        direct = renderer.connection_string(dict(m, maxZoom=5), 'abc1234')
+        source = tileproxy.routed_source(renderer.connection_string(dict(m, maxZoom=5)), routes,
+                                         lambda name: 'http://127.0.0.1:8123/tile/{z}/{x}/{y}?n=' + name)
+        layer = prefetch.parse_source(source, routes)
+        self.assertEqual(layer['templates'], tileproxy.tile_templates(m))
+        self.assertEqual((layer['name'], layer['provider'], layer['authcfg'], layer['zmax'],
+                          layer['routed']), ('Mock', 'mock', None, 5, True))
+        # The prefetch stops at the maximum zoom of the map
+        routes['Mock']['zmax'] = 5
+        overzoomed = tileproxy.routed_source(renderer.connection_string(dict(m, maxZoom=5)), routes,
+                                             lambda name: 'http://127.0.0.1:8123/tile/{z}/{x}/{y}?n=' + name, 6)
+        self.assertEqual(prefetch.parse_source(overzoomed, routes)['zmax'], 5)
+        layer = prefetch.parse_source(direct, routes)
+        self.assertEqual((layer['templates'], layer['authcfg'], layer['routed']),
+                         (tileproxy.tile_templates(m)[:1], 'abc1234', False))
+        self.assertIsNone(prefetch.parse_source('contextualWMSLegend=0&crs=EPSG:4326&url=http://x'))
+        self.assertEqual(prefetch.zoom_for_resolution(156543.03392804097), 0)
+        self.assertEqual(prefetch.zoom_for_resolution(1.2), 17)
+        self.assertEqual(prefetch.zoom_for_resolution(1.2, zmax=5), 5)
+        plan = prefetch.PrefetchPlan(routes)
+        # The layers not using the proxy do not read the tile cache
+        plan.add(direct, (-1000, -1000, 1000, 1000), 512)
+        self.assertEqual(plan.tile_count(), 0)
+        # Two overlapping pages at zoom 3, within the tile edges: 4 + 4
+        # tiles, 2 shared
+        half = renderer.WEB_MERCATOR_MAX / 2 - 1
+        quarter = renderer.WEB_MERCATOR_MAX / 4 - 1
+        plan.add(source, (-half, -quarter, -1, quarter), 512)
+        plan.add(source, (-quarter, -quarter, quarter, quarter), 512)
+        plan.pages = 2
+        self.assertEqual(plan.tile_count(), 6)
+        path = tempfile.mktemp('.sqlite')
+        store = tilestore.TileStore(path).start()
+        try:
+            proxy = tileproxy.TileProxy(cache_size=0, store=store)
+            self.assertEqual(plan.missing(store), {source: 6})
+            self.assertAlmostEqual(prefetch.estimate_saving(plan.missing(store), {source: 0.6}), 0.6)
+            report = prefetch.prefetch(proxy, plan)
+            self.assertEqual((report['pages'], report['tiles'], report['fetched'], report['errors']),
+                             (2, 6, 6, 0))
+            self.assertIn('saved_s', report)
+            self.assertEqual(plan.missing(store), {source: 0})
+            report = prefetch.prefetch(proxy, plan)
+            self.assertEqual((report['cached'], report['fetched']), (6, 0))
+            self.assertEqual(server.request_count('/v1/basemaps/mock/'), 6)
+            # Progress and cancellation
+            plan.add(source, (-half, -quarter, -1, quarter), 1024)
+            progress = []
+            report = prefetch.prefetch(proxy, plan, progress=lambda done, total: progress.append((done, total)))
+            self.assertEqual(progress[-1], (plan.tile_count(), plan.tile_count()))
+            self.assertFalse(report['cancelled'])
+            plan.add(source, (-half, -quarter, -1, quarter), 2048)
+            report = prefetch.prefetch(proxy, plan, cancelled=lambda: True)
+            self.assertTrue(report['cancelled'])
+            self.assertEqual((report['done'], report['fetched']), (0, 0))
+            proxy.stop()
+        finally:
+            store.close()
+            server.stop()
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+
+    def test_rate_limit(self):
+        """Check the provider quotas of the tile proxy"""
+        self.assertEqual(ratelimit.catalog_limits([{'id': 'a', 'rateLimit': 20, 'rateBurst': 40},
+                                                   {'id': 'b'}], [{'provider': 'a'}, {'provider': 'b'}]),
+                         {'a': (20, 40)})
+        # The maps of the catalog name their provider, the providers have
+        # an id
+        with open(self.local_providers_uri) as f:
+            providers = json.load(f)
+        for p in providers:
+            if p['id'] == 'mapbox':
+                p['rateLimit'] = 20
+        maps = utils.get_available_maps(self.local_maps_uri)
+        limits = ratelimit.catalog_limits(providers, maps)
+        self.assertEqual(limits, {'Mapbox': (20, None)})
+        proxy = tileproxy.TileProxy(limits=limits)
+        mapbox = [m for m in maps if m['name'].startswith('Mapbox')][0]
+        self.assertEqual(proxy.limiter(tileproxy.provider(mapbox)).limit, 20)
+        limits = ratelimit.parse_limits('Mapbox:20:###Planet:5:10')
+        self.assertEqual(limits, {'Mapbox': (20, None), 'Planet': (5, 10)})
+        self.assertEqual(ratelimit.parse_limits(ratelimit.format_limits(limits)), limits)
+        self.assertRaises(ValueError, ratelimit.parse_limits, 'Mapbox:fast:')
+        self.assertEqual(ratelimit.retry_after([('Retry-After', '7')]), 7)
+        self.assertEqual(ratelimit.retry_after([('retry-after', 'Wed, 21 Oct 2015 07:28:00 GMT')],
+                                               now=1445412470), 10)
+        self.assertIsNone(ratelimit.retry_after([('Content-Type', 'image/png')]))
+        # Token bucket on a fake clock
+        now = [0.0]
+        limiter = ratelimit.RateLimiter(2, clock=lambda: now[0])
+        self.assertEqual([limiter.reserve() for i in range(3)], [0, 0, 0.5])
+        now[0] = 0.5
+        self.assertEqual(limiter.reserve(), 0)
+        # 3 requests in 0.5 s hit the quota: the pause of Retry-After and
+        # half the rate, recovered by the successful requests
+        limiter.throttled(3)
+        self.assertEqual(limiter.reserve(), 3)
+        self.assertEqual((limiter.limit, limiter.rate), (2, 1))
+        for i in range(10):
+            limiter.succeeded()
+        self.assertAlmostEqual(limiter.rate, 2)
+        # The quota of a provider without one is learned from the first 429
+        limiter = ratelimit.RateLimiter(clock=lambda: now[0])
+        for i in range(20):
+            now[0] = 10 + i * 0.1
+            self.assertEqual(limiter.reserve(), 0)
+        limiter.throttled()
+        self.assertAlmostEqual(limiter.limit, 20 / 1.9 * ratelimit.MARGIN)
+        self.assertAlmostEqual(limiter.rate, limiter.limit * ratelimit.BACKOFF)
+        # The responses to the requests sent before the pause only extend it
+        rate = limiter.rate
+        limiter.throttled(2)
+        self.assertEqual((limiter.rate, limiter.reserve()), (rate, 2))
+        self.assertRaises(ratelimit.Cancelled, limiter.acquire, lambda: True)
+        self.assertFalse(limiter.acquire(timeout=0.1))
+        server = MockBCSServer(quota=5).start()
+        stats = tilestats.TileStats()
+        try:
+            m = {'name': 'Mock', 'provider': 'mock',
+                 'endpoint': 'http://127.0.0.1:%d/v1/basemaps/mock/{z}/{x}/{y}.png' % server.port}
+            templates = tileproxy.tile_templates(m)
+            key = ('Mock', 'mock')
+            # Over the quota: the tiles wait and are requested again
+            path = tempfile.mktemp('.sqlite')
+            store = tilestore.TileStore(path).start()
+            proxy = tileproxy.TileProxy(stats=stats, store=store)
+            try:
+                report = seed.seed(proxy, m, seed.extent_tiles(-1e8, -1e8, 1e8, 1e8, 4)[:15])
+            finally:
+                store.close()
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(path + suffix):
+                        os.unlink(path + suffix)
+            self.assertEqual((report['fetched'], report['errors']), (15, 0))
+            self.assertTrue(stats.report()['layers'][0]['throttled'] > 0)
+            self.assertIsNotNone(proxy.limiter('mock').limit)
+            # Within the configured quota, the cache hits do not wait and
+            # the waiting requests can be cancelled
+            proxy = tileproxy.TileProxy(limits={'mock': (0.5, 1)})
+            self.assertEqual(proxy.fetch(templates, 5, 0, 0, key=key)[0], 200)
+            count = server.request_count('/v1/basemaps/mock/')
+            self.assertRaises(ratelimit.Cancelled, proxy.fetch, templates, 5, 1, 0, None, key,
+                              lambda: True)
+            self.assertEqual(proxy.fetch(templates, 5, 0, 0, key=key)[0], 200)
+            self.assertEqual(server.request_count('/v1/basemaps/mock/'), count)
+            proxy.stop()
+        finally:
+            server.stop()
+
+    def test_probe_maps(self):
+        """Check the health probe of the endpoints"""
+        server = MockBCSServer(catalog_size=5).start()
+        try:
+            maps = server.maps + [{'name': 'Dead', 'endpoint': 'http://127.0.0.1:1/{z}/{x}/{y}.png'}]
+            results = probe.probe_maps(maps, netfetch.request_all, timeout=5)
+            self.assertEqual(probe.failed_maps(results), ['Dead'])
+            self.assertEqual(results[maps[0]['name']]['status'], 200)
+            self.assertTrue(results[maps[0]['name']]['latency'] >= 0)
+            self.assertIsNone(results['Dead']['latency'])
+            server.error_rate = 1.0
+            results = probe.probe_maps(server.maps, netfetch.request_all, timeout=5)
+            self.assertEqual(results[maps[0]['name']]['error'], 'HTTP 503')
+            # Global timeout: not checked, not failed
+            server.error_rate = 0.0
+            server.latency = 2
+            results = probe.probe_maps(server.maps, netfetch.request_all, timeout=0.5)
+            self.assertEqual(probe.failed_maps(results), [])
+            self.assertEqual(len(probe.unchecked_maps(results)), 5)
+            self.assertFalse(results[maps[0]['name']]['checked'])
+        finally:
+            server.stop()
+
+    def test_perf_spans(self):
+        """Check that performance spans are written to the JSON log"""
+        log_file = tempfile.mktemp('.jsonl')
+        perf.configure(True, log_file)
+        try:
+            utils.get_available_maps(self.local_maps_uri)
+        finally:
+            perf.configure(False)
+        with open(log_file) as f:
+            records = [json.loads(l) for l in f]
+        os.unlink(log_file)
+        spans = dict((r['span'], r) for r in records)
+        self.assertEqual(spans['catalog.parse']['items'], 10)
+        self.assertEqual(spans['catalog.filter']['supported'], 8)
+        self.assertTrue(spans['catalog.parse']['bytes'] > 0)
+        self.assertTrue(spans['catalog.filter']['duration_ms'] >= 0)
+        # Disabled: nothing is recorded
+        self.assertIs(perf.span('noop'), perf.span('noop'))
+
     def test_utils_create_oauth(self):
         """Create an authentication configuration"""
         self.assertEquals(utils.setup_oauth('username', 'password', TOKEN_URI, TEST_AUTHCFG_ID, TEST_AUTHCFG_NAME), TEST_AUTHCFG_ID)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    wizard_benchmarks.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Headless benchmarks of the setup wizard with synthetic catalogs of
+increasing size.
+
+The wizard is built on the Qt offscreen platform, for every catalog size
+the following steps are measured:
+
+- map_selection_build: MapSelectionPage.initializePage (catalog parsing
+  and tree build)
+- toggle_all_maps: checking and unchecking the "All maps" root item
+- is_complete: a single MapSelectionPage.isComplete call
+- accept: SetupWizard.accept
+
+Run with a standalone QGIS:
+
+    python -m boundlessbasemaps.tests.wizard_benchmarks --output wizard.json
+
+or through the paver task:
+
+    paver benchmark --wizard -o wizard.json
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+
+# Must be set before the QApplication is created
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from boundlessbasemaps.tests.synthetic import (synthetic_maps,
+                                               synthetic_providers,
+                                               write_catalog)
+from boundlessbasemaps.tests.benchmarks import (measure, metadata, compare,
+                                                init_qgis, parse_sizes)
+
+
+DEFAULT_SIZES = [10, 100, 500, 1000, 2000, 5000]
+
+
+def run_benchmarks(sizes, repeat, workdir):
+    """Run the wizard benchmarks and return the list of results"""
+    from qgis.PyQt.QtCore import Qt
+    from boundlessbasemaps.gui.setupwizard import SetupWizard
+    results = []
+    providers_uri = write_catalog(os.path.join(workdir, 'providers.json'),
+                                  synthetic_providers())
+
+    def add(name, size, func, setup):
+        result = measure(func, repeat, setup)
+        result.update({'benchmark': name, 'size': size, 'params': {}})
+        results.append(result)
+        print('%-20s %6d %10.4f s %s KiB' % (name, size, result['median_s'],
+                                             result['peak_kib']))
+
+    for size in sizes:
+        maps_uri = write_catalog(os.path.join(workdir, 'basemaps_%d.json' % size),
+                                 synthetic_maps(size))
+
+        def new_wizard():
+            """A wizard showing the intro page, next() opens the map selection"""
+            w = SetupWizard({
+                "token_uri": "http://localhost/token",
+                "maps_uri": maps_uri,
+                "providers_uri": providers_uri,
+                "username": "username",
+                "password": "password",
+            })
+            w.show()
+            return w
+
+        def map_selection():
+            w = new_wizard()
+            w.next()
+            return w
+
+        def conclusion():
+            w = map_selection()
+            w.next()
+            return w
+
+        def toggle(w):
+            root = w.currentPage().tree.topLevelItem(0)
+            root.setCheckState(0, Qt.Checked)
+            root.setCheckState(0, Qt.Unchecked)
+
+        add('map_selection_build', size, lambda w: w.next(), new_wizard)
+        add('toggle_all_maps', size, toggle, map_selection)
+        add('is_complete', size, lambda w: w.currentPage().isComplete(), map_selection)
+        add('accept', size, lambda w: w.accept(), conclusion)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('-o', '--output', help='JSON file for the results')
+    parser.add_argument('-s', '--sizes', type=parse_sizes, default=DEFAULT_SIZES,
+                        help='comma separated catalog sizes')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('-c', '--compare',
+                        help='previous JSON results to check for regressions')
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp()
+    qgs = init_qgis(os.path.join(workdir, 'profile'), True)
+    try:
+        output = {
+            'metadata': metadata(),
+            'results': run_benchmarks(args.sizes, args.repeat, workdir),
+        }
+    finally:
+        qgs.exitQgis()
+        shutil.rmtree(workdir, True)
+
+    # Scaling curve: median time of every step by catalog size
+    print('\n%-20s %s' % ('size', ' '.join('%10d' % s for s in args.sizes)))
+    for name in ('map_selection_build', 'toggle_all_maps', 'is_complete', 'accept'):
+        medians = dict((r['size'], r['median_s']) for r in output['results']
+                       if r['benchmark'] == name)
+        print('%-20s %s' % (name, ' '.join('%10.4f' % medians[s] for s in args.sizes)))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), output)
+        for name, size, params, before, after in regressions:
+            print('REGRESSION %s size=%d: %.4f s -> %.4f s' % (name, size, before, after))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,522 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    tileproxy.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Basemaps tile path: XYZ endpoints with many hosts and local tile proxy.
+
+A catalog entry can spread its tiles over many hosts, either with a
+subdomain template:
+
+    "endpoint": "https://{s}.tiles.example.com/{z}/{x}/{y}.png",
+    "subdomains": ["a", "b", "c"]
+
+("subdomains" is optional and defaults to a, b, c) or with a list of mirror
+hosts, which replace the scheme and host of the endpoint:
+
+    "endpoint": "https://tiles.example.com/{z}/{x}/{y}.png",
+    "mirrors": ["https://tiles2.example.com", "https://tiles3.example.com"]
+
+Every tile is always fetched from the same host, chosen from its
+coordinates, so that its URL is stable and caches well.
+
+QGIS XYZ layers can only use one URL template: the layers of the default
+project keep the URL of the first host, and when the tile proxy is
+enabled (tile_proxy setting) the plugin reroutes them in the running
+session only to a proxy on localhost, which fetches the tiles from all
+the hosts. The project files always keep the URLs of the hosts.
+
+The proxy only serves the routes registered from the stored catalog (see
+TileProxy.set_routes()): its URLs carry the map name, never a template,
+so it can not be used to fetch arbitrary URLs. Every basemap layer is
+routed, whatever its number of hosts, so that the statistics, the shared
+cache and the quotas apply to all of them. The credentials of the authcfg
+are only sent to the hosts of the endpoint itself (its subdomains, or the
+mirrors with the same host name), never to other mirrors, and the requests
+of QGIS are not forwarded with their Authorization header: the fetcher
+(see netfetch.py in QGIS, persistent connections of the standard library
+otherwise) applies the authcfg of the route itself.
+
+The proxy of each QGIS instance listens on its own LISTENERS free ports
+and the layers are spread over them, so that the layers do not share the
+limit of parallel requests QGIS sets per host and port. Each layer is
+still fetched at most that many tiles at a time.
+The map and provider names key the traffic statistics (see
+tilestats.py). Besides its memory cache, the proxy can keep the
+tiles in the cache shared by the QGIS instances (see tilestore.py),
+synthesize the tiles the hosts fail to serve from their cached ancestors
+(see overzoom.py) and keep the requests of each provider within its
+quota (see ratelimit.py): the tiles which are not cached wait for the
+quota, and are dropped if QGIS cancels them meanwhile.
+
+This module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import re
+import socket
+import select
+import threading
+import zlib
+from collections import OrderedDict
+from boundlessbasemaps import ratelimit
+from boundlessbasemaps.perf import timer
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlsplit, urlencode, parse_qs, quote, unquote
+except ImportError:  # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlsplit, parse_qs
+    from urllib import urlencode, quote, unquote
+
+
+# Any free port
+DEFAULT_PORT = 0
+# Number of ports the proxy listens on
+LISTENERS = 4
+DEFAULT_SUBDOMAINS = ['a', 'b', 'c']
+# Tiles kept in memory by the proxy
+DEFAULT_CACHE_SIZE = 2048
+# Idle upstream connections kept open for each host
+POOL_SIZE = 8
+# Request headers forwarded to the tile hosts
+FORWARD_HEADERS = ('User-Agent', 'Accept')
+# Response headers returned to QGIS
+RETURN_HEADERS = ('Content-Type', 'Cache-Control', 'Expires', 'ETag', 'Last-Modified')
+TILE_PATH_RE = re.compile(r'^/tile/(\d+)/(\d+)/(\d+)$')
+
+
+def tile_templates(m):
+    """Return the list of URL templates of the catalog entry m, one
+    for each host"""
+    endpoint = m['endpoint']
+    if '{s}' in endpoint:
+        subdomains = m.get('subdomains') or DEFAULT_SUBDOMAINS
+        return [endpoint.replace('{s}', s) for s in subdomains]
+    mirrors = m.get('mirrors')
+    if mirrors:
+        parts = urlsplit(endpoint)
+        path = endpoint[len('%s://%s' % (parts.scheme, parts.netloc)):]
+        return [endpoint] + [h.rstrip('/') + path for h in mirrors]
+    return [endpoint]
+
+
+def shard(templates, z, x, y):
+    """Return the template of the host serving the tile"""
+    return templates[(x + y) % len(templates)]
+
+
+def tile_url(template, z, x, y):
+    return template.replace('{z}', str(z)).replace('{x}', str(x)).replace('{y}', str(y))
+
+
+def provider(m):
+    """Return the provider of the catalog entry m"""
+    return m.get('provider') or m.get('attribution') or urlsplit(m['endpoint']).netloc
+
+
+def _hostname(url):
+    return (urlsplit(url).hostname or '').lower()
+
+
+def route(m, authcfg=None):
+    """Return the proxy route of the catalog entry m: a dictionary with
+    the map name, provider, the url of the layers of the default project,
+    the templates of the hosts, the authcfg and the maximum zoom of the
+    map (None if not known). With an authcfg, the
+    mirrors whose host name is not one of the endpoint are dropped, they
+    must not get the credentials"""
+    if not m.get('auth', True):
+        authcfg = None
+    templates = tile_templates(m)
+    url = templates[0]
+    if authcfg:
+        hosts = set(_hostname(t) for t in tile_templates(dict(m, mirrors=None)))
+        templates = [t for t in templates if _hostname(t) in hosts]
+    return {
+        'name': m['name'],
+        'provider': provider(m),
+        'url': url,
+        'templates': templates,
+        'authcfg': authcfg or None,
+        'zmax': _int_or_none(m.get('maxZoom')),
+    }
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def source_params(source):
+    """Return the parameters of a wms provider data source as a
+    dictionary of unquoted values"""
+    params = {}
+    for pair in source.split('&'):
+        key, _, value = pair.partition('=')
+        params[key] = unquote(value)
+    return params
+
+
+def routed_source(source, routes, proxy_url, extra_zoom=0):
+    """Return the XYZ layer data source through the proxy, None if no
+    route of routes (dictionary of name: route) matches its url and authcfg.
+    proxy_url(name) returns the proxy URL template of a route. The zmax
+    of the source is raised by extra_zoom levels, the levels the proxy
+    synthesizes past the maximum zoom of the map"""
+    params = source_params(source)
+    if params.get('type') != 'xyz':
+        return None
+    for name, r in routes.items():
+        if r['url'] == params.get('url') and r['authcfg'] == (params.get('authcfg') or None):
+            break
+    else:
+        return None
+    pairs = []
+    for pair in source.split('&'):
+        key = pair.partition('=')[0]
+        if key == 'url':
+            pairs.append('url=%s' % quote(proxy_url(name)))
+        elif key == 'zmax' and extra_zoom and _int_or_none(params['zmax']) is not None:
+            pairs.append('zmax=%d' % (int(params['zmax']) + extra_zoom))
+        elif key != 'authcfg':  # Applied by the proxy
+            pairs.append(pair)
+    return '&'.join(pairs)
+
+
+def source_route(source, routes):
+    """Return the route of routes a proxy data source requests, None if
+    source does not use the proxy"""
+    url = source_params(source).get('url') or ''
+    parts = urlsplit(url)
+    if parts.hostname != '127.0.0.1':
+        return None
+    return routes.get(parse_qs(parts.query).get('n', [None])[0])
+
+
+def _disconnected(sock):
+    """Return True if the peer closed the connection"""
+    try:
+        if not select.select([sock], [], [], 0)[0]:
+            return False
+        return not sock.recv(1, socket.MSG_PEEK)
+    except (socket.error, ValueError):
+        return True
+
+
+class _ConnectionPool(object):
+    """Persistent HTTP connections to the tile hosts"""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, netloc = key
+        cls = HTTPSConnection if scheme == 'https' else HTTPConnection
+        return cls(netloc, timeout=self.timeout), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < POOL_SIZE:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, url, headers, authcfg=None):
+        """GET url, return status, headers and body. The QGIS
+        authentication configurations are not available here"""
+        if authcfg:
+            raise socket.error("%s: the authcfg %s needs the QGIS network stack" % (url, authcfg))
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        while True:
+            conn, reused = self._connection(key)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (socket.error, HTTPException):
+                conn.close()
+                if reused:  # Stale keep-alive connection, retry with a new one
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                self._release(key, conn)
+            return response.status, response.getheaders(), body
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.proxy.handle(self)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileProxy(object):
+    """Local tile proxy, listening on LISTENERS ports: consecutive ones
+    from port, or free ones if port is 0. It serves the routes set by
+    set_routes(). The requests are recorded in stats, a
+    tilestats.TileStats instance, if not None. The tiles are also
+    cached in store, a tilestore.TileStore instance, if not None.
+    synthesize(tileset, z, x, y), if not None, returns the content type
+    and data of a tile the hosts failed to serve, or None. limits are
+    the quotas of the providers, a dictionary of provider: (rate, burst)
+    (see ratelimit.py). fetcher(url, headers, authcfg) returns the status,
+    headers and body of a tile, it defaults to persistent connections
+    of the standard library, which do not support the authcfgs."""
+
+    def __init__(self, port=DEFAULT_PORT, timeout=30, cache_size=DEFAULT_CACHE_SIZE,
+                 stats=None, store=None, synthesize=None, limits=None, fetcher=None):
+        self.port = port
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.stats = stats
+        self.store = store
+        self.synthesize = synthesize
+        self.limits = dict(limits or {})
+        self.routes = {}
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pool = _ConnectionPool(timeout)
+        self.fetcher = fetcher or self._pool.request
+        self._servers = []
+        self._threads = []
+
+    def start(self):
+        """Start listening, raise socket.error if a port is not available"""
+        try:
+            for i in range(LISTENERS):
+                httpd = _ThreadingHTTPServer(('127.0.0.1', self.port + i if self.port else 0),
+                                             _Handler)
+                httpd.proxy = self
+                thread = threading.Thread(target=httpd.serve_forever)
+                thread.daemon = True
+                thread.start()
+                self._servers.append(httpd)
+                self._threads.append(thread)
+        except socket.error:
+            self.stop()
+            raise
+        return self
+
+    def stop(self):
+        for httpd in self._servers:
+            httpd.shutdown()
+            httpd.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._servers = []
+        self._threads = []
+        self._pool.close()
+
+    @property
+    def ports(self):
+        return [httpd.server_address[1] for httpd in self._servers]
+
+    def set_routes(self, maps, authcfg=None):
+        """Replace the routes with the ones of the catalog entries maps
+        (see route()), return them"""
+        routes = {}
+        for m in maps:
+            r = route(m, authcfg)
+            routes[r['name']] = r
+        self.routes = routes
+        return routes
+
+    def url(self, name):
+        """Return the URL template of the route name, the routes are
+        spread over the ports"""
+        ports = self.ports
+        port = ports[(zlib.crc32(name.encode('utf-8')) & 0xffffffff) % len(ports)]
+        return 'http://127.0.0.1:%d/tile/{z}/{x}/{y}?%s' % (
+            port, urlencode([('n', name.encode('utf-8'))]))
+
+    def set_limits(self, limits):
+        """Replace the quotas of the providers, the learned ones are
+        discarded"""
+        with self._limiters_lock:
+            self.limits = dict(limits or {})
+            for provider, limiter in self._limiters.items():
+                limiter.configure(*self.limits.get(provider, (None, None)))
+
+    def limiter(self, provider):
+        """Return the ratelimit.RateLimiter of the provider"""
+        with self._limiters_lock:
+            limiter = self._limiters.get(provider)
+            if limiter is None:
+                limiter = self._limiters[provider] = ratelimit.RateLimiter(
+                    *self.limits.get(provider, (None, None)))
+            return limiter
+
+    def fetch(self, templates, z, x, y, headers=None, key=None, cancelled=None, authcfg=None):
+        """Return status, headers and body of the tile, the request is
+        recorded in the statistics under key, a (layer, provider) tuple,
+        and authorized by the fetcher with authcfg.
+        While the tile waits for the quota of the provider, cancelled(),
+        if not None, is checked and ratelimit.Cancelled raised if true"""
+        url = tile_url(shard(templates, z, x, y), z, x, y)
+        with self._cache_lock:
+            cached = self._cache.pop(url, None)
+            if cached is not None:
+                self._cache[url] = cached
+        if cached is not None:
+            self._record(key, size=len(cached[2]), hit=True)
+            return cached
+        stored = self.store.get(templates[0], z, x, y) if self.store is not None else None
+        if stored is not None:
+            content_type, body = stored
+            result = (200, [('Content-Type', content_type)] if content_type else [], body)
+            self._remember(url, result)
+            self._record(key, size=len(body), hit=True)
+            return result
+        limiter = self.limiter(key[1] if key is not None else urlsplit(url).netloc)
+        try:
+            status, response_headers, body, latency = self._request(url, headers, limiter,
+                                                                    key, cancelled, authcfg)
+        except (socket.error, HTTPException):
+            synthesized = self._synthesize(templates, z, x, y, key)
+            if synthesized is not None:
+                return synthesized
+            self._record(key, error=True)
+            raise
+        if status >= 400:
+            synthesized = self._synthesize(templates, z, x, y, key)
+            if synthesized is not None:
+                return synthesized
+            self._record(key, error=True)
+        else:
+            self._record(key, size=len(body), latency=latency)
+        response_headers = [(k, v) for k, v in response_headers
+                             if k.title() in RETURN_HEADERS]
+        result = (status, response_headers, body)
+        if status == 200:
+            self._remember(url, result)
+            if self.store is not None:
+                self.store.put(templates[0], z, x, y,
+                               dict((k.title(), v) for k, v in response_headers).get('Content-Type'),
+                               body)
+        return result
+
+    def _request(self, url, headers, limiter, key, cancelled=None, authcfg=None):
+        """GET url within the quota of limiter, after a 429 response the
+        request is sent again when the quota allows, until the timeout.
+        Return status, headers, body and latency of the last response"""
+        deadline = timer() + self.timeout
+        while True:
+            if not limiter.acquire(cancelled, deadline - timer()):
+                # The quota did not allow the request in time
+                return 429, [], b'', None
+            start = timer()
+            status, response_headers, body = self.fetcher(url, headers or {}, authcfg)
+            latency = timer() - start
+            if status != 429:
+                if status < 400:
+                    limiter.succeeded()
+                return status, response_headers, body, latency
+            limiter.throttled(ratelimit.retry_after(response_headers))
+            if self.stats is not None and key is not None:
+                self.stats.record_throttled(key[0], key[1])
+            if timer() >= deadline:
+                return status, response_headers, body, latency
+
+    def _synthesize(self, templates, z, x, y, key):
+        """Return the tile synthesized from its cached ancestors, None if
+        there are none. The synthesized tiles are not cached"""
+        if self.synthesize is None:
+            return None
+        tile = self.synthesize(templates[0], z, x, y)
+        if tile is None:
+            return None
+        content_type, body = tile
+        self._record(key, size=len(body), error=True, synthesized=True)
+        return (200, [('Content-Type', content_type), ('Cache-Control', 'no-store')], body)
+
+    def _remember(self, url, result):
+        """Add the tile to the memory cache"""
+        if self.cache_size:
+            with self._cache_lock:
+                self._cache[url] = result
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+    def _record(self, key, **kwargs):
+        if self.stats is not None and key is not None:
+            self.stats.record(key[0], key[1], **kwargs)
+
+    def handle(self, handler):
+        path, _, query = handler.path.partition('?')
+        match = TILE_PATH_RE.match(path)
+        r = self.routes.get(parse_qs(query).get('n', [None])[0])
+        if match is None or r is None:
+            return self._send(handler, 404, [], b'')
+        z, x, y = [int(v) for v in match.groups()]
+        headers = dict((k, handler.headers.get(k)) for k in FORWARD_HEADERS
+                       if handler.headers.get(k) is not None)
+        try:
+            status, response_headers, body = self.fetch(r['templates'], z, x, y, headers,
+                                                        (r['name'], r['provider']),
+                                                        lambda: _disconnected(handler.connection),
+                                                        r['authcfg'])
+        except ratelimit.Cancelled:
+            handler.close_connection = True
+            return
+        except (socket.error, HTTPException):
+            return self._send(handler, 502, [], b'')
+        self._send(handler, status, response_headers, body)
+
+    def _send(self, handler, status, headers, body):
+        handler.send_response(status)
+        for k, v in headers:
+            handler.send_header(k, v)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
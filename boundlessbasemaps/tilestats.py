@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    tilestats.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Tile traffic statistics of the tile proxy, per layer and provider.
+
+Every counter set holds the requests, cache hits, errors, tiles
+synthesized from their cached ancestors (see overzoom.py), 429 responses
+of the hosts over quota (see ratelimit.py), bytes returned
+to QGIS, bytes and seconds spent fetching from the tile hosts and a
+histogram of the upstream latencies. The histogram buckets grow
+geometrically (BUCKETS_PER_OCTAVE per doubling, from 1 ms), so the
+percentiles are estimated within 20% with a few dozen integers.
+
+The counters are kept in memory and merged into a JSON file by flush(),
+under a file lock, so the statistics of many sessions and of concurrent
+QGIS instances add up.
+
+This module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import io
+import os
+import json
+import math
+import threading
+from boundlessbasemaps import fileutils
+
+STATS_VERSION = 1
+BUCKETS_PER_OCTAVE = 4
+# Counters of a layer, the latency histogram is stored apart
+COUNTERS = ('requests', 'hits', 'errors', 'synthesized', 'throttled', 'bytes', 'upstream_bytes',
+            'upstream_s')
+PERCENTILES = (50, 95, 99)
+
+
+def bucket(latency):
+    """Return the histogram bucket of a latency in seconds"""
+    ms = latency * 1000.0
+    if ms <= 1:
+        return 0
+    return int(math.ceil(math.log(ms, 2) * BUCKETS_PER_OCTAVE))
+
+
+def bucket_limit(b):
+    """Return the upper limit in seconds of the histogram bucket b"""
+    return 2 ** (float(b) / BUCKETS_PER_OCTAVE) / 1000.0
+
+
+def percentile(histogram, p):
+    """Return the estimated p-th percentile latency in seconds of a
+    histogram (dictionary of bucket: count), None if empty"""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    rank = total * p / 100.0
+    count = 0
+    for b in sorted(histogram):
+        count += histogram[b]
+        if count >= rank:
+            return bucket_limit(b)
+    return bucket_limit(max(histogram))
+
+
+def _new_entry():
+    entry = dict((k, 0) for k in COUNTERS)
+    entry['latency'] = {}
+    return entry
+
+
+def _merge(target, source):
+    """Add the counters of the source entries to the target entries"""
+    for key, entry in source.items():
+        t = target.setdefault(key, _new_entry())
+        for k in COUNTERS:
+            t[k] += entry.get(k, 0)
+        for b, count in entry.get('latency', {}).items():
+            b = int(b)
+            t['latency'][b] = t['latency'].get(b, 0) + count
+
+
+def summary(entry):
+    """Return the counters of an entry with the hit ratio, the upstream
+    throughput (bytes/second) and the latency percentiles (seconds)"""
+    result = dict((k, entry[k]) for k in COUNTERS)
+    result['hit_ratio'] = float(entry['hits']) / entry['requests'] if entry['requests'] else None
+    result['throughput'] = entry['upstream_bytes'] / entry['upstream_s'] if entry['upstream_s'] else None
+    for p in PERCENTILES:
+        result['p%d' % p] = percentile(entry['latency'], p)
+    return result
+
+
+class TileStats(object):
+    """Thread safe tile traffic counters, keyed by (layer, provider)"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def record(self, layer, provider, size=0, hit=False, latency=None, error=False,
+               synthesized=False):
+        """Record a tile request: size bytes returned, served from the
+        cache if hit, else fetched in latency seconds. A synthesized tile
+        is returned after an upstream error"""
+        with self._lock:
+            entry = self._entry(layer, provider)
+            entry['requests'] += 1
+            if synthesized:
+                entry['synthesized'] += 1
+                entry['bytes'] += size
+            if error:
+                entry['errors'] += 1
+                return
+            entry['bytes'] += size
+            if hit:
+                entry['hits'] += 1
+            elif latency is not None:
+                entry['upstream_bytes'] += size
+                entry['upstream_s'] += latency
+                b = bucket(latency)
+                entry['latency'][b] = entry['latency'].get(b, 0) + 1
+
+    def record_throttled(self, layer, provider):
+        """Record a 429 response of the host, the tile request itself is
+        recorded by record()"""
+        with self._lock:
+            self._entry(layer, provider)['throttled'] += 1
+
+    def _entry(self, layer, provider):
+        entry = self._pending.get((layer, provider))
+        if entry is None:
+            entry = self._pending[(layer, provider)] = _new_entry()
+        return entry
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def _read(self):
+        """Return the stored entries, empty if the file is missing or
+        of another version"""
+        try:
+            with io.open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+        if data.get('version') != STATS_VERSION:
+            return {}
+        entries = {}
+        _merge(entries, dict(((e['layer'], e['provider']), e) for e in data.get('layers', [])))
+        return entries
+
+    def flush(self):
+        """Merge the counters recorded since the last flush into the file"""
+        pending = self._take_pending()
+        if not pending or self.path is None:
+            return
+        try:
+            with fileutils.file_lock(self.path):
+                entries = self._read()
+                _merge(entries, pending)
+                fileutils.atomic_write(self.path, json.dumps({
+                    'version': STATS_VERSION,
+                    'layers': [dict(entry, layer=layer, provider=provider,
+                                    upstream_s=round(entry['upstream_s'], 6),
+                                    latency=dict((str(b), c) for b, c in entry['latency'].items()))
+                               for (layer, provider), entry in sorted(entries.items())],
+                }, separators=(',', ':')))
+        except (IOError, OSError, fileutils.LockTimeout):
+            # Keep the counters for the next flush
+            with self._lock:
+                _merge(self._pending, pending)
+
+    def entries(self):
+        """Return all the counters, stored and pending, as a dictionary
+        (layer, provider): entry"""
+        entries = self._read() if self.path is not None else {}
+        with self._lock:
+            _merge(entries, self._pending)
+        return entries
+
+    def reset(self):
+        with self._lock:
+            self._pending = {}
+        if self.path is not None:
+            with fileutils.file_lock(self.path):
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+
+    def report(self):
+        """Return the statistics per layer and per provider as a
+        JSON serializable dictionary"""
+        entries = self.entries()
+        providers = {}
+        for (layer, provider), entry in entries.items():
+            _merge(providers, {provider: entry})
+        return {
+            'version': STATS_VERSION,
+            'layers': [dict(summary(entry), layer=layer, provider=provider)
+                       for (layer, provider), entry in sorted(entries.items())],
+            'providers': [dict(summary(entry), provider=provider)
+                          for provider, entry in sorted(providers.items())],
+        }
+
+    def export(self, path):
+        """Write report() to a JSON file"""
+        fileutils.atomic_write(path, json.dumps(self.report(), indent=2, sort_keys=True))
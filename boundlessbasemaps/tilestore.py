@@ -0,0 +1,353 @@
+# -*- coding: utf-8 -*-
+
+"""
+***************************************************************************
+    tilestore.py
+    ---------------------
+    Date                 : October 2026
+    Copyright            : (C) 2017 Boundless, http://boundlessgeo.com
+***************************************************************************
+*                                                                         *
+*   This program is free software; you can redistribute it and/or modify  *
+*   it under the terms of the GNU General Public License as published by  *
+*   the Free Software Foundation; either version 2 of the License, or     *
+*   (at your option) any later version.                                   *
+*                                                                         *
+***************************************************************************
+
+Tile cache shared by the QGIS instances of the user.
+
+The tiles are stored in a SQLite database in WAL mode: the readers never
+wait for the writers and the processes write one at a time, with a busy
+timeout. The tiles are keyed by tileset (the first URL template of the
+map), zoom, column and row.
+
+Many tiles are identical (sea, empty land, blank high zooms), the data
+are stored once per content hash: the tiles table maps the coordinates
+to the hash and the blobs table holds the data and the number of tiles
+referencing them, kept by triggers. A blob is deleted with the last
+tile referencing it. The reads are a single query, joining the primary
+keys of the two tables.
+
+Every store has one writer thread, which commits the new tiles and the
+access times of the cached tiles read every FLUSH_INTERVAL seconds in a
+single transaction, so the tile requests never wait for the disk.
+
+When the cache grows over its size (the size of the blobs), the least
+recently read tiles are evicted down to EVICT_TARGET of the size. The eviction is done by one
+process only: the store holding the "evictor" lease in the database,
+renewed every EVICT_INTERVAL seconds; another process takes the lease
+over when it expires (the evictor QGIS instance was closed).
+
+This module only depends on the standard library.
+
+"""
+
+__author__ = 'Boundless Basemaps contributors'
+__date__ = 'October 2026'
+__copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
+
+import time
+import uuid
+import hashlib
+import sqlite3
+import threading
+
+STORE_VERSION = 2
+# Default size of the cache in bytes
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Seconds a tile is served from the cache
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+# Seconds between the commits of the writer thread
+FLUSH_INTERVAL = 0.5
+# Seconds between the eviction runs, the evictor lease lasts three times
+EVICT_INTERVAL = 60
+# Fraction of the size the eviction frees the cache down to
+EVICT_TARGET = 0.9
+# Seconds a process waits for the database lock
+BUSY_TIMEOUT = 10
+# Read connections kept open
+READERS = 4
+# Rows deleted per statement (SQLite limits the parameters)
+DELETE_BATCH = 500
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, content_type TEXT, '
+    'data BLOB, size INTEGER NOT NULL, refs INTEGER NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS tiles (tileset TEXT NOT NULL, z INTEGER NOT NULL, '
+    'x INTEGER NOT NULL, y INTEGER NOT NULL, hash TEXT NOT NULL, '
+    'created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (tileset, z, x, y))',
+    'CREATE INDEX IF NOT EXISTS tiles_accessed ON tiles (accessed)',
+    'CREATE TRIGGER IF NOT EXISTS tiles_insert AFTER INSERT ON tiles BEGIN '
+    'UPDATE blobs SET refs = refs + 1 WHERE hash = new.hash; END',
+    'CREATE TRIGGER IF NOT EXISTS tiles_update AFTER UPDATE OF hash ON tiles '
+    'WHEN old.hash != new.hash BEGIN '
+    'UPDATE blobs SET refs = refs + 1 WHERE hash = new.hash; '
+    'UPDATE blobs SET refs = refs - 1 WHERE hash = old.hash; '
+    'DELETE FROM blobs WHERE hash = old.hash AND refs <= 0; END',
+    'CREATE TRIGGER IF NOT EXISTS tiles_delete AFTER DELETE ON tiles BEGIN '
+    'UPDATE blobs SET refs = refs - 1 WHERE hash = old.hash; '
+    'DELETE FROM blobs WHERE hash = old.hash AND refs <= 0; END',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)',
+)
+
+
+def content_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                           check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def dedupe_stats(tiles, blobs, logical_bytes, stored_bytes):
+    """Return the dedupe statistics of tiles sharing blobs: the ratio of
+    tiles per blob and the bytes saved"""
+    return {
+        'tiles': tiles,
+        'blobs': blobs,
+        'bytes': stored_bytes,
+        'logical_bytes': logical_bytes,
+        'dedupe_ratio': float(tiles) / blobs if blobs else None,
+        'bytes_saved': logical_bytes - stored_bytes,
+    }
+
+
+class TileStore(object):
+    """Tile cache in the SQLite database at path, at most max_bytes of
+    tiles younger than max_age seconds. start() opens the database and
+    starts the writer thread, close() commits the pending writes"""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, max_age=DEFAULT_MAX_AGE,
+                 clock=time.time):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.clock = clock
+        # Evictor lease owner
+        self.owner = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = {}
+        self._touched = set()
+        self._readers = []
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._closing = False
+        self._last_evict = None
+
+    def start(self):
+        self._writer = _connect(self.path)
+        self._transaction(self._create)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        with self._lock:
+            self._closing = True
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._lock:
+            readers, self._readers = self._readers, []
+        for conn in readers:
+            conn.close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def _create(self, conn):
+        if conn.execute('PRAGMA user_version').fetchone()[0] != STORE_VERSION:
+            conn.execute('DROP TABLE IF EXISTS tiles')
+            conn.execute('DROP TABLE IF EXISTS blobs')
+            conn.execute('DROP TABLE IF EXISTS meta')
+            conn.execute('PRAGMA user_version=%d' % STORE_VERSION)
+        for statement in SCHEMA:
+            conn.execute(statement)
+
+    def _transaction(self, func):
+        """Run func(connection) in a write transaction"""
+        with self._write_lock:
+            conn = self._writer
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(conn)
+            except:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+
+    def _reader(self):
+        with self._lock:
+            if self._readers:
+                return self._readers.pop()
+        return _connect(self.path)
+
+    def _release(self, conn):
+        with self._lock:
+            if len(self._readers) < READERS and not self._closing:
+                self._readers.append(conn)
+                return
+        conn.close()
+
+    def get(self, tileset, z, x, y):
+        """Return the content type and the data of the tile, None if it is
+        not in the cache or expired"""
+        key = (tileset, z, x, y)
+        with self._lock:
+            pending = self._pending.get(key)
+        if pending is not None:
+            return pending[0], pending[1]
+        conn = self._reader()
+        try:
+            row = conn.execute('SELECT b.content_type, b.data, t.created FROM tiles t '
+                               'JOIN blobs b ON b.hash = t.hash '
+                               'WHERE t.tileset = ? AND t.z = ? AND t.x = ? AND t.y = ?',
+                               key).fetchone()
+        except sqlite3.Error:
+            row = None
+        finally:
+            self._release(conn)
+        if row is None or self.clock() - row[2] > self.max_age:
+            return None
+        with self._lock:
+            self._touched.add(key)
+        return row[0], bytes(row[1])
+
+    def put(self, tileset, z, x, y, content_type, data):
+        """Add the tile to the cache, it is written by the writer thread"""
+        with self._lock:
+            self._pending[(tileset, z, x, y)] = (content_type, data, self.clock())
+
+    def flush(self):
+        """Commit the pending tiles and access times"""
+        with self._lock:
+            # The pending tiles are served until they are committed
+            pending = dict(self._pending)
+            touched, self._touched = self._touched, set()
+        if (not pending and not touched) or self._writer is None:
+            return
+        now = self.clock()
+
+        def write(conn):
+            for key, (ct, data, created) in pending.items():
+                h = content_hash(data)
+                conn.execute('INSERT OR IGNORE INTO blobs (hash, content_type, data, size, refs) '
+                             'VALUES (?, ?, ?, ?, 0)', (h, ct, sqlite3.Binary(data), len(data)))
+                # No INSERT OR REPLACE: the delete trigger would not fire
+                if not conn.execute('UPDATE tiles SET hash = ?, created = ?, accessed = ? '
+                                    'WHERE tileset = ? AND z = ? AND x = ? AND y = ?',
+                                    (h, created, now) + key).rowcount:
+                    conn.execute('INSERT INTO tiles (tileset, z, x, y, hash, created, accessed) '
+                                 'VALUES (?, ?, ?, ?, ?, ?, ?)', key + (h, created, now))
+            conn.executemany('UPDATE tiles SET accessed = ? WHERE tileset = ? AND z = ? '
+                             'AND x = ? AND y = ?', [(now, ) + key for key in touched])
+        try:
+            self._transaction(write)
+        except sqlite3.Error:
+            pass  # Busy or read-only: the tiles are not cached
+        finally:
+            with self._lock:
+                for key, tile in pending.items():
+                    if self._pending.get(key) is tile:
+                        del self._pending[key]
+
+    def claim_eviction(self):
+        """Take or renew the evictor lease, return True if this store
+        holds it"""
+        now = self.clock()
+
+        def claim(conn):
+            row = conn.execute("SELECT value FROM meta WHERE key = 'evictor'").fetchone()
+            if row is not None:
+                owner, expires = row[0].split()
+                if owner != self.owner and float(expires) > now:
+                    return False
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('evictor', ?)",
+                         ('%s %f' % (self.owner, now + 3 * EVICT_INTERVAL), ))
+            return True
+        try:
+            return self._transaction(claim)
+        except sqlite3.Error:
+            return False
+
+    def size(self):
+        """Return the bytes of tile data in the cache"""
+        conn = self._reader()
+        try:
+            return conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+        finally:
+            self._release(conn)
+
+    def stats(self):
+        """Return the number of tiles and of distinct blobs, the bytes
+        stored and the bytes the tiles would take without the dedupe"""
+        conn = self._reader()
+        try:
+            tiles, logical = conn.execute('SELECT COUNT(*), COALESCE(SUM(b.size), 0) FROM tiles t '
+                                          'JOIN blobs b ON b.hash = t.hash').fetchone()
+            blobs, stored = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) '
+                                         'FROM blobs').fetchone()
+        finally:
+            self._release(conn)
+        return dedupe_stats(tiles, blobs, logical, stored)
+
+    def evict(self):
+        """Delete the expired tiles and the least recently read ones until
+        the cache is under EVICT_TARGET of its size, return the number of
+        tiles deleted"""
+        now = self.clock()
+
+        def delete(conn):
+            deleted = conn.execute('DELETE FROM tiles WHERE created < ?',
+                                   (now - self.max_age, )).rowcount
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+            if total <= self.max_bytes:
+                return deleted
+            excess = total - int(self.max_bytes * EVICT_TARGET)
+            # A blob is freed with the last of its tiles
+            rowids = []
+            refs = {}
+            for rowid, h, size, count in conn.execute(
+                    'SELECT t.rowid, t.hash, b.size, b.refs FROM tiles t '
+                    'JOIN blobs b ON b.hash = t.hash ORDER BY t.accessed'):
+                rowids.append(rowid)
+                refs[h] = refs.get(h, count) - 1
+                if not refs[h]:
+                    excess -= size
+                    if excess <= 0:
+                        break
+            for i in range(0, len(rowids), DELETE_BATCH):
+                batch = rowids[i:i + DELETE_BATCH]
+                conn.execute('DELETE FROM tiles WHERE rowid IN (%s)' % ','.join('?' * len(batch)),
+                             batch)
+            return deleted + len(rowids)
+        return self._transaction(delete)
+
+    def _run(self):
+        """Writer thread"""
+        while True:
+            with self._lock:
+                if not self._closing:
+                    self._wakeup.wait(FLUSH_INTERVAL)
+                if self._closing:
+                    return
+            self.flush()
+            now = self.clock()
+            if self._last_evict is None or now - self._last_evict >= EVICT_INTERVAL:
+                self._last_evict = now
+                try:
+                    if self.claim_eviction():
+                        self.evict()
+                except sqlite3.Error:
+                    pass
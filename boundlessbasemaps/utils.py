@@ -25,24 +25,65 @@ __copyright__ = '(C) 2017 Boundless, http://boundlessgeo.com'
 
 import os
 import json
-try:
-    from urllib2 import quote
-except:
-    from urllib.parse import quote
-
-from tempfile import mktemp
+import time
+import shutil
+import base64
+import hashlib
+from datetime import datetime
 from qgis.core import (QgsAuthManager, QgsMapLayer, QgsRasterLayer,
                        QgsAuthMethodConfig, QgsApplication)
-from qgis.PyQt.QtCore import QEventLoop, QUrl, QSettings
+from qgis.PyQt.QtCore import QEventLoop, QUrl, QSettings, QByteArray, QTimer
+from qgis.PyQt.QtGui import QImageReader
+from qgis.PyQt.QtNetwork import QNetworkRequest, QNetworkReply
+from qgis.PyQt.QtXml import QDomDocument
+from qgis.core import QgsNetworkAccessManager
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+from qgis.core import (QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsLayerTree,
+                       QgsProject)
+try:
+    from qgis.core import QgsMapLayerRegistry, QgsComposerMap
+except ImportError:  # QGIS 3
+    QgsMapLayerRegistry = None
+    QgsComposerMap = None
 try:
-    from qgis.gui import QgsFileDownloader
-except:
-    from qgis.core import QgsFileDownloader
-from qgis.core import QgsCoordinateReferenceSystem
+    from qgis.core import Qgis
+    QGIS3 = Qgis.QGIS_VERSION_INT >= 29900
+except ImportError:
+    QGIS3 = False
+from boundlessbasemaps import (perf, renderer, fileutils, fetchpolicy, catalogsync, snapshot,
+                               federation, prefetch)
+from boundlessbasemaps.renderer import BasemapsConfigError
 
 
 AUTHCFG_ID = "conect1"  # test id
 AUTHCFG_NAME = "Boundless OAuth2 API"
+PLUGIN_NAMESPACE = 'boundlessbasemaps'
+PROJECT_DEFAULT_TEMPLATE = os.path.join(os.path.dirname(__file__), 'project_default.qgs.tpl')
+# Catalog tileFormat: Qt image format needed to decode the tiles
+TILE_FORMATS = {
+    'PNG': 'png',
+    'JPEG': 'jpeg',
+    'JPG': 'jpeg',
+    'WEBP': 'webp',
+}
+DEFAULT_FORMAT_PREFERENCE = ['WEBP', 'JPEG', 'JPG', 'PNG']
+# Keys of the token response (or of the claims of a JWT access token)
+# which can carry the entitlements matched against the accessList of the maps
+ENTITLEMENT_KEYS = ('entitlements', 'roles', 'accessList')
+
+# Files of the circuit breakers of the BCS endpoints and of the latencies
+# of their mirrors in the cache directory
+CIRCUITS_FILE = 'circuits.json'
+MIRRORS_FILE = 'mirrors.json'
+# HTTP errors of the BCS calls worth a retry
+TRANSIENT_HTTP_STATUS = (408, 429, 500, 502, 503, 504)
+
+_supported_tile_formats = None
+_fetch_policy = None
+_mirror_latencies = None
 
 
 def bcs_supported():
@@ -58,18 +99,78 @@ def default_project_path():
     return os.path.join(QgsApplication.qgisSettingsDirPath(), 'project_default.qgs')
 
 
+def backup_default_project():
+    """Copy any existing default project to a timestamped backup copy,
+    return the backup path or None if there was no default project.
+    The default project itself is left in place until it is atomically
+    replaced by the new one"""
+    default_path = default_project_path()
+    if not os.path.isfile(default_path):
+        return None
+    default_project_backup = default_path.replace(
+        '.qgs', '-%s.qgs' % datetime.now().strftime('%Y-%m-%d-%H:%M:%S'))
+    with perf.span('project.backup'):
+        shutil.copy2(default_path, default_project_backup)
+    return default_project_backup
+
+
+def cache_dir():
+    """Return the directory for the plugin cached data, create it if needed"""
+    path = os.path.join(QgsApplication.qgisSettingsDirPath(), 'boundlessbasemaps')
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def cache_path(uri):
+    """Return the path of the cached copy of the document at uri"""
+    return os.path.join(cache_dir(), 'cache-%s.json' % hashlib.sha1(
+        uri.encode('utf-8')).hexdigest()[:16])
+
+
 def set_default_project(content, overwrite=False):
     """Create a new default project with the given content,
     if overwrite is True any pre-existing project will be silently overwritten.
     Return True in case of successful project writing."""
     default_path = default_project_path()
-    if not overwrite and os.path.isfile(default_path):
-        return False
-    with open(default_path, 'wb+') as f:
-        f.write(content)
+    with fileutils.file_lock(default_path):
+        if not overwrite and os.path.isfile(default_path):
+            return False
+        _write_default_project(default_path, content)
+    return True
+
+
+def replace_default_project(content, backup=True):
+    """Backup any existing default project (if backup is True) and write
+    the new one, while holding a lock so that setups running in other QGIS
+    instances can not interleave. Return the backup path or None"""
+    default_path = default_project_path()
+    with fileutils.file_lock(default_path):
+        backup_path = backup_default_project() if backup else None
+        _write_default_project(default_path, content)
+    return backup_path
+
+
+def _write_default_project(default_path, content):
+    with perf.span('project.write', bytes=len(content)):
+        fileutils.atomic_write(default_path, content)
     settings = QSettings()
     settings.setValue('Qgis/newProjectDefault', True)
-    return True
+
+
+def store_plugin_settings(selected, visible, authcfg, settings=None):
+    """Store the Basemaps plugin settings for the given selection, with the
+    same keys used by the plugin. settings is an optional QSettings instance,
+    for example for the settings file of another QGIS profile"""
+    if settings is None:
+        settings = QSettings()
+    for name, value in (('enabled', True),
+                        ('authcfg', authcfg or ''),
+                        ('selected', '###'.join(selected)),
+                        ('visible', '###'.join(visible)),
+                        ('first_time_setup_done', True)):
+        settings.setValue('%s/%s' % (PLUGIN_NAMESPACE, name), value)
+    settings.setValue('Qgis/newProjectDefault', True)
 
 
 def unset_default_project():
@@ -92,6 +193,7 @@ def get_oauth_authcfg(authcfg_id=AUTHCFG_ID):
     return None
 
 
+@perf.timed('authcfg.create')
 def setup_oauth(username, password, basemaps_token_uri, authcfg_id=AUTHCFG_ID, authcfg_name=AUTHCFG_NAME):
     """Setup oauth configuration to access the BCS API,
     return authcfg_id on success, None on failure
@@ -112,7 +214,7 @@ def setup_oauth(username, password, basemaps_token_uri, authcfg_id=AUTHCFG_ID, a
      "requestUrl" : "",
      "scope" : "",
      "state" : "",
-     "tokenUrl" : basemaps_token_uri,
+     "tokenUrl" : best_mirror(basemaps_token_uri),
      "username" : username,
      "version" : 1
     }
@@ -134,98 +236,672 @@ def setup_oauth(username, password, basemaps_token_uri, authcfg_id=AUTHCFG_ID, a
     return None
 
 
-def create_default_project(available_maps, visible_maps, project_template, authcfg=None):
-    """Create a default project from a template and return it as a string"""
+def fetch_policy():
+    """Return the fetch policy of the BCS calls, the circuit breakers
+    are stored in the cache directory"""
+    global _fetch_policy
+    if _fetch_policy is None:
+        breaker = fetchpolicy.CircuitBreaker(os.path.join(cache_dir(), CIRCUITS_FILE))
+        _fetch_policy = fetchpolicy.FetchPolicy(breaker=breaker, sleep=_wait)
+    return _fetch_policy
+
+
+def _wait(seconds):
+    """Sleep without freezing the GUI"""
+    loop = QEventLoop()
+    QTimer.singleShot(int(seconds * 1000), loop.quit)
+    loop.exec_()
+
+
+def mirror_latencies():
+    """Return the latency estimates of the mirrors of the BCS endpoints,
+    stored in the cache directory"""
+    global _mirror_latencies
+    if _mirror_latencies is None:
+        _mirror_latencies = fetchpolicy.MirrorLatencies(os.path.join(cache_dir(), MIRRORS_FILE))
+    return _mirror_latencies
+
+
+def best_mirror(uri):
+    """Return the fastest known mirror of uri, a '###' separated list"""
+    return mirror_latencies().rank(fetchpolicy.split_uris(uri))[0]
+
+
+def _with_params(uri, params=None):
+    """Return uri with the params added to its query string"""
+    if not params:
+        return uri
+    return uri + ('&' if '?' in uri else '?') + urlencode(sorted(params.items()))
+
+
+def _send(uri, data=None):
+    """GET uri, or POST the form data if not None, return the reply"""
+    request = QNetworkRequest(QUrl(uri))
+    if data is None:
+        return QgsNetworkAccessManager.instance().get(request)
+    request.setHeader(QNetworkRequest.ContentTypeHeader, 'application/x-www-form-urlencoded')
+    return QgsNetworkAccessManager.instance().post(request, QByteArray(data))
+
+
+def _reply_result(uri, reply, parse=None):
+    """Return the body of a finished reply and its parsed value.
+    Raise fetchpolicy.TransportError if there was no HTTP reply,
+    fetchpolicy.TransientError on the other errors worth a retry,
+    fetchpolicy.FetchError on the others"""
+    if reply.error() != QNetworkReply.NoError:
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if status is None:
+            raise fetchpolicy.TransportError("%s: %s" % (uri, reply.errorString()))
+        if int(status) in TRANSIENT_HTTP_STATUS:
+            raise fetchpolicy.TransientError("%s: %s" % (uri, reply.errorString()))
+        raise fetchpolicy.FetchError("%s: %s" % (uri, reply.errorString()))
+    body = reply.readAll().data()
+    if parse is None:
+        return body, None
+    try:
+        return body, parse(body)
+    except ValueError as e:
+        raise fetchpolicy.TransientError("%s: invalid reply: %s" % (uri, e))
+
+
+def _race(uris, timeout, data=None, parse=None, params=None):
+    """Request the mirrors uris (with the query params) at the same time
+    (see _send) and return
+    the body and the value parsed by parse() of the first valid reply, the
+    other requests are aborted. The latencies are recorded in
+    mirror_latencies(): the elapsed time for the aborted requests, the
+    timeout for the failed ones.
+    Raise fetchpolicy.TransportError, TransientError or FetchError (see
+    _reply_result) if all the requests fail or timeout seconds elapse"""
+    loop = QEventLoop()
+    timer = QTimer()
+    timer.setSingleShot(True)
+    timer.timeout.connect(loop.quit)
+    start = perf.timer()
+    pending = []
+    for uri in uris:
+        reply = _send(_with_params(uri, params), data)
+        reply.finished.connect(loop.quit)
+        pending.append((uri, reply))
+    replies = list(pending)
+    timer.start(int(timeout * 1000))
+    samples = {}
+    errors = []
+    result = None
+    try:
+        while pending and result is None and timer.isActive():
+            loop.exec_()
+            for uri, reply in list(pending):
+                if not reply.isFinished():
+                    continue
+                pending.remove((uri, reply))
+                try:
+                    result = _reply_result(uri, reply, parse)
+                except fetchpolicy.FetchError as e:
+                    errors.append(e)
+                    samples[uri] = timeout
+                    continue
+                samples[uri] = perf.timer() - start
+                break
+        timer.stop()
+        for uri, reply in pending:
+            reply.abort()
+            samples[uri] = perf.timer() - start
+            if result is None:
+                errors.append(fetchpolicy.TransportError("%s: timeout" % uri))
+    finally:
+        for uri, reply in replies:
+            reply.deleteLater()
+    mirror_latencies().record(samples)
+    if result is not None:
+        return result
+    message = '; '.join("%s" % e for e in errors)
+    if all(isinstance(e, fetchpolicy.TransportError) for e in errors):
+        raise fetchpolicy.TransportError(message)
+    if any(isinstance(e, fetchpolicy.TransientError) for e in errors):
+        raise fetchpolicy.TransientError(message)
+    raise fetchpolicy.FetchError(message)
+
+
+def _fetch(uri, data=None, parse=None, params=None):
+    """Fetch uri, a '###' separated list of mirrors, following the fetch
+    policy and racing the mirrors, see _race()"""
+    mirrors = fetchpolicy.split_uris(uri)
+    return fetch_policy().call(uri, lambda timeout: _race(mirror_latencies().race(mirrors),
+                                                          timeout, data, parse, params))
+
+
+def _parse_json(body):
+    return json.loads(body.decode('utf-8'))
+
+
+def _post_form(uri, fields):
+    """POST the form fields to uri and return the parsed JSON reply,
+    None on failure"""
+    try:
+        return _fetch(uri, urlencode(fields).encode('utf-8'), _parse_json)[1]
+    except fetchpolicy.FetchError:
+        return None
+
+
+def _jwt_claims(token):
+    """Return the claims of a JWT token, None if token is not a JWT"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload.encode('ascii')).decode('utf-8'))
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return None
+
+
+def entitlements_from_token(response):
+    """Return the set of entitlements in a token response, looking for
+    ENTITLEMENT_KEYS in the response itself and in the claims of the access
+    token. Return None if the response does not tell"""
+    for source in (response, _jwt_claims(response.get('access_token'))):
+        if not isinstance(source, dict):
+            continue
+        for key in ENTITLEMENT_KEYS:
+            value = source.get(key)
+            if isinstance(value, (list, tuple)):
+                return set(value)
+            if value:
+                return set(value.split())
+    return None
+
+
+@perf.timed('token.request')
+def request_token(token_uri, username, password):
+    """Request a token to the BCS token endpoint with the password grant,
+    return the token response, None on failure"""
+    return _post_form(token_uri, {
+        'grant_type': 'password',
+        'username': username,
+        'password': password,
+    })
+
+
+def authcfg_credentials(authcfg_id):
+    """Return the token URI, the username and the password of an OAuth2
+    authcfg created by setup_oauth(), None if it is not available.
+    QgsAuthManager must only be used from the GUI thread"""
+    config = QgsAuthMethodConfig()
+    if not QgsAuthManager.instance().loadAuthenticationConfig(authcfg_id, config, True):
+        return None
+    try:
+        oauth2 = json.loads(config.config('oauth2config'))
+    except (TypeError, ValueError):
+        return None
+    if not oauth2.get('tokenUrl') or not oauth2.get('username'):
+        return None
+    return oauth2['tokenUrl'], oauth2['username'], oauth2.get('password', '')
+
+
+def request_authcfg_token(authcfg_id):
+    """Request a token with the credentials of an OAuth2 authcfg created
+    by setup_oauth(), return the token response, None on failure"""
+    credentials = authcfg_credentials(authcfg_id)
+    if credentials is None:
+        return None
+    return request_token(*credentials)
+
+
+def get_entitlements(token_uri, username, password):
+    """Request a token to the BCS token endpoint and return the set of the
+    entitlements of the account, None if unknown"""
+    response = request_token(token_uri, username, password)
+    if response is None:
+        return None
+    return entitlements_from_token(response)
+
+
+def get_authcfg_entitlements(authcfg_id):
+    """Return the entitlements of the account of an OAuth2 authcfg created
+    by setup_oauth(), None if unknown"""
+    response = request_authcfg_token(authcfg_id)
+    if response is None:
+        return None
+    return entitlements_from_token(response)
+
+
+def access_index(maps):
+    """Return the access index of the maps: a dictionary of
+    accessList item: set of map names. The maps without an accessList are
+    indexed under None"""
+    index = {}
+    for m in maps:
+        for item in m.get('accessList') or [None]:
+            index.setdefault(item, set()).add(m['name'])
+    return index
+
+
+def accessible_maps(index, entitlements):
+    """Return the set of the names of the maps accessible with the
+    entitlements, all the maps if entitlements is None"""
+    if entitlements is None:
+        return set().union(*index.values())
+    names = set(index.get(None, ()))
+    for item in entitlements:
+        names.update(index.get(item, ()))
+    return names
+
+
+def create_default_project(available_maps, visible_maps, project_template, authcfg=None,
+                           use_qgis=False, lazy=False, entitlements=None):
+    """Create a default project from a template and return it as a string.
+    The maplayer elements are generated by the renderer module unless
+    use_qgis is True: in this case they are created by QGIS itself.
+    If lazy is True the hidden maps are written as placeholders.
+    If entitlements is not None, BasemapsConfigError is raised for the
+    maps which are not accessible"""
+    if entitlements is not None:
+        accessible = accessible_maps(access_index(available_maps), entitlements)
+        denied = [m['name'] for m in available_maps if m['name'] not in accessible]
+        if denied:
+            raise BasemapsConfigError("Your subscription does not include: %s" % ', '.join(denied))
+    with perf.span('project.generate', items=len(available_maps)) as s:
+        if use_qgis:
+            layers = qgis_layer_definitions(available_maps, authcfg)
+        else:
+            layers = renderer.layer_definitions(available_maps, authcfg)
+        if not len(layers):
+            return None
+        tpl = renderer.read_template(project_template)
+        prj = renderer.render_project(tpl, layers, visible_maps, lazy)
+        s.set(bytes=len(prj))
+    return prj
+
+
+def qgis_layer_definitions(available_maps, authcfg=None):
+    """Create the QGIS layers for the maps and return their definitions as
+    a list of dictionaries with id, name, datasource and maplayer xml, like
+    renderer.layer_definitions() does.
+    This needs QGIS and must run in the main thread."""
     layers = []
     for m in available_maps:
-        connstring = u'type=xyz&url=%(url)s'
-        if authcfg is not None:
-            connstring = u'authcfg=%(authcfg)s&' + connstring
-        layer = QgsRasterLayer(connstring % {
-            'url': quote(m['endpoint']),
-            'authcfg': authcfg,
-        }, m['name'], 'wms')
+        layer = QgsRasterLayer(renderer.connection_string(m, authcfg), m['name'], 'wms')
         # I've no idea why the following is required even if the crs is specified 
         # in the layer definition
         layer.setCrs(QgsCoordinateReferenceSystem('EPSG:3857'))
-        layers.append(layer)
-    if len(layers):
-        xml = QgsMapLayer.asLayerDefinition(layers)
-        maplayers = "\n".join(xml.toString().split("\n")[3:-3])
-        layer_tree_layer = ""
-        custom_order = ""
-        legend_layer = ""
-        layer_coordinate_transform = ""
-        for layer in layers:
-            is_visible = layer.name() in visible_maps
-            values = {'name': layer.name(), 'id': layer.id(), 'visible': ('1' if is_visible else '0'), 'checked': ('Qt::Checked' if is_visible else 'Qt::Unchecked')}
-            custom_order += "<item>%s</item>" % layer.id()
-            layer_tree_layer += """
-            <layer-tree-layer expanded="1" checked="%(checked)s" id="%(id)s" name="%(name)s">
-                <customproperties/>
-            </layer-tree-layer>""" % values
-            legend_layer += """
-            <legendlayer drawingOrder="-1" open="true" checked="%(checked)s" name="%(name)s" showFeatureCount="0">
-              <filegroup open="true" hidden="false">
-                <legendlayerfile isInOverview="0" layerid="%(id)s" visible="%(visible)s"/>
-              </filegroup>
-            </legendlayer>""" % values
-            layer_coordinate_transform += '<layer_coordinate_transform destAuthId="EPSG:3857" srcAuthId="EPSG:3857" srcDatumTransform="-1" destDatumTransform="-1" layerid="%s"/>' % layer.id()
-        tpl = ""
-        with open(project_template, 'rb') as f:
-            tpl = f.read()
-        for tag in ['custom_order', 'layer_tree_layer', 'legend_layer', 'layer_coordinate_transform', 'maplayers']:
-            tpl = tpl.replace("#%s#" % tag.upper(), locals()[tag])
-        return tpl
+        zoom = renderer.zoom_limits(m)
+        set_zoom_limits(layer, *zoom)
+        xml = QgsMapLayer.asLayerDefinition([layer])
+        layers.append({
+            'id': layer.id(),
+            'name': layer.name(),
+            'datasource': layer.source(),
+            'zoom': zoom,
+            'xml': "\n".join(xml.toString().split("\n")[3:-3]),
+        })
+    return layers
+
+
+def is_placeholder(node):
+    """Check wether the layer tree node is a placeholder for a basemap
+    written by render_project() in lazy mode"""
+    return (QgsLayerTree.isGroup(node) and
+            bool(node.customProperty(renderer.PLACEHOLDER_PROPERTY, '')))
+
+
+def load_placeholder(node):
+    """Create the basemap layer of a placeholder layer tree node and
+    replace the node with the new layer, return the layer"""
+    parent = node.parent()
+    if parent is None:  # Already loaded or removed
+        return None
+    with perf.span('layer.load_placeholder'):
+        layer = QgsRasterLayer(node.customProperty(renderer.PLACEHOLDER_PROPERTY),
+                               node.name(), 'wms')
+        layer.setCrs(QgsCoordinateReferenceSystem('EPSG:3857'))
+        set_zoom_limits(layer, *[_int_or_none(node.customProperty(key, ''))
+                                 for key in (renderer.MIN_ZOOM_PROPERTY,
+                                             renderer.MAX_ZOOM_PROPERTY)])
+        if QgsMapLayerRegistry is not None:
+            QgsMapLayerRegistry.instance().addMapLayer(layer, False)
+        else:
+            QgsProject.instance().addMapLayer(layer, False)
+        parent.insertLayer(parent.children().index(node), layer)
+        parent.removeChildNode(node)
+    return layer
+
+
+def layer_registry():
+    """Return the registry of the map layers of the project"""
+    if QgsMapLayerRegistry is not None:
+        return QgsMapLayerRegistry.instance()
+    return QgsProject.instance()
+
+
+def set_layer_source(layer, source):
+    """Replace the data source of the layer, QGIS 2 has no API for it:
+    the layer is written to XML and read again"""
+    if hasattr(layer, 'setDataSource'):
+        layer.setDataSource(source, layer.name(), layer.providerType())
+        return
+    doc = QDomDocument()
+    element = doc.createElement('maplayer')
+    layer.writeLayerXML(element, doc)
+    _set_text(doc, element.firstChildElement('datasource'), source)
+    layer.readLayerXML(element)
+    layer.triggerRepaint()
+
+
+def replace_project_sources(doc, sources, scales=None):
+    """Replace the data sources of the layers in the project document
+    doc, sources is a dictionary of layer id: data source and scales a
+    dictionary of layer id: scale based visibility (see layer_scale())"""
+    names = ('minScale', 'maxScale') if QGIS3 else ('minimumScale', 'maximumScale')
+    maplayers = doc.elementsByTagName('maplayer')
+    for i in range(maplayers.count()):
+        element = maplayers.at(i).toElement()
+        layer_id = element.firstChildElement('id').text()
+        source = sources.get(layer_id)
+        if source is not None:
+            _set_text(doc, element.firstChildElement('datasource'), source)
+        scale = (scales or {}).get(layer_id)
+        if scale is not None:
+            element.setAttribute('hasScaleBasedVisibilityFlag', str(int(scale[0])))
+            element.setAttribute(names[0], repr(scale[1]))
+            element.setAttribute(names[1], repr(scale[2]))
+
+
+def _set_text(doc, element, text):
+    while element.hasChildNodes():
+        element.removeChild(element.firstChild())
+    element.appendChild(doc.createTextNode(text))
+
+
+def layer_scale(layer):
+    """Return the scale based visibility of the layer: the flag, the
+    minimum and the maximum scale"""
+    return layer.hasScaleBasedVisibility(), layer.minimumScale(), layer.maximumScale()
+
+
+def set_layer_scale(layer, scale):
+    """Restore the scale based visibility returned by layer_scale()"""
+    layer.setScaleBasedVisibility(scale[0])
+    layer.setMinimumScale(scale[1])
+    layer.setMaximumScale(scale[2])
+
+
+def set_zoom_limits(layer, zmin, zmax):
+    """Set the scale based visibility of the layer from its zoom limits"""
+    minimum_scale, maximum_scale = renderer.scale_range(zmin, zmax)
+    if minimum_scale is None and maximum_scale is None:
+        return
+    layer.setScaleBasedVisibility(True)
+    if QGIS3:
+        # Swapped meaning, 0 is no limit
+        layer.setMinimumScale(maximum_scale or 0)
+        layer.setMaximumScale(minimum_scale or 0)
     else:
+        layer.setMinimumScale(minimum_scale or 0)
+        layer.setMaximumScale(maximum_scale or 1e8)
+
+
+@perf.timed('prefetch.plan')
+def print_layout_plan(compositions, canvas_layers, routes=None):
+    """Return the prefetch.PrefetchPlan of the XYZ layers of the map items
+    of the compositions, for every atlas page. canvas_layers are the ids of
+    the layers of the map items which do not keep their own layer set.
+    routes are the routes of the tile proxy.
+    Only the compositions of the QGIS 2 print composer are supported, the
+    plan is empty on QGIS 3"""
+    plan = prefetch.PrefetchPlan(routes)
+    if QgsComposerMap is None:
+        return plan
+    for composition in compositions:
+        atlas = composition.atlasComposition()
+        if not atlas.enabled():
+            _add_layout_page(plan, composition, canvas_layers)
+            continue
+        atlas.beginRender()
+        try:
+            for i in range(atlas.numFeatures()):
+                atlas.prepareForFeature(i)
+                _add_layout_page(plan, composition, canvas_layers)
+        finally:
+            atlas.endRender()
+    return plan
+
+
+def _add_layout_page(plan, composition, canvas_layers):
+    """Add the XYZ layers of the map items of the current page to plan"""
+    plan.pages += 1
+    transform = QgsCoordinateTransform(composition.mapSettings().destinationCrs(),
+                                       QgsCoordinateReferenceSystem('EPSG:3857'))
+    for item in composition.items():
+        if not isinstance(item, QgsComposerMap):
+            continue
+        extent = transform.transformBoundingBox(item.extent())
+        # Item size in mm
+        width = item.rect().width() / 25.4 * composition.printResolution()
+        for layer_id in (item.layerSet() if item.keepLayerSet() else canvas_layers):
+            layer = QgsMapLayerRegistry.instance().mapLayer(layer_id)
+            if layer is None or layer.type() != QgsMapLayer.RasterLayer:
+                continue
+            plan.add(layer.source(), (extent.xMinimum(), extent.yMinimum(),
+                                      extent.xMaximum(), extent.yMaximum()), width, layer.name())
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
         return None
 
 
-def layer_is_supported(lyr):
+def supported_tile_formats():
+    """Return the set of the catalog tile formats which can be decoded by
+    the local Qt build"""
+    global _supported_tile_formats
+    if _supported_tile_formats is None:
+        readable = set()
+        for f in QImageReader.supportedImageFormats():
+            f = f.data()
+            if isinstance(f, bytes):
+                f = f.decode('ascii')
+            readable.add(f.lower())
+        _supported_tile_formats = set(k for k, v in TILE_FORMATS.items() if v in readable)
+    return _supported_tile_formats
+
+
+def layer_is_supported(lyr, formats=None):
     """Check wether the layer is supported by QGIS or by this plugin
-    by excluding vector tiles"""
-    return (lyr['tileFormat'] == 'PNG' and
+    by excluding vector tiles and the tile formats which can't be decoded,
+    formats defaults to supported_tile_formats()"""
+    if formats is None:
+        formats = supported_tile_formats()
+    return ((lyr['tileFormat'] or '').upper() in formats and
             lyr['standard'] == 'XYZ')
 
 
-def get_available_providers(providers_uri):
+def prefer_formats(maps, preference=DEFAULT_FORMAT_PREFERENCE):
+    """Keep only one variant of the maps with the same name: the one with
+    the tile format coming first in preference (smallest tiles first),
+    formats not in preference come last. The catalog order is kept"""
+    rank = dict((f.upper(), i) for i, f in enumerate(preference))
+    best = {}
+    for m in maps:
+        r = rank.get(m['tileFormat'].upper(), len(rank))
+        if m['name'] not in best or r < best[m['name']][0]:
+            best[m['name']] = (r, m)
+    return [m for m in maps if best[m['name']][1] is m]
+
+
+def parse_format_preference(value):
+    """Parse the ### separated tile_formats setting"""
+    formats = [f.strip().upper() for f in (value or '').split('###') if f.strip()]
+    return formats or DEFAULT_FORMAT_PREFERENCE
+
+
+def get_available_providers(providers_uri, cache_ttl=None):
     """Fetch the list of available providers from BCS endpoint,
-    apparently this API method does not require auth"""
+    apparently this API method does not require auth.
+    If cache_ttl is not None, a cached copy younger than cache_ttl seconds
+    is used instead of the network"""
     # For testing purposes, we can also access to a json file directly
     if not providers_uri.startswith('http'):
-        try:
-            j = json.load(open(providers_uri, encoding='utf-8'))
-        except:
-            j = json.load(open(providers_uri))
+        with perf.span('providers.parse') as s:
+            try:
+                j = json.load(open(providers_uri, encoding='utf-8'))
+            except:
+                j = json.load(open(providers_uri))
+            s.set(items=len(j))
     else:
-        t = mktemp()
-        q = QgsFileDownloader(QUrl(providers_uri), t)
-        loop = QEventLoop()
-        q.downloadExited.connect(loop.quit)
-        loop.exec_()
-        if not os.path.isfile(t):
+        j = _fetch_json(providers_uri, 'providers', cache_ttl)
+        if j is None:
             return []
-        with open(t) as f:
-            j = json.load(f)
-        os.unlink(t)
     return j
 
 
-def get_available_maps(maps_uri):
+def get_available_maps(maps_uri, cache_ttl=None, format_preference=None):
     """Fetch the list of available and QGIS supported maps from BCS endpoint,
-    apparently this API method does not require auth"""
+    apparently this API method does not require auth.
+    If cache_ttl is not None, a cached copy younger than cache_ttl seconds
+    is used instead of the network.
+    If format_preference is not None, only the preferred tile format of
+    the variants of the same map is kept, see prefer_formats()"""
     # For testing purposes, we can also access to a json file directly
     if not maps_uri.startswith('http'):
-        j = json.load(open(maps_uri))
+        with perf.span('catalog.parse', bytes=os.path.getsize(maps_uri)) as s:
+            j = json.load(open(maps_uri))
+            s.set(items=len(j))
     else:
-        t = mktemp()
-        q = QgsFileDownloader(QUrl(maps_uri), t)
-        loop = QEventLoop()
-        q.downloadExited.connect(loop.quit)
-        loop.exec_()
-        if not os.path.isfile(t):
+        j = _fetch_catalog(maps_uri, cache_ttl)
+        if j is None:
             return []
-        with open(t) as f:
+    return _filter_maps(j, format_preference)
+
+
+def _filter_maps(j, format_preference=None):
+    """Return the QGIS supported maps of the catalog j"""
+    with perf.span('catalog.filter', items=len(j)) as s:
+        formats = supported_tile_formats()
+        maps = [l for l in j if layer_is_supported(l, formats)]
+        if format_preference is not None:
+            maps = prefer_formats(maps, format_preference)
+        s.set(supported=len(maps))
+    return maps
+
+
+def merge_sources(maps_uri, maps, providers, results, format_preference=None):
+    """Merge the Basemaps catalog (maps and providers of maps_uri) with the
+    results of federation.SourceFetcher, the maps of the sources are
+    filtered like get_available_maps(). Return the maps and the providers"""
+    catalogs = [(federation.tag_source(maps or [], maps_uri), providers)]
+    for uri, source_maps, source_providers, error in results:
+        if error is None:
+            catalogs.append((_filter_maps(source_maps, format_preference), source_providers))
+    with perf.span('catalog.merge', sources=len(catalogs)) as s:
+        maps, providers = federation.merge(catalogs)
+        s.set(items=len(maps))
+    return maps, providers
+
+
+def get_local_catalog(maps_uri, providers_uri, format_preference=None):
+    """Return the maps (filtered like get_available_maps()) and the
+    providers available without the network: the local copy of the
+    catalog whatever its age or the snapshot bundled with the plugin, or
+    the catalog file if maps_uri is a local file.
+    Return (None, None) if there are none.
+    A versioned snapshot seeds the local copy, so that the next
+    catalog fetch only downloads the changes"""
+    if not maps_uri.startswith('http'):
+        # For testing purposes: the catalog file is read at once
+        providers = None
+        if providers_uri and not providers_uri.startswith('http'):
+            providers = get_available_providers(providers_uri)
+        return get_available_maps(maps_uri, format_preference=format_preference), providers or []
+    store = catalogsync.CatalogStore(cache_path(maps_uri))
+    version, maps = store.load()
+    providers = None
+    cached_providers = cache_path(providers_uri)
+    if os.path.isfile(cached_providers):
+        try:
+            providers = _read_cached_json(cached_providers, 'providers.cache')
+        except ValueError:
+            pass
+    if maps is None:
+        with perf.span('snapshot.load') as s:
+            snap = snapshot.read()
+            s.set(items=len(snap['maps']) if snap is not None else 0)
+        if snap is None:
+            return None, None
+        maps = snap['maps']
+        providers = providers or snap['providers']
+        if snap['version'] is not None:
+            store.save(snap['version'], maps)
+            os.utime(store.path, (snap['created'], snap['created']))
+    return _filter_maps(maps, format_preference), providers or []
+
+
+def _fetch_json(uri, kind, cache_ttl=None):
+    """Download and parse the JSON document at uri and store it in the cache,
+    if cache_ttl is not None and the cached copy is younger than cache_ttl
+    seconds, the network is not used.
+    The download follows the fetch policy, if it fails (or the circuit of
+    the endpoint is open) the cached copy is used whatever its age.
+    Return None on failure"""
+    cached = cache_path(uri)
+    if (cache_ttl is not None and os.path.isfile(cached) and
+            time.time() - os.path.getmtime(cached) < cache_ttl):
+        return _read_cached_json(cached, '%s.cache' % kind)
+    try:
+        with perf.span('%s.download' % kind) as s:
+            body, j = _fetch(uri, parse=_parse_json)
+            s.set(bytes=len(body), items=len(j))
+    except fetchpolicy.FetchError:
+        if not os.path.isfile(cached):
+            return None
+        return _read_cached_json(cached, '%s.stale' % kind)
+    fileutils.atomic_write(cached, body)
+    return j
+
+
+def _fetch_catalog(uri, cache_ttl=None):
+    """Return the maps catalog at uri like _fetch_json(), the local copy
+    is synced with the changes since its version if the endpoint
+    supports it (see catalogsync), else the full catalog is downloaded"""
+    store = catalogsync.CatalogStore(cache_path(uri))
+    version, maps = store.load()
+    if (cache_ttl is not None and maps is not None and
+            store.age(time.time()) < cache_ttl):
+        with perf.span('catalog.cache', items=len(maps)):
+            return maps
+    try:
+        with perf.span('catalog.download') as s:
+            if version is not None:
+                try:
+                    body, reply = _fetch(uri, parse=_parse_json,
+                                         params={catalogsync.SINCE_PARAM: version})
+                    new_version, new_maps, is_delta = catalogsync.apply_reply(maps, reply)
+                except (fetchpolicy.CircuitOpen, fetchpolicy.TransientError):
+                    # The endpoint is struggling: no full fetch, the local
+                    # copy is used
+                    raise
+                except (fetchpolicy.FetchError, ValueError):
+                    # Deltas not supported after all: full fetch
+                    version = None
+            if version is None:
+                body, reply = _fetch(uri, parse=_parse_json)
+                new_version, new_maps, is_delta = catalogsync.apply_reply(None, reply)
+            s.set(bytes=len(body), items=len(new_maps), delta=is_delta)
+    except (fetchpolicy.FetchError, ValueError):
+        if maps is None:
+            return None
+        with perf.span('catalog.stale', items=len(maps)):
+            return maps
+    if is_delta and not catalogsync.delta_size(reply) and new_version == version:
+        store.touch()
+    else:
+        store.save(new_version, new_maps)
+    return new_maps
+
+
+def _read_cached_json(cached, span_name):
+    with perf.span(span_name, bytes=os.path.getsize(cached)) as s:
+        with open(cached) as f:
             j = json.load(f)
-        os.unlink(t)
-    return [l for l in j if layer_is_supported(l)]
+        s.set(items=len(j))
+    return j
@@ -212,6 +212,49 @@ def builddocs(options):
                                               options.sphinx.builddir))
 
 
+@task
+@cmdopts([
+    ('output=', 'o', 'JSON file for the benchmark results'),
+    ('sizes=', 's', 'Comma separated list of synthetic catalog sizes'),
+    ('compare=', 'c', 'Previous JSON results to check for regressions'),
+    ('wizard', 'w', 'Run the offscreen setup wizard benchmarks instead'),
+])
+def benchmark(options):
+    """Run the catalog and default project benchmarks"""
+    args = []
+    for opt in ('output', 'sizes', 'compare'):
+        value = getattr(options, opt, None)
+        if value:
+            args.append('--%s=%s' % (opt, value))
+    module = 'wizard_benchmarks' if getattr(options, 'wizard', False) else 'benchmarks'
+    sh('%s -m %s.tests.%s %s' % (sys.executable, options.plugin.name, module,
+                                 ' '.join(args)))
+
+
+@task
+@cmdopts([
+    ('maps-uri=', 'm', 'Catalog URI, defaults to the maps_uri plugin setting'),
+    ('providers-uri=', 'p', 'Providers URI, defaults to the providers_uri plugin setting'),
+])
+def snapshot(options):
+    """Regenerate the catalog snapshot bundled with the plugin"""
+    sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+    from boundlessbasemaps import catalogsync, snapshot as catalog_snapshot
+    with open(options.plugin.source_dir / 'settings.json') as f:
+        defaults = dict((s['name'], s['default']) for s in json.load(f))
+    maps_uri = getattr(options, 'maps_uri', None) or defaults['maps_uri'].split('###')[0]
+    providers_uri = getattr(options, 'providers_uri', None) or defaults['providers_uri'].split('###')[0]
+    r = requests.get(maps_uri)
+    r.raise_for_status()
+    version, maps, is_delta = catalogsync.apply_reply(None, r.json())
+    r = requests.get(providers_uri)
+    r.raise_for_status()
+    providers = r.json()
+    size = catalog_snapshot.write(catalog_snapshot.SNAPSHOT_FILE, maps, providers, version)
+    info('%d maps and %d providers written to %s (%d bytes)' % (
+        len(maps), len(providers), catalog_snapshot.SNAPSHOT_FILE, size))
+
+
 @task
 def install_devtools():
     """Install development tools"""